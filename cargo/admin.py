@@ -1,14 +1,261 @@
+import datetime
+import functools
+
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.db import models, transaction
+from django.utils import timezone
+from django.utils.html import format_html
 
 # Register your models here.
 
-from cargo.models import CompanyType, Company, Facility, Employee, Cargo, PickupOrder, Lumper
+from cargo.models import CompanyType, Company, Facility, Employee, Cargo, CargoEvent, PickupOrder, Lumper, Job, DeadJob
+from cargo import jobs
+from cargo.images import IMAGE_FIELDS
+from cargo.pagination import EstimatedCountPaginator
+
+# Foreign keys to the employees and facilities are edited with autocomplete widgets, which search
+# the search_fields of their admins, and those to the (large) cargo tables with raw id inputs, so
+# no change form renders a whole table into a <select>. The changelists of the tables that grow
+# with the cargos are ordered by indexed columns and count with EstimatedCountPaginator, without
+# the second, unfiltered count of the admin's "N total" link.
+
+
+class IndexedDatesQuerySet(models.QuerySet):
+    """
+    QuerySet whose datetimes() tells which years, months or days have rows with one range
+    probe each (answered by an index on the field), all in a single query, instead of
+    truncating the date of every row as the admin's date hierarchy otherwise does.
+    """
+
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None, is_dst=None):
+        if kind not in ('year', 'month', 'day'):
+            return super(IndexedDatesQuerySet, self).datetimes(field_name, kind, order, tzinfo, is_dst)
+        bounds = self.aggregate(first=models.Min(field_name), last=models.Max(field_name))
+        if bounds['first'] is None:
+            return []
+        tzinfo = tzinfo or timezone.get_current_timezone()
+        first, last = timezone.localtime(bounds['first'], tzinfo), timezone.localtime(bounds['last'], tzinfo)
+        starts = [datetime.datetime(first.year, first.month if kind != 'year' else 1, first.day if kind == 'day' else 1)]
+        while True:
+            following = _next_period(starts[-1], kind)
+            if following > last.replace(tzinfo=None):
+                break
+            starts.append(following)
+        periods = [(timezone.make_aware(start, tzinfo), timezone.make_aware(_next_period(start, kind), tzinfo)) for start in starts]
+        probes = {
+            'period_{0}'.format(index): models.Exists(self.filter(**{field_name + '__gte': start, field_name + '__lt': end}))
+            for index, (start, end) in enumerate(periods)
+        }
+        found = self.model._base_manager.using(self.db).order_by().annotate(**probes).values(*probes)[0]
+        periods = [start for index, (start, _) in enumerate(periods) if found['period_{0}'.format(index)]]
+        return periods[::-1] if order == 'DESC' else periods
+
+
+def _next_period(start, kind):
+    if kind == 'day':
+        return start + datetime.timedelta(days=1)
+    if kind == 'month' and start.month < 12:
+        return start.replace(month=start.month + 1)
+    return start.replace(year=start.year + 1, month=1 if kind == 'month' else start.month)
+
+
+class IndexedDatesChangeList(ChangeList):
+    """
+    ChangeList whose date hierarchy reads the rows through IndexedDatesQuerySet (mixed into
+    the model's own QuerySet class, whose methods the admin actions may use).
+    """
+
+    def get_queryset(self, request):
+        queryset = super(IndexedDatesChangeList, self).get_queryset(request)
+        indexed = queryset._chain()
+        indexed.__class__ = _indexed_dates(type(queryset))
+        return indexed
+
+
+@functools.lru_cache(maxsize=None)
+def _indexed_dates(queryset_class):
+    return type('IndexedDates' + queryset_class.__name__, (IndexedDatesQuerySet, queryset_class), {})
+
+
+@admin.register(CompanyType)
+class CompanyTypeAdmin(admin.ModelAdmin):
+    list_display = ('type',)
+    search_fields = ('type',)
+
+
+@admin.register(Company)
+class CompanyAdmin(admin.ModelAdmin):
+    list_display = ('name', 'type')
+    list_filter = ('type',)
+    list_select_related = ('type',)
+    search_fields = ('name',)
+    autocomplete_fields = ('type',)
+
+
+@admin.register(Facility)
+class FacilityAdmin(admin.ModelAdmin):
+    list_display = ('name', 'company', 'address', 'phone', 'latitude', 'longitude')
+    list_select_related = ('company',)
+    readonly_fields = ('latitude', 'longitude')
+    search_fields = ('name', 'address')
+    autocomplete_fields = ('company',)
+
+
+@admin.register(Employee)
+class EmployeeAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'company', 'phone')
+    search_fields = ('user__username', 'user__first_name', 'user__last_name')
+    autocomplete_fields = ('user', 'company')
+
+    def get_queryset(self, request):
+        return super(EmployeeAdmin, self).get_queryset(request).with_names()
+
+
+def transition_action(status):
+    """
+    Returns an admin action moving the selected cargos that are in the status right before
+    `status` to it, through Cargo.transition (so each move is logged as a CargoEvent).
+    """
+    label = dict(Cargo.CARGO_STATUS)[status]
+
+    def move(modeladmin, request, queryset):
+        employee = Employee.objects.filter(user=request.user).first()
+        moved = Cargo.objects.filter(pk__in=queryset.values('pk')).transition(status, employee=employee)
+        skipped = queryset.count() - len(moved)
+        message = '{0} cargos moved to {1}.'.format(len(moved), label)
+        if skipped:
+            message += ' {0} were not {1} and were left alone.'.format(skipped, dict(Cargo.CARGO_STATUS)[Cargo.PREVIOUS_STATUS[status]])
+        modeladmin.message_user(request, message)
+    move.__name__ = 'move_to_{0}'.format(label.lower().replace(' ', '_'))
+    move.short_description = 'Move the selected cargos to {0}'.format(label)
+    move.allowed_permissions = ('change',)
+    return move
+
+
+@admin.register(Cargo)
+class CargoAdmin(admin.ModelAdmin):
+    """
+    The status and the timestamps of its changes are only changed with the actions, which go
+    through the state machine (see Cargo.transition): the forms cannot skip or undo a step.
+    """
+    list_display = ('id', 'description', 'price', 'status', 'broker', 'dispatcher', 'posted', 'delivered')
+    list_display_links = ('id', 'description')
+    # Both answered by the cargo_posted_id_idx and cargo_open_posted_idx indexes
+    list_filter = ('status',)
+    date_hierarchy = 'posted'
+    ordering = ('-posted', '-id')
+    search_fields = ('=id', 'description')
+    autocomplete_fields = ('broker', 'dispatcher', 'driver')
+    readonly_fields = ('status', 'negotiated', 'assigned', 'delivered')
+    actions = [transition_action(status) for status in Cargo.PREVIOUS_STATUS]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return IndexedDatesChangeList
+
+    def get_queryset(self, request):
+        return super(CargoAdmin, self).get_queryset(request).with_parties()
+
+
+@admin.register(CargoEvent)
+class CargoEventAdmin(admin.ModelAdmin):
+    """
+    The event log is append-only: events can be browsed but not edited or deleted here.
+    """
+    list_display = ('cargo_id', 'from_status', 'to_status', 'occurred', 'employee')
+    list_filter = ('to_status',)
+    list_select_related = ('employee__user',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'queue', 'run_at', 'attempts', 'max_attempts', 'locked_by', 'created')
+    list_filter = ('queue', 'name')
+    readonly_fields = ('attempts', 'locked_by', 'last_error', 'created')
+
+
+@admin.register(DeadJob)
+class DeadJobAdmin(admin.ModelAdmin):
+    """
+    Jobs that failed all their attempts. Fix the cause, then queue them again with the action.
+    """
+    list_display = ('name', 'queue', 'attempts', 'created', 'failed')
+    list_filter = ('queue', 'name')
+    readonly_fields = ('queue', 'name', 'kwargs', 'attempts', 'error', 'created', 'failed')
+    actions = ['requeue']
+
+    def has_add_permission(self, request):
+        return False
+
+    def requeue(self, request, queryset):
+        with transaction.atomic():
+            for dead in queryset:
+                jobs.enqueue(dead.name, queue=dead.queue, **dead.kwargs)
+            count = queryset.delete()[0]
+        self.message_user(request, '{0} jobs queued again.'.format(count))
+    requeue.short_description = 'Queue the selected jobs again'
+
+
+def thumbnail(model, field_name, description):
+    """
+    Returns an admin column/read-only field showing an image's thumbnail, linked to the full image.
+    """
+    prefix = IMAGE_FIELDS[model][field_name]
+
+    def preview(modeladmin, obj):
+        image, small = getattr(obj, field_name), getattr(obj, prefix + '_thumbnail')
+        if not image:
+            return '-'
+        if not small:
+            return format_html('<a href="{0}">processing</a>', image.url)
+        return format_html('<a href="{0}"><img src="{1}" style="max-height: 80px"></a>', image.url, small.url)
+    preview.short_description = description
+    return preview
+
+
+@admin.register(PickupOrder)
+class PickupOrderAdmin(admin.ModelAdmin):
+    bol_preview = thumbnail(PickupOrder, 'bol_image', 'BOL')
+    pod_preview = thumbnail(PickupOrder, 'pod_image', 'POD')
+    list_display = ('__str__', 'loaded', 'delivered', 'bol_preview', 'pod_preview')
+    readonly_fields = ('bol_preview', 'bol_width', 'bol_height', 'bol_bytes', 'pod_preview', 'pod_width', 'pod_height', 'pod_bytes')
+    ordering = ('-id',)
+    raw_id_fields = ('cargo',)
+    autocomplete_fields = ('pickup_from', 'deliver_to')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super(PickupOrderAdmin, self).get_queryset(request).with_facilities()
+
+
+@admin.register(Lumper)
+class LumperAdmin(admin.ModelAdmin):
+    image_preview = thumbnail(Lumper, 'image', 'Image')
+    list_display = ('__str__', 'requested', 'paid', 'image_preview')
+    readonly_fields = ('image_preview', 'image_width', 'image_height', 'image_bytes')
+    # Answered by the cargo_lumper_requested_idx index
+    date_hierarchy = 'requested'
+    ordering = ('-requested', '-id')
+    raw_id_fields = ('pickup_order',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
+    def get_changelist(self, request, **kwargs):
+        return IndexedDatesChangeList
 
-admin.site.register(CompanyType)
-admin.site.register(Company)
-admin.site.register(Facility)
-admin.site.register(Employee)
-admin.site.register(Cargo)
-admin.site.register(PickupOrder)
-admin.site.register(Lumper)
\ No newline at end of file
+    def get_queryset(self, request):
+        return super(LumperAdmin, self).get_queryset(request).with_pickup_order()
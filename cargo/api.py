@@ -0,0 +1,217 @@
+"""
+Read-only JSON API over cargos, pickup orders, companies and facilities.
+
+    GET /cargo/api/<resource>/?fields=id,status&status=p&from=2018-10-01&cursor=...
+    GET /cargo/api/<resource>/<id>?fields=...
+
+- Reading a resource takes the view permission of its model (e.g. cargo.view_cargo);
+  anonymous users and users without it get 403 Forbidden.
+- fields= picks the columns returned, and only those are selected (values()).
+- Lists are filtered with the resource's filters (e.g. status, broker and the
+  from/to dates for cargos), and paged with the keyset CursorPaginator through
+  next/previous links. limit= sets the page size.
+- Responses carry a strong ETag and a Last-Modified built from the newest
+  'updated' timestamp and the row count of the filtered rows, both read with
+  one aggregate query. A client that sends them back (If-None-Match /
+  If-Modified-Since) gets 304 Not Modified without the rows being read.
+
+Every field is a column of the resource's own table (related objects are
+given by id), so a change to a row always moves its 'updated' timestamp.
+"""
+import datetime
+import decimal
+import hashlib
+
+from django.core.exceptions import FieldError, ValidationError
+from django.db.models import Count, Max
+from django.utils.http import http_date
+
+from cargo import exports
+from cargo.models import Cargo, PickupOrder, Company, Facility
+from cargo.pagination import CursorPaginator
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT     = 500
+
+
+class Resource(object):
+    """
+    An API resource: its fields as name -> lookup, its default fields, the ordering
+    it is paged by, its filters as query parameter -> lookup, and optionally the
+    date field the from/to parameters apply to and the cargo status lookup.
+    """
+
+    def __init__(self, model, fields, ordering, filters=None, date_field=None, status_field=None, default_fields=None):
+        self.model          = model
+        self.fields         = fields
+        self.ordering       = ordering
+        self.filters        = filters or {}
+        self.date_field     = date_field
+        self.status_field   = status_field
+        self.default_fields = default_fields or list(fields)
+
+    def projection(self, fields_param):
+        """
+        Returns the field names asked for in a 'fields' parameter (the defaults when empty).
+        Raises ValueError for unknown fields.
+        """
+        if not fields_param:
+            return self.default_fields
+        names = [name.strip() for name in fields_param.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise ValueError('Unknown fields: {0}. Available: {1}'.format(', '.join(unknown), ', '.join(self.fields)))
+        return names
+
+    def queryset(self, params):
+        """
+        Returns the rows matching the filters in the query parameters. Raises ValueError for invalid filters.
+        """
+        queryset = self.model.objects.order_by()
+        if self.date_field or self.status_field:
+            filters = exports.parse_filters({key: params.get(key) for key in ('from', 'to', 'status')})
+            if self.date_field and filters.get('start'):
+                queryset = queryset.filter(**{self.date_field + '__gte': exports._start_of(filters['start'])})
+            if self.date_field and filters.get('end'):
+                queryset = queryset.filter(**{self.date_field + '__lt': exports._start_of(filters['end'] + datetime.timedelta(days=1))})
+            if self.status_field and filters.get('status'):
+                queryset = queryset.filter(**{self.status_field: filters['status']})
+        for param, lookup in self.filters.items():
+            value = params.get(param)
+            if value:
+                queryset = queryset.filter(**{lookup: value})
+        return queryset
+
+    def version(self, queryset):
+        """
+        Returns (newest updated timestamp, row count) of the rows, in one aggregate query.
+        Raises ValueError if a filter value does not suit its field.
+        """
+        try:
+            result = queryset.aggregate(updated=Max('updated'), count=Count('pk'))
+        except (ValidationError, FieldError, TypeError) as e:
+            raise ValueError(e)
+        return result['updated'], result['count']
+
+    def rows(self, queryset, names):
+        """
+        Projects the queryset onto the given fields (plus the ordering keys, for the cursor).
+        """
+        lookups = list(dict.fromkeys([self.fields[name] for name in names] + [key.lstrip('-') for key in self.ordering]))
+        return queryset.values(*lookups)
+
+    def serialize(self, row, names):
+        return {name: _json_value(row[self.fields[name]]) for name in names}
+
+    def paginator(self, queryset, names, limit):
+        return CursorPaginator(self.rows(queryset, names), limit, self.ordering)
+
+
+RESOURCES = {
+    'cargos': Resource(Cargo, {
+        'id': 'id',
+        'description': 'description',
+        'price': 'price',
+        'price_currency': 'price_currency',
+        'status': 'status',
+        'broker': 'broker_id',
+        'dispatcher': 'dispatcher_id',
+        'driver': 'driver_id',
+        'posted': 'posted',
+        'negotiated': 'negotiated',
+        'assigned': 'assigned',
+        'delivered': 'delivered',
+        'updated': 'updated',
+    }, ordering=('-posted', '-id'), filters={
+        'broker': 'broker_id',
+        'dispatcher': 'dispatcher_id',
+        'driver': 'driver_id',
+    }, date_field='posted', status_field='status'),
+    'pickups': Resource(PickupOrder, {
+        'id': 'id',
+        'cargo': 'cargo_id',
+        'pickup_from': 'pickup_from_id',
+        'deliver_to': 'deliver_to_id',
+        'loaded': 'loaded',
+        'delivered': 'delivered',
+        'bol_image': 'bol_image',
+        'pod_image': 'pod_image',
+        'updated': 'updated',
+    }, ordering=('-id',), filters={
+        'cargo': 'cargo_id',
+        'broker': 'cargo__broker_id',
+        'pickup_from': 'pickup_from_id',
+        'deliver_to': 'deliver_to_id',
+    }, date_field='loaded', status_field='cargo__status'),
+    'companies': Resource(Company, {
+        'id': 'id',
+        'name': 'name',
+        'type': 'type__type',
+        'updated': 'updated',
+    }, ordering=('name',), filters={
+        'type': 'type__type__iexact',
+    }),
+    'facilities': Resource(Facility, {
+        'id': 'id',
+        'name': 'name',
+        'company': 'company_id',
+        'address': 'address',
+        'latitude': 'latitude',
+        'longitude': 'longitude',
+        'phone': 'phone',
+        'updated': 'updated',
+    }, ordering=('id',), filters={
+        'company': 'company_id',
+    }),
+}
+
+
+def etag(request, updated, count):
+    """
+    Returns a strong ETag for a response built from rows with the given version,
+    varying on the path and query parameters.
+    """
+    digest = hashlib.sha1()
+    digest.update(request.path.encode())
+    digest.update(repr(sorted(request.GET.lists())).encode())
+    digest.update('{0}|{1}'.format(updated.isoformat() if updated else '', count).encode())
+    return '"{0}"'.format(digest.hexdigest())
+
+
+def last_modified(updated):
+    """
+    Returns the timestamp (in whole seconds, as HTTP dates are) for the Last-Modified header.
+    """
+    return int(updated.timestamp()) if updated else None
+
+
+def limit(params):
+    """
+    Returns the page size from the 'limit' parameter. Raises ValueError if it is not valid.
+    """
+    value = params.get('limit')
+    if not value:
+        return DEFAULT_LIMIT
+    value = int(value)
+    if not 1 <= value <= MAX_LIMIT:
+        raise ValueError('limit must be between 1 and {0}'.format(MAX_LIMIT))
+    return value
+
+
+def set_validators(response, tag, updated):
+    response['ETag'] = tag
+    if updated:
+        response['Last-Modified'] = http_date(last_modified(updated))
+    # Clients may keep the response but must check it is still current before using it
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _json_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
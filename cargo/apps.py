@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class CargoConfig(AppConfig):
     name = 'cargo'
+
+    def ready(self):
+        # Connect the signal handlers (dashboard counters, etc.)
+        import cargo.signals  # noqa: F401
@@ -0,0 +1,139 @@
+"""
+Archival of delivered cargos.
+
+Cargos delivered more than settings.CARGO_ARCHIVE_AFTER_DAYS ago are moved,
+with their events, pickup orders and lumpers, from the live tables into the
+archive tables (ArchivedCargo, ArchivedCargoEvent, ArchivedPickupOrder and
+ArchivedLumper), keeping their ids. So the live tables, their indexes and
+everything reading them through the default managers (lists, load board,
+matching, API, admin) only hold the cargos still in use, and the history is
+read explicitly through the archive models, or through lookup().
+
+archive() works in batches of cargos, each moved in its own short
+transaction: the batch's rows are copied with INSERT ... SELECT and deleted
+with plain DELETEs, so no row is loaded into Python and no signal is sent.
+On PostgreSQL the batch's cargos are locked with SKIP LOCKED, so cargos a
+request is changing are left for the next run instead of waiting for it.
+
+What the signals would otherwise keep up to date is unaffected or handled
+here: the dashboard counters and the daily rollups count the archived rows
+too (see cargo.counters and cargo.rollups), the search documents of the
+archived cargos are dropped, and their cached pages are invalidated, as
+their page now renders the archived cargo (see CargoDetailView). The
+accounting exports read the archive tables too (see cargo.exports); the event
+reports read the live tables only.
+"""
+import datetime
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from cargo import caching, search
+from cargo.models import (
+    Cargo, CargoEvent, PickupOrder, Lumper,
+    ArchivedCargo, ArchivedCargoEvent, ArchivedPickupOrder, ArchivedLumper,
+)
+
+BATCH_SIZE = 500
+
+# Live model -> archive model, children first (the order rows are deleted in)
+ARCHIVED = (
+    (Lumper, ArchivedLumper),
+    (PickupOrder, ArchivedPickupOrder),
+    (CargoEvent, ArchivedCargoEvent),
+    (Cargo, ArchivedCargo),
+)
+
+
+def archivable(days=None, now=None):
+    """
+    The delivered cargos old enough to be archived.
+    """
+    if days is None:
+        days = settings.CARGO_ARCHIVE_AFTER_DAYS
+    cutoff = (now or timezone.now()) - datetime.timedelta(days=days)
+    return Cargo.objects.filter(status='d', delivered__lt=cutoff)
+
+
+def archive(days=None, batch_size=BATCH_SIZE, now=None, pause=0, progress=None):
+    """
+    Moves the cargos delivered more than `days` days before now to the archive, batch_size
+    cargos per transaction, sleeping `pause` seconds between batches. Returns the number of
+    cargos archived.
+    """
+    cargos = archivable(days, now).order_by('pk')
+    if connection.features.has_select_for_update_skip_locked:
+        cargos = cargos.select_for_update(skip_locked=True)
+    archived = 0
+    while True:
+        with transaction.atomic():
+            ids = list(cargos.values_list('pk', flat=True)[:batch_size])
+            if ids:
+                move(ids)
+        archived += len(ids)
+        if ids and progress:
+            progress('{0} cargos archived'.format(archived))
+        if len(ids) < batch_size:
+            return archived
+        if pause:
+            time.sleep(pause)
+
+
+def move(ids):
+    """
+    Moves the given cargos, with their events, pickup orders and lumpers, to the archive tables.
+    Must run inside a transaction, with the cargos locked.
+    """
+    placeholders = ', '.join(['%s'] * len(ids))
+    archived = timezone.now()
+    with connection.cursor() as cursor:
+        for model, archive_model in reversed(ARCHIVED):
+            columns = ', '.join(connection.ops.quote_name(field.column) for field in model._meta.concrete_fields)
+            where, params = _rows_of(model, placeholders, ids)
+            if archive_model is ArchivedCargo:
+                cursor.execute('INSERT INTO {0} ({1}, {2}) SELECT {1}, %s FROM {3} WHERE {4}'.format(
+                    _table(archive_model), columns, connection.ops.quote_name('archived'), _table(model), where,
+                ), [archived] + params)
+            else:
+                cursor.execute('INSERT INTO {0} ({1}) SELECT {1} FROM {2} WHERE {3}'.format(
+                    _table(archive_model), columns, _table(model), where,
+                ), params)
+        for model, _ in ARCHIVED:
+            where, params = _rows_of(model, placeholders, ids)
+            cursor.execute('DELETE FROM {0} WHERE {1}'.format(_table(model), where), params)
+    search.unindex(Cargo, ids)
+    caching.invalidate_on_commit('cargo', *ids)
+
+
+def _rows_of(model, placeholders, ids):
+    """
+    The WHERE clause (and its parameters) selecting the rows of model belonging to the given cargos.
+    """
+    quote = connection.ops.quote_name
+    if model is Cargo:
+        return '{0} IN ({1})'.format(quote('id'), placeholders), list(ids)
+    if model is Lumper:
+        return '{0} IN (SELECT {1} FROM {2} WHERE {3} IN ({4}))'.format(
+            quote('pickup_order_id'), quote('id'), _table(PickupOrder), quote('cargo_id'), placeholders,
+        ), list(ids)
+    return '{0} IN ({1})'.format(quote('cargo_id'), placeholders), list(ids)
+
+
+def _table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def lookup(pk):
+    """
+    Returns the cargo with the given id, live (a Cargo) or archived (an ArchivedCargo), or None.
+    """
+    return Cargo.objects.filter(pk=pk).first() or ArchivedCargo.objects.filter(pk=pk).first()
+
+
+def run():
+    """
+    Job archiving the old delivered cargos, queued periodically by the job workers (see CARGO_PERIODIC_JOBS).
+    """
+    archive()
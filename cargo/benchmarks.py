@@ -0,0 +1,190 @@
+"""
+Benchmarks of the main pages, to compare branches and catch regressions.
+
+Each of the SCENARIOS requests one page (the detail pages for random rows of a
+sample read up front) from several worker threads at once, each with its own
+test Client logged in as a superuser, so the admin changelists can be measured
+too. The requests go through the whole middleware stack, in process, and
+their queries are counted by the request metrics (see cargo.metrics).
+
+A run reports, for each scenario, the throughput, the p50 and p99 latency
+and the average number of queries per request. Each worker first makes a few
+warm-up requests that are not measured (they fill the caches, as traffic does
+in production). Results are compared with a baseline saved from an earlier
+run on the same data (see cargo.seeding): a scenario regresses when its
+latency grows or its throughput drops by more than the tolerance, when it
+runs more queries per request than the baseline (plus QUERY_SLACK, for the
+cache misses that vary between runs), or when it answers with errors.
+"""
+import json
+import random
+import statistics
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+
+from cargo.models import Cargo, Company
+
+# Name -> (URL name, model whose sampled ids the URL takes, or None)
+SCENARIOS = {
+    'index': ('index', None),
+    'cargo-list': ('cargos', None),
+    'cargo-detail': ('cargo-detail', Cargo),
+    'company-detail': ('company-detail', Company),
+    'brokers': ('brokers', None),
+    'carriers': ('carriers', None),
+    'admin-cargos': ('admin:cargo_cargo_changelist', None),
+    'admin-pickup-orders': ('admin:cargo_pickuporder_changelist', None),
+    'admin-lumpers': ('admin:cargo_lumper_changelist', None),
+    'admin-companies': ('admin:cargo_company_changelist', None),
+    'admin-facilities': ('admin:cargo_facility_changelist', None),
+    'admin-employees': ('admin:cargo_employee_changelist', None),
+}
+
+SAMPLE_SIZE = 1000
+QUERY_SLACK = 0.5  # Queries per request
+
+BENCHMARK_USER = 'benchmark'
+
+
+def benchmark_user():
+    """
+    Returns the superuser the benchmark requests are made as, creating it if needed.
+    """
+    user, created = User.objects.get_or_create(username=BENCHMARK_USER, defaults={'is_staff': True, 'is_superuser': True})
+    if created:
+        user.set_unusable_password()
+        user.save(update_fields=['password'])
+    return user
+
+
+def sample(model, rng, size=SAMPLE_SIZE):
+    """
+    Returns the ids of up to size random rows of model.
+    """
+    first = model.objects.order_by('pk').values_list('pk', flat=True).first()
+    last = model.objects.order_by('-pk').values_list('pk', flat=True).first()
+    if first is None:
+        return []
+    candidates = rng.sample(range(first, last + 1), min(size, last - first + 1))
+    return sorted(model.objects.filter(pk__in=candidates).values_list('pk', flat=True))
+
+
+def run(scenarios=None, workers=4, requests=200, warmup=5, seed=0, host='testserver'):
+    """
+    Runs the scenarios (names of SCENARIOS, all by default) in turn, requesting the pages for
+    host (which must be in ALLOWED_HOSTS). Returns {name: result} (see run_scenario).
+    """
+    rng = random.Random(seed)
+    user = benchmark_user()
+    samples = {}
+    results = {}
+    for name in scenarios or SCENARIOS:
+        url_name, model = SCENARIOS[name]
+        if model is not None and model not in samples:
+            samples[model] = sample(model, rng)
+        if model is None:
+            paths = [reverse(url_name)]
+        elif samples[model]:
+            paths = [reverse(url_name, args=[pk]) for pk in samples[model]]
+        else:
+            continue  # Nothing to show
+        results[name] = run_scenario(paths, user, workers, requests, warmup, seed, host)
+    return results
+
+
+def run_scenario(paths, user, workers, requests, warmup, seed=0, host='testserver'):
+    """
+    Makes requests requests for random paths (after warmup unmeasured ones per worker) from
+    workers threads. Returns the throughput, the p50 and p99 latencies in milliseconds, the
+    average queries per request and the number of errors, as a dict.
+    """
+    latencies, queries, errors = [], [], [0]
+    remaining = [requests]
+    lock = threading.Lock()
+
+    def work(index):
+        rng = random.Random('{0}-{1}'.format(seed, index))
+        client = Client(HTTP_HOST=host)
+        client.force_login(user)
+        for _ in range(warmup):
+            client.get(rng.choice(paths))
+        while True:
+            with lock:
+                if not remaining[0]:
+                    return
+                remaining[0] -= 1
+            started = time.perf_counter()
+            response = client.get(rng.choice(paths))
+            elapsed = time.perf_counter() - started
+            recorder = getattr(response.wsgi_request, 'query_recorder', None)
+            with lock:
+                latencies.append(elapsed)
+                if recorder is not None:
+                    queries.append(recorder.count)
+                errors[0] += response.status_code >= 400
+
+    def thread(index):
+        try:
+            work(index)
+        finally:
+            connections.close_all()
+
+    started = time.perf_counter()
+    if workers == 1:
+        work(0)  # In this thread, e.g. inside a test's transaction
+    else:
+        threads = [threading.Thread(target=thread, args=[index]) for index in range(workers)]
+        for each in threads:
+            each.start()
+        for each in threads:
+            each.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'throughput': round(len(latencies) / elapsed, 1),
+        'p50': round(statistics.median(latencies) * 1000, 2),
+        'p99': round(latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000, 2),
+        'queries': round(statistics.mean(queries), 2) if queries else None,
+        'errors': errors[0],
+    }
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Returns the regressions of results against baseline (both {name: result}) as messages.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric in ('p50', 'p99'):
+            if result[metric] > base[metric] * (1 + tolerance):
+                regressions.append('{0}: {1} {2} ms, baseline {3} ms'.format(name, metric, result[metric], base[metric]))
+        if result['throughput'] < base['throughput'] / (1 + tolerance):
+            regressions.append('{0}: {1} requests/s, baseline {2}'.format(name, result['throughput'], base['throughput']))
+        if result['queries'] is not None and base.get('queries') is not None and result['queries'] > base['queries'] + QUERY_SLACK:
+            regressions.append('{0}: {1} queries per request, baseline {2}'.format(name, result['queries'], base['queries']))
+        if result['errors'] > base.get('errors', 0):
+            regressions.append('{0}: {1} errors, baseline {2}'.format(name, result['errors'], base.get('errors', 0)))
+    return regressions
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path, results, **conditions):
+    """
+    Writes results as the baseline, with the conditions they were measured in (workers, data size, etc.).
+    """
+    with open(path, 'w') as f:
+        json.dump({'conditions': conditions, 'scenarios': results}, f, indent=2, sort_keys=True)
+        f.write('\n')
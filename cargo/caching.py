@@ -0,0 +1,132 @@
+"""
+Caching of the company and cargo pages.
+
+Cached values are keyed by a version token: each object (or list) the value
+was built from has a token in the cache, and the value's key includes it.
+Invalidating an object deletes its token, so the next read makes a new one and
+misses, and the values built from the old token are never read again (they
+just expire). The handlers in cargo.signals delete the tokens of exactly the
+objects a change affects, once the change is committed, so a request that
+reads the database between the change and the commit cannot cache stale data
+under the new token.
+
+The backend is settings.CACHES['default']: local memory by default, or a file,
+memcached or Redis-compatible cache from the environment (see settings). A
+token deleted in one process is only gone for the processes sharing its
+cache, so with several web workers, or with the job workers (whose jobs
+change cargos and companies too), the cache must be a shared one. The hit
+and miss counters are kept per process.
+"""
+import threading
+import uuid
+from functools import partial
+
+from django.core.cache import cache
+from django.db import transaction
+
+KEY_PREFIX = 'cargo'
+
+_MISSING = object()
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def _version_key(kind, pk=None):
+    return '{0}:version:{1}:{2}'.format(KEY_PREFIX, kind, '' if pk is None else pk)
+
+
+def versions(*dependencies):
+    """
+    Returns the current version tokens of the given (kind, pk) dependencies, in one cache round trip
+    (plus one to create the tokens that are missing).
+    """
+    keys = [_version_key(*dependency) for dependency in dependencies]
+    found = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex[:12] for key in keys if key not in found}
+    if missing:
+        # Never expire; an evicted token only costs a miss
+        cache.set_many(missing, timeout=None)
+        found.update(missing)
+    return [found[key] for key in keys]
+
+
+def make_key(name, dependencies, *parts):
+    """
+    Returns the key of a cached value named `name`, built from the given (kind, pk)
+    dependencies and varying on the given parts.
+    """
+    return ':'.join([KEY_PREFIX, name] + [str(part) for part in parts] + versions(*dependencies))
+
+
+def get_or_compute(key, compute, timeout=None):
+    """
+    Returns the value cached under `key`, or computes, caches and returns it.
+    Exceptions raised by compute (e.g. Http404) are not cached.
+    """
+    value = cache.get(key, _MISSING)
+    with _stats_lock:
+        _stats['hits' if value is not _MISSING else 'misses'] += 1
+    if value is _MISSING:
+        value = compute()
+        cache.set(key, value, timeout if timeout is not None else cache.default_timeout)
+    return value
+
+
+def invalidate(kind, *pks):
+    """
+    Drops the version tokens of the given objects of a kind (pk None stands for a whole list).
+    """
+    if pks:
+        cache.delete_many([_version_key(kind, pk) for pk in pks])
+
+
+def invalidate_on_commit(kind, *pks):
+    """
+    Like invalidate(), once the current transaction (if any) is committed.
+    """
+    transaction.on_commit(partial(invalidate, kind, *pks))
+
+
+def stats():
+    """
+    Returns the hit and miss counts of this process and the hit ratio.
+    """
+    with _stats_lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    return {'hits': hits, 'misses': misses, 'ratio': hits / (hits + misses) if hits + misses else None}
+
+
+class CachedObjectMixin(object):
+    """
+    DetailView mixin caching the object (with whatever the view's queryset selects or
+    prefetches) under the version of (cache_kind, pk), and passing that version to
+    the template as `cache_version` for {% cache %} fragments.
+    """
+    cache_kind = None
+
+    def get_object(self, queryset=None):
+        if queryset is not None:
+            return super(CachedObjectMixin, self).get_object(queryset)
+        pk = self.kwargs.get(self.pk_url_kwarg)
+        self.cache_version, = versions((self.cache_kind, pk))
+        key = make_key('object', [], self.cache_kind, pk, self.cache_version)
+        return get_or_compute(key, super(CachedObjectMixin, self).get_object)
+
+    def get_context_data(self, **kwargs):
+        context = super(CachedObjectMixin, self).get_context_data(**kwargs)
+        context['cache_version'] = self.cache_version
+        context['cache_timeout'] = cache.default_timeout
+        return context
+
+
+class CachedPageMixin(object):
+    """
+    CursorPaginationMixin companion caching each page under the version of the
+    cache_kind list, so a change to any object of the list drops every page.
+    """
+    cache_kind = None
+
+    def get_cursor_page(self, paginator, cursor):
+        key = make_key('page', [(self.cache_kind, None)], type(self).__name__, paginator.per_page, cursor or '')
+        return get_or_compute(key, partial(super(CachedPageMixin, self).get_cursor_page, paginator, cursor))
@@ -0,0 +1,92 @@
+"""
+Precomputed record counts for the home page.
+
+The counts live in a single DashboardCounter row. Saves and deletes of Cargo,
+PickupOrder and Company adjust it through the handlers in cargo.signals, inside
+the same transaction as the change, so the index view only has to read one row.
+Anything that bypasses model signals (queryset.update(), bulk_create(), raw SQL)
+must either call adjust() itself or rely on reconcile(), which the
+reconcile_counters management command runs periodically.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from cargo.models import DashboardCounter, Cargo, PickupOrder, Company, CompanyType, ArchivedCargo, ArchivedPickupOrder
+
+COUNTER_PK = 1
+
+COUNTER_FIELDS = ('num_cargos', 'num_pickuporders', 'num_cargos_available', 'num_brokerages', 'num_carriers')
+
+# Company type names (matched case-insensitively) that have their own counter.
+COMPANY_TYPE_COUNTERS = {
+    'brokerage': 'num_brokerages',
+    'carrier': 'num_carriers',
+}
+
+
+def company_type_counter(type_id):
+    """
+    Returns the counter field name for companies of the given CompanyType id, or None.
+    """
+    if type_id is None:
+        return None
+    name = CompanyType.objects.filter(pk=type_id).values_list('type', flat=True).first()
+    return COMPANY_TYPE_COUNTERS.get((name or '').lower())
+
+
+def compute(fields=None):
+    """
+    Counts the rows behind each counter straight from the tables.
+    """
+    queries = {
+        # Archived cargos and pickup orders (see cargo.archive) still count
+        'num_cargos': lambda: Cargo.objects.count() + ArchivedCargo.objects.count(),
+        'num_pickuporders': lambda: PickupOrder.objects.count() + ArchivedPickupOrder.objects.count(),
+        'num_cargos_available': lambda: Cargo.objects.filter(status__exact='p').count(),
+        'num_brokerages': lambda: Company.objects.filter(type__type__iexact='brokerage').count(),
+        'num_carriers': lambda: Company.objects.filter(type__type__iexact='carrier').count(),
+    }
+    return {name: query() for name, query in queries.items() if fields is None or name in fields}
+
+
+def reconcile(fields=None):
+    """
+    Recomputes the counters (all of them, or only the given field names) and stores them.
+    Returns the DashboardCounter row.
+    """
+    with transaction.atomic():
+        counter = DashboardCounter.objects.select_for_update().filter(pk=COUNTER_PK).first()
+        if counter is None:
+            counter, fields = DashboardCounter(pk=COUNTER_PK), None
+        for name, value in compute(fields).items():
+            setattr(counter, name, value)
+        if fields is None:
+            counter.reconciled = timezone.now()
+        counter.save()
+    return counter
+
+
+def adjust(**deltas):
+    """
+    Adds the given deltas (e.g. num_cargos=1, num_cargos_available=-1) to the counters
+    with a single UPDATE. The counters are rebuilt if the row does not exist yet.
+    """
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    updated = DashboardCounter.objects.filter(pk=COUNTER_PK).update(
+        **{name: F(name) + delta for name, delta in deltas.items()}
+    )
+    if not updated:
+        reconcile()
+
+
+def current():
+    """
+    Returns the DashboardCounter row, building it on first use.
+    """
+    counter = DashboardCounter.objects.filter(pk=COUNTER_PK).first()
+    if counter is None:
+        counter = reconcile()
+    return counter
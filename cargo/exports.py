@@ -0,0 +1,172 @@
+"""
+Streaming accounting exports of cargos, pickup orders and lumpers.
+
+Each export is a values_list() projection read with a server-side cursor
+(QuerySet.iterator), turned into CSV or NDJSON lines one row at a time, so
+memory use does not grow with the number of rows. Money amounts and their
+currency are exported as separate columns.
+
+Archived cargos (see cargo.archive) are exported too: when the date range
+reaches back to the archived rows, the matching rows of the archive tables,
+which have the same columns, are read the same way and merged with the live
+rows in id order.
+"""
+import csv
+import datetime
+import heapq
+import json
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from cargo.models import Cargo, PickupOrder, Lumper, ArchivedCargo, ArchivedPickupOrder, ArchivedLumper
+
+CHUNK_SIZE = 2000
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class Export(object):
+    """
+    An export of one model (and its archive model): its columns as (header, field
+    lookup) pairs, the timestamp the date range applies to and the lookup of the
+    cargo status.
+    """
+
+    def __init__(self, model, archive_model, date_field, status_field, columns):
+        self.model         = model
+        self.archive_model = archive_model
+        self.date_field    = date_field
+        self.status_field  = status_field
+        self.columns       = columns
+
+    @property
+    def header(self):
+        return [header for header, _ in self.columns]
+
+    def queryset(self, start=None, end=None, status=None, archived=False):
+        """
+        Rows with the date field within [start, end] (dates, both inclusive) and the given cargo status,
+        of the live table or, with archived, of the archive table.
+        """
+        queryset = (self.archive_model if archived else self.model).objects.order_by('pk')
+        if start is not None:
+            queryset = queryset.filter(**{self.date_field + '__gte': _start_of(start)})
+        if end is not None:
+            queryset = queryset.filter(**{self.date_field + '__lt': _start_of(end + datetime.timedelta(days=1))})
+        if status:
+            queryset = queryset.filter(**{self.status_field: status})
+        return queryset.values_list(*[lookup for _, lookup in self.columns])
+
+    def rows(self, start=None, end=None, status=None):
+        rows = self.queryset(start, end, status).iterator(chunk_size=CHUNK_SIZE)
+        if _reaches_archive(start):
+            archived = self.queryset(start, end, status, archived=True).iterator(chunk_size=CHUNK_SIZE)
+            rows = heapq.merge(rows, archived, key=lambda row: row[0])  # Both ordered by id, the first column
+        for row in rows:
+            yield [_cell(value) for value in row]
+
+
+EXPORTS = {
+    'cargos': Export(Cargo, ArchivedCargo, 'posted', 'status', [
+        ('id', 'id'),
+        ('description', 'description'),
+        ('status', 'status'),
+        ('price', 'price'),
+        ('price_currency', 'price_currency'),
+        ('brokerage', 'broker__company__name'),
+        ('carrier', 'dispatcher__company__name'),
+        ('posted', 'posted'),
+        ('negotiated', 'negotiated'),
+        ('assigned', 'assigned'),
+        ('delivered', 'delivered'),
+    ]),
+    'pickups': Export(PickupOrder, ArchivedPickupOrder, 'loaded', 'cargo__status', [
+        ('id', 'id'),
+        ('cargo_id', 'cargo_id'),
+        ('cargo_status', 'cargo__status'),
+        ('pickup_from', 'pickup_from__name'),
+        ('deliver_to', 'deliver_to__name'),
+        ('loaded', 'loaded'),
+        ('delivered', 'delivered'),
+    ]),
+    'lumpers': Export(Lumper, ArchivedLumper, 'paid', 'pickup_order__cargo__status', [
+        ('id', 'id'),
+        ('cargo_id', 'pickup_order__cargo_id'),
+        ('pickup_order_id', 'pickup_order_id'),
+        ('facility', 'pickup_order__pickup_from__name'),
+        ('price', 'price'),
+        ('price_currency', 'price_currency'),
+        ('requested', 'requested'),
+        ('paid', 'paid'),
+    ]),
+}
+
+
+class Echo(object):
+    """
+    File-like object that hands back what is written to it, for csv.writer.
+    """
+    def write(self, value):
+        return value
+
+
+def stream(export, format, start=None, end=None, status=None):
+    """
+    Yields the export as lines of the given format, starting with the header for CSV.
+    """
+    rows = export.rows(start, end, status)
+    if format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(export.header)
+        for row in rows:
+            yield writer.writerow(row)
+    elif format == 'ndjson':
+        for row in rows:
+            yield json.dumps(dict(zip(export.header, row))) + '\n'
+    else:
+        raise ValueError('Unknown export format {0!r}'.format(format))
+
+
+def parse_filters(data):
+    """
+    Reads the 'from', 'to' (YYYY-MM-DD) and 'status' filters from a dict-like object.
+    Raises ValueError for invalid values.
+    """
+    filters = {}
+    for key, name in (('from', 'start'), ('to', 'end')):
+        value = data.get(key)
+        if value:
+            filters[name] = parse_date(value)
+            if filters[name] is None:
+                raise ValueError('Invalid date {0!r} for {1!r}, use YYYY-MM-DD'.format(value, key))
+    status = data.get('status')
+    if status:
+        if status not in dict(Cargo.CARGO_STATUS):
+            raise ValueError('Invalid status {0!r}'.format(status))
+        filters['status'] = status
+    return filters
+
+
+def _reaches_archive(start):
+    """
+    Whether archived rows can fall in a range starting at start. The timestamps of an archived
+    cargo, its pickup orders and lumpers all precede its archival, so a range starting after the
+    last archival has none.
+    """
+    return start is None or ArchivedCargo.objects.filter(archived__gte=_start_of(start)).exists()
+
+
+def _start_of(date):
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
+
+
+def _cell(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if value is None:
+        return ''
+    return str(value)
@@ -0,0 +1,429 @@
+"""
+Facility locations, and the queries for facilities and open cargos near a point
+or along a lane.
+
+Saving a facility with a new address queues a job (see cargo.jobs) that
+geocodes it into Facility.latitude/longitude. The geocoder is pluggable
+(settings.CARGO_GEOCODER, a dotted path to a Geocoder class):
+
+- GoogleGeocoder calls the Google Geocoding API with settings.GOOGLE_API_KEY.
+- StubGeocoder works offline, for development and tests: it knows a few
+  cities and 'latitude, longitude' pairs.
+
+Every answer (including "not found") is kept in the GeocodeResult table, so an
+address is only sent to the geocoder once.
+
+Nearby facilities are found through Facility.geohash, an indexed column: a
+geohash is a string naming a cell of a grid over the earth, and every
+location in a cell has a geohash starting with it. A circle is covered by at
+most MAX_CELLS cells, each an indexed range of geohashes (those starting
+with the cell's); the exact distances of the few candidates are then computed here. This
+works the same on PostgreSQL and SQLite, without PostGIS. (Cells are not
+wrapped across the 180th meridian, which no lane of ours crosses.)
+
+Distances are in miles, on a sphere.
+"""
+import functools
+import hashlib
+import json
+import math
+import operator
+import re
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from cargo import jobs, matching
+from cargo.models import Cargo, Facility, GeocodeResult, PickupOrder
+
+EARTH_RADIUS = 3958.8  # Miles
+
+BASE32    = '0123456789bcdefghjkmnpqrstuvwxyz'
+PRECISION = 9   # Characters of Facility.geohash, a cell of about 15 x 15 feet
+MAX_CELLS = 20  # Cells (i.e. index ranges) a search area is covered with at most
+
+START_RADIUS = 25    # Miles nearest() looks within first, quadrupled until it finds enough
+MAX_RADIUS   = 3000
+
+
+class GeocodingError(Exception):
+    """
+    The geocoder could not answer now (network error, quota, etc.); the job is retried.
+    """
+
+
+class Geocoder(object):
+    """
+    Turns addresses into coordinates. Subclasses set a name (part of the cached
+    results' key) and implement geocode().
+    """
+    name = None
+
+    def geocode(self, address):
+        """
+        Returns the (latitude, longitude) of the address, or None if it does not exist.
+        Raises GeocodingError when it cannot tell.
+        """
+        raise NotImplementedError
+
+
+class GoogleGeocoder(Geocoder):
+    """
+    The Google Geocoding API (https://developers.google.com/maps/documentation/geocoding).
+    """
+    name = 'google'
+    URL  = 'https://maps.googleapis.com/maps/api/geocode/json'
+
+    def __init__(self, api_key=None, timeout=10):
+        self.api_key = api_key or settings.GOOGLE_API_KEY
+        self.timeout = timeout
+
+    def geocode(self, address):
+        url = '{0}?{1}'.format(self.URL, urllib.parse.urlencode({'address': address, 'key': self.api_key}))
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                data = json.load(response)
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise GeocodingError(str(e))
+        if data['status'] == 'ZERO_RESULTS':
+            return None
+        if data['status'] != 'OK':
+            raise GeocodingError('{0}: {1}'.format(data['status'], data.get('error_message', '')))
+        location = data['results'][0]['geometry']['location']
+        return location['lat'], location['lng']
+
+
+class StubGeocoder(Geocoder):
+    """
+    An offline geocoder. Finds a 'latitude, longitude' pair in the address, or else the
+    first of CITIES it names (moved up to a few miles, differently for every address, so
+    facilities in one city are not all in the same spot). Other addresses are not found.
+    """
+    name = 'stub'
+    CITIES = {
+        'atlanta': (33.749, -84.388),
+        'boston': (42.360, -71.059),
+        'chicago': (41.878, -87.630),
+        'dallas': (32.777, -96.797),
+        'denver': (39.739, -104.990),
+        'houston': (29.760, -95.370),
+        'jacksonville': (30.332, -81.656),
+        'los angeles': (34.052, -118.244),
+        'miami': (25.762, -80.192),
+        'new york': (40.713, -74.006),
+        'orlando': (28.538, -81.379),
+        'phoenix': (33.448, -112.074),
+        'seattle': (47.606, -122.332),
+        'tampa': (27.951, -82.457),
+    }
+    POINT = re.compile(r'(-?\d{1,2}(?:\.\d+)?)\s*,\s*(-?\d{1,3}(?:\.\d+)?)')
+
+    def geocode(self, address):
+        match = self.POINT.search(address)
+        if match:
+            latitude, longitude = float(match.group(1)), float(match.group(2))
+            if -90 <= latitude <= 90 and -180 <= longitude <= 180:
+                return latitude, longitude
+        text = normalize(address)
+        for city, (latitude, longitude) in self.CITIES.items():
+            if re.search(r'\b{0}\b'.format(city), text):
+                digest = hashlib.sha1(text.encode()).digest()
+                return latitude + (digest[0] - 128) / 4000.0, longitude + (digest[1] - 128) / 4000.0
+        return None
+
+
+@functools.lru_cache()
+def _geocoder(path):
+    return import_string(path)()
+
+
+def geocoder():
+    """
+    Returns the configured Geocoder.
+    """
+    return _geocoder(settings.CARGO_GEOCODER)
+
+
+def normalize(address):
+    return ' '.join(address.lower().split())[:200]
+
+
+def geocode(address):
+    """
+    Returns the (latitude, longitude) of an address, or None if it was not found, asking the
+    geocoder only if it has not answered for the same address before.
+    """
+    provider = geocoder()
+    key = normalize(address)
+    cached = GeocodeResult.objects.filter(provider=provider.name, address=key).first()
+    if cached is not None:
+        return None if cached.latitude is None else (cached.latitude, cached.longitude)
+    point = provider.geocode(address)
+    latitude, longitude = point or (None, None)
+    try:
+        with transaction.atomic():
+            GeocodeResult.objects.create(provider=provider.name, address=key, latitude=latitude, longitude=longitude)
+    except IntegrityError:
+        pass  # Another worker geocoded it at the same time
+    return point
+
+
+def schedule(facility_id):
+    """
+    Queues the geocoding of a facility's address.
+    """
+    jobs.enqueue(locate, queue='geocoding', key='locate:{0}'.format(facility_id), facility_id=facility_id)
+
+
+def locate(facility_id):
+    """
+    Job storing the location of a facility's current address.
+    """
+    address = Facility.objects.filter(pk=facility_id).values_list('address', flat=True).first()
+    if address is None:
+        return
+    point = geocode(address)
+    latitude, longitude = point or (None, None)
+    # Only if the address was not changed meanwhile (that change queued its own job)
+    Facility.objects.filter(pk=facility_id, address=address).update(
+        latitude=latitude, longitude=longitude, geohash=encode(*point) if point else '', updated=timezone.now())
+    matching.invalidate()  # Its loads may have become candidates, or moved
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    """
+    Returns the geohash of a point.
+    """
+    south, north, west, east = -90.0, 90.0, -180.0, 180.0
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        # Bits alternate between longitude and latitude, starting with longitude
+        if even:
+            middle = (west + east) / 2
+            value = value * 2 + (longitude >= middle)
+            west, east = (middle, east) if longitude >= middle else (west, middle)
+        else:
+            middle = (south + north) / 2
+            value = value * 2 + (latitude >= middle)
+            south, north = (middle, north) if latitude >= middle else (south, middle)
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """
+    Returns the (height, width) in degrees of the geohash cells of a precision.
+    """
+    return 180.0 / 2 ** (5 * precision // 2), 360.0 / 2 ** ((5 * precision + 1) // 2)
+
+
+def cover(south, west, north, east):
+    """
+    Returns the geohashes of at most MAX_CELLS cells, as small as possible, covering a box.
+    """
+    for precision in range(PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        if (int((north - south) / height) + 2) * (int((east - west) / width) + 2) > MAX_CELLS:
+            continue
+        cells = set()
+        # Steps of one cell from one corner visit every row and column of cells in the box
+        latitude = south
+        while True:
+            longitude = west
+            while True:
+                cells.add(encode(min(latitude, north), min(longitude, east), precision))
+                if longitude >= east:
+                    break
+                longitude += width
+            if latitude >= north:
+                break
+            latitude += height
+        return sorted(cells)
+    return ['']  # Larger than any cell: everything
+
+
+def box(latitude, longitude, radius):
+    """
+    Returns the (south, west, north, east) box around a circle of radius miles.
+    """
+    dlat = math.degrees(radius / EARTH_RADIUS)
+    south, north = max(latitude - dlat, -90.0), min(latitude + dlat, 90.0)
+    cos = min(math.cos(math.radians(south)), math.cos(math.radians(north)))
+    dlon = math.degrees(radius / (EARTH_RADIUS * cos)) if cos > 0.01 else 180.0
+    if dlon >= 180.0:
+        return south, -180.0, north, 180.0
+    return south, max(longitude - dlon, -180.0), north, min(longitude + dlon, 180.0)
+
+
+def distance(latitude1, longitude1, latitude2, longitude2):
+    """
+    Returns the great-circle distance in miles between two points.
+    """
+    return _angle(latitude1, longitude1, latitude2, longitude2) * EARTH_RADIUS
+
+
+def _angle(latitude1, longitude1, latitude2, longitude2):
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    dphi, dlambda = phi2 - phi1, math.radians(longitude2 - longitude1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _bearing(latitude1, longitude1, latitude2, longitude2):
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    dlambda = math.radians(longitude2 - longitude1)
+    return math.atan2(math.sin(dlambda) * math.cos(phi2), math.cos(phi1) * math.sin(phi2) - math.sin(phi1) * math.cos(phi2) * math.sin(dlambda))
+
+
+def lane_offset(point, origin, destination):
+    """
+    Returns (miles off the lane, miles along it) of a point relative to the great-circle lane
+    from origin to destination. Points before or after the lane are measured from its ends.
+    """
+    length = _angle(origin[0], origin[1], destination[0], destination[1])
+    to_point = _angle(origin[0], origin[1], point[0], point[1])
+    if to_point == 0 or length == 0:
+        return to_point * EARTH_RADIUS, 0.0
+    delta = _bearing(origin[0], origin[1], point[0], point[1]) - _bearing(origin[0], origin[1], destination[0], destination[1])
+    cross = math.asin(max(-1.0, min(1.0, math.sin(to_point) * math.sin(delta))))
+    along = math.acos(max(-1.0, min(1.0, math.cos(to_point) / math.cos(cross))))
+    if math.cos(delta) < 0:
+        return to_point * EARTH_RADIUS, 0.0
+    if along > length:
+        return distance(point[0], point[1], destination[0], destination[1]), length * EARTH_RADIUS
+    return abs(cross) * EARTH_RADIUS, along * EARTH_RADIUS
+
+
+def parse_point(text):
+    """
+    Returns the (latitude, longitude) written as 'latitude,longitude'. Raises ValueError.
+    """
+    try:
+        latitude, longitude = (float(part) for part in text.split(','))
+    except (AttributeError, ValueError):
+        raise ValueError('Invalid point {0!r}, expected latitude,longitude'.format(text))
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('Point {0!r} is out of range'.format(text))
+    return latitude, longitude
+
+
+def in_box(south, west, north, east, prefix=''):
+    """
+    Returns the lookups (Q) for located rows in a box, through the geohash index.
+    """
+    cells = []
+    for cell in cover(south, west, north, east):
+        # A range rather than startswith, whose LIKE SQLite cannot answer from the index
+        lookups = {prefix + 'geohash__gte': cell}
+        following = _following(cell)
+        if following:
+            lookups[prefix + 'geohash__lt'] = following
+        cells.append(Q(**lookups))
+    return functools.reduce(operator.or_, cells) & Q(**{
+        prefix + 'latitude__range': (south, north),
+        prefix + 'longitude__range': (west, east),
+    })
+
+
+def _following(cell):
+    # The first geohash after every geohash starting with cell ('' if there is none)
+    cell = cell.rstrip(BASE32[-1])
+    return cell[:-1] + BASE32[BASE32.index(cell[-1]) + 1] if cell else ''
+
+
+def within(latitude, longitude, radius, queryset=None):
+    """
+    Returns the facilities within radius miles of a point, nearest first, each with its 'distance'.
+    """
+    queryset = Facility.objects.all() if queryset is None else queryset
+    found = []
+    for facility in queryset.filter(in_box(*box(latitude, longitude, radius))).order_by():
+        facility.distance = distance(latitude, longitude, facility.latitude, facility.longitude)
+        if facility.distance <= radius:
+            found.append(facility)
+    return sorted(found, key=lambda facility: (facility.distance, facility.pk))
+
+
+def nearest(latitude, longitude, limit=10, max_radius=MAX_RADIUS, queryset=None):
+    """
+    Returns the limit facilities nearest to a point (at most max_radius miles away), nearest
+    first, each with its 'distance'.
+    """
+    radius = min(START_RADIUS, max_radius)
+    while True:
+        found = within(latitude, longitude, radius, queryset)
+        if len(found) >= limit or radius >= max_radius:
+            return found[:limit]
+        radius = min(radius * 4, max_radius)
+
+
+def cargos_near(latitude, longitude, radius, queryset=None):
+    """
+    Returns the open (posted) cargos picked up within radius miles of a point, nearest pickup
+    first, each with its pickup 'distance'.
+    """
+    pickups = PickupOrder.objects.filter(in_box(*box(latitude, longitude, radius), prefix='pickup_from__'), cargo__status='p')
+    distances = {}
+    for cargo_id, pickup_latitude, pickup_longitude in pickups.values_list('cargo_id', 'pickup_from__latitude', 'pickup_from__longitude'):
+        miles = distance(latitude, longitude, pickup_latitude, pickup_longitude)
+        if miles <= radius and miles < distances.get(cargo_id, radius + 1):
+            distances[cargo_id] = miles
+    return _with_distances(queryset, distances)
+
+
+def cargos_along(origin, destination, radius, queryset=None):
+    """
+    Returns the open (posted) cargos picked up and delivered within radius miles of the lane
+    from origin to destination (both (latitude, longitude)), in its direction. Their 'distance'
+    is the miles their pickup and delivery are off the lane, fewest first.
+    """
+    south, west, north, east = _lane_box(origin, destination, radius)
+    pickups = PickupOrder.objects.filter(
+        in_box(south, west, north, east, prefix='pickup_from__'),
+        in_box(south, west, north, east, prefix='deliver_to__'),
+        cargo__status='p',
+    ).values_list('cargo_id', 'pickup_from__latitude', 'pickup_from__longitude', 'deliver_to__latitude', 'deliver_to__longitude')
+    distances = {}
+    for cargo_id, *points in pickups:
+        pickup_off, pickup_along = lane_offset(points[:2], origin, destination)
+        delivery_off, delivery_along = lane_offset(points[2:], origin, destination)
+        if pickup_off <= radius and delivery_off <= radius and pickup_along <= delivery_along:
+            distances[cargo_id] = min(pickup_off + delivery_off, distances.get(cargo_id, float('inf')))
+    return _with_distances(queryset, distances)
+
+
+def _lane_box(origin, destination, radius):
+    # The box of points along the great circle (which bulges away from the equator), widened by the radius
+    steps = max(1, int(distance(origin[0], origin[1], destination[0], destination[1]) / 50))
+    boxes = [box(*_interpolate(origin, destination, step / steps), radius) for step in range(steps + 1)]
+    return min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes)
+
+
+def _interpolate(origin, destination, fraction):
+    angle = _angle(origin[0], origin[1], destination[0], destination[1])
+    if angle == 0:
+        return origin
+    phi1, lambda1, phi2, lambda2 = (math.radians(value) for value in origin + destination)
+    a, b = math.sin((1 - fraction) * angle) / math.sin(angle), math.sin(fraction * angle) / math.sin(angle)
+    x = a * math.cos(phi1) * math.cos(lambda1) + b * math.cos(phi2) * math.cos(lambda2)
+    y = a * math.cos(phi1) * math.sin(lambda1) + b * math.cos(phi2) * math.sin(lambda2)
+    z = a * math.sin(phi1) + b * math.sin(phi2)
+    return math.degrees(math.atan2(z, math.hypot(x, y))), math.degrees(math.atan2(y, x))
+
+
+def _with_distances(queryset, distances):
+    queryset = Cargo.objects.all() if queryset is None else queryset
+    cargos = list(queryset.in_bulk(list(distances)).values())
+    for cargo in cargos:
+        cargo.distance = distances[cargo.pk]
+    return sorted(cargos, key=lambda cargo: (cargo.distance, cargo.pk))
@@ -0,0 +1,119 @@
+"""
+Post-processing of the BOL, POD and lumper images.
+
+Uploads arrive at full phone-camera resolution. The upload queues a background
+job (see cargo.jobs), committed with it, which outside the request:
+
+- applies the EXIF orientation and re-encodes the image as a compressed JPEG
+  no larger than ARCHIVE_SIZE, without the EXIF data (location, device, etc.),
+  which replaces the original file;
+- writes a THUMBNAIL_SIZE thumbnail (WebP when Pillow supports it, else JPEG);
+- records the stored image's dimensions and size on the model.
+"""
+import io
+import os
+
+from PIL import Image, ImageOps, features
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.utils import timezone
+
+from cargo import caching, jobs
+from cargo.models import PickupOrder, Lumper
+
+THUMBNAIL_SIZE = (320, 320)
+ARCHIVE_SIZE   = (2048, 2048)
+ARCHIVE_QUALITY   = 80
+THUMBNAIL_QUALITY = 75
+
+# Image field -> prefix of the <prefix>_thumbnail/_width/_height/_bytes fields it fills
+IMAGE_FIELDS = {
+    PickupOrder: {'bol_image': 'bol', 'pod_image': 'pod'},
+    Lumper: {'image': 'image'},
+}
+
+def schedule(model, pk, field_name):
+    """
+    Queues the post-processing of one image field of a saved object.
+    """
+    jobs.enqueue(run, queue='images', model=model._meta.label_lower, pk=pk, field_name=field_name)
+
+
+def run(model, pk, field_name):
+    """
+    Job processing one image (see schedule).
+    """
+    process(apps.get_model(model), pk, field_name)
+
+
+def encode(image, size, format, quality):
+    """
+    Returns the image shrunk to fit in size and encoded in the given format, without metadata.
+    """
+    image = image.copy()
+    image.thumbnail(size, Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, quality=quality, optimize=True, **({'progressive': True} if format == 'JPEG' else {}))
+    return image.size, buffer.getvalue()
+
+
+def process(model, pk, field_name):
+    """
+    Compresses one image of an object, writes its thumbnail and records the sizes.
+    Does nothing if the image was removed or replaced in the meantime.
+    """
+    prefix = IMAGE_FIELDS[model][field_name]
+    obj = model.objects.filter(pk=pk).first()
+    field_file = getattr(obj, field_name, None)
+    if not field_file:
+        return
+    original_name = field_file.name
+    old_thumbnail = getattr(obj, prefix + '_thumbnail').name
+    storage = field_file.storage
+    base, _ = os.path.splitext(os.path.basename(original_name))
+    if old_thumbnail and os.path.splitext(os.path.basename(old_thumbnail))[0] == base:
+        return  # Already processed
+
+    with field_file.open('rb'):
+        image = ImageOps.exif_transpose(Image.open(field_file))
+        image = image.convert('RGB')
+    thumbnail_format = 'WEBP' if features.check('webp') else 'JPEG'
+    (width, height), archive = encode(image, ARCHIVE_SIZE, 'JPEG', ARCHIVE_QUALITY)
+    _, thumbnail = encode(image, THUMBNAIL_SIZE, thumbnail_format, THUMBNAIL_QUALITY)
+
+    upload_to = model._meta.get_field(field_name).upload_to
+    archive_name = storage.save('{0}/{1}.jpg'.format(upload_to, base), ContentFile(archive))
+    thumbnail_field = model._meta.get_field(prefix + '_thumbnail')
+    # Named after the stored image, which is how an already processed image is recognised
+    archive_base, _ = os.path.splitext(os.path.basename(archive_name))
+    thumbnail_name = storage.save('{0}/{1}.{2}'.format(thumbnail_field.upload_to, archive_base, thumbnail_format.lower()), ContentFile(thumbnail))
+
+    # Only record the result if the object still points to the image that was processed
+    updated = model.objects.filter(pk=pk, **{field_name: original_name}).update(**{
+        field_name: archive_name,
+        prefix + '_thumbnail': thumbnail_name,
+        prefix + '_width': width,
+        prefix + '_height': height,
+        prefix + '_bytes': len(archive),
+        'updated': timezone.now(),
+    })
+    if not updated:
+        storage.delete(archive_name)
+        storage.delete(thumbnail_name)
+    else:
+        storage.delete(original_name)
+        if old_thumbnail:
+            storage.delete(old_thumbnail)
+        # update() does not send post_save, so the cargo page showing the image is invalidated here
+        caching.invalidate('cargo', obj.cargo_id if model is PickupOrder else obj.pickup_order.cargo_id)
+
+
+def names_of(instance):
+    """
+    Returns the current file name of each post-processed image field of an object.
+    """
+    names = {}
+    for field_name in IMAGE_FIELDS.get(type(instance), ()):
+        value = instance.__dict__.get(field_name)
+        names[field_name] = getattr(value, 'name', value) or ''
+    return names
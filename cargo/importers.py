@@ -0,0 +1,253 @@
+"""
+Bulk load-board import.
+
+Brokers send loads as CSV (with a header row) or JSONL files, one load per
+row/line. Columns:
+
+    description, price, price_currency, broker (the broker's username), status,
+    pickup_from, deliver_to (facility ids), loaded, delivered,
+    lumper_price, lumper_price_currency, lumper_paid
+
+The pickup columns are optional; when pickup_from is given a PickupOrder is
+created for the cargo (and loaded and delivered are required), and when
+lumper_price is given a Lumper is created for that pickup order (and
+lumper_paid is required).
+
+Rows are read as a stream and handled in chunks. Brokers and facilities are
+resolved through an in-memory cache filled with one query per chunk for the
+keys it has not seen yet. Each chunk is validated row by row and inserted with
+bulk_create (batch_size rows per INSERT) inside its own transaction. Rows that
+fail validation are skipped and reported, and do not stop the import.
+"""
+import csv
+import itertools
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from cargo import counters, live, matching, search
+from cargo.models import Cargo, PickupOrder, Lumper, Employee, Facility
+
+FORMATS = ('csv', 'jsonl')
+
+
+def read_csv(stream):
+    """
+    Yields (line number, row) pairs from a CSV stream with a header row.
+    """
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_jsonl(stream):
+    """
+    Yields (line number, row) pairs from a stream with one JSON object per line.
+    """
+    for line_num, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            row = e  # Reported as a bad row by the importer
+        yield line_num, row
+
+
+def read_rows(stream, format):
+    if format not in FORMATS:
+        raise ValueError('Unknown import format {0!r}, expected one of {1}'.format(format, ', '.join(FORMATS)))
+    return read_csv(stream) if format == 'csv' else read_jsonl(stream)
+
+
+class ImportResult(object):
+    """
+    Counts of the rows created by an import, and the rows that were rejected.
+    """
+
+    def __init__(self):
+        self.cargos  = 0
+        self.pickups = 0
+        self.lumpers = 0
+        self.errors  = []  # (line number, message) pairs
+
+    def as_dict(self):
+        return {
+            'cargos': self.cargos,
+            'pickups': self.pickups,
+            'lumpers': self.lumpers,
+            'errors': [{'line': line, 'error': message} for line, message in self.errors],
+        }
+
+
+class CargoImporter(object):
+    """
+    Imports (line number, row) pairs as Cargo, PickupOrder and Lumper rows.
+    """
+
+    def __init__(self, chunk_size=5000, batch_size=1000):
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.brokers    = {}  # username -> Employee (or None when unknown)
+        self.facilities = {}  # id -> Facility (or None when unknown)
+
+    def run(self, rows):
+        result = ImportResult()
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, self.chunk_size))
+            if not chunk:
+                return result
+            self.import_chunk(chunk, result)
+
+    def import_chunk(self, chunk, result):
+        self._resolve(chunk)
+        loads = []
+        for line, row in chunk:
+            try:
+                loads.append(self.build(row))
+            except ValidationError as e:
+                result.errors.append((line, '; '.join(e.messages)))
+            except (TypeError, ValueError, AttributeError) as e:
+                result.errors.append((line, 'Malformed row: {0}'.format(e)))
+
+        with transaction.atomic():
+            self._insert(Cargo, [cargo for cargo, _, _ in loads])
+            for cargo, pickup, lumper in loads:
+                if pickup is not None:
+                    pickup.cargo = cargo
+            pickups = [pickup for _, pickup, _ in loads if pickup is not None]
+            self._insert(PickupOrder, pickups)
+            for _, pickup, lumper in loads:
+                if lumper is not None:
+                    lumper.pickup_order = pickup
+            lumpers = [lumper for _, _, lumper in loads if lumper is not None]
+            self._insert(Lumper, lumpers)
+
+            if connection.features.can_return_rows_from_bulk_insert:
+                # bulk_create does not send post_save, so the dashboard counters, search index,
+                # load board and matches are updated here
+                counters.adjust(
+                    num_cargos=len(loads),
+                    num_cargos_available=sum(1 for cargo, _, _ in loads if cargo.status == 'p'),
+                    num_pickuporders=len(pickups),
+                )
+                search.index(Cargo, [cargo for cargo, _, _ in loads])
+                live.publish_on_commit(live.cargo_event('created', cargo) for cargo, _, _ in loads)
+                matching.invalidate()
+
+        result.cargos  += len(loads)
+        result.pickups += len(pickups)
+        result.lumpers += len(lumpers)
+
+    def build(self, row):
+        """
+        Returns the unsaved (cargo, pickup order or None, lumper or None) for a row,
+        raising ValidationError if the row is not valid.
+        """
+        if isinstance(row, Exception):
+            raise ValidationError('Malformed row: {0}'.format(row))
+
+        broker = self.brokers.get(_text(row, 'broker'))
+        if broker is None:
+            raise ValidationError('Unknown broker {0!r}'.format(row.get('broker')))
+        cargo = Cargo(
+            description=_text(row, 'description'),
+            price=_decimal(row, 'price'),
+            price_currency=_text(row, 'price_currency') or 'USD',
+            broker=broker,
+            status=_text(row, 'status') or 'p',
+        )
+        cargo.clean_fields(exclude=['broker', 'dispatcher', 'driver'])
+
+        pickup = lumper = None
+        if _text(row, 'pickup_from'):
+            pickup = PickupOrder(
+                pickup_from=self._facility(row, 'pickup_from'),
+                deliver_to=self._facility(row, 'deliver_to'),
+                loaded=_datetime(row, 'loaded', required=True),
+                delivered=_datetime(row, 'delivered', required=True),
+            )
+            pickup.clean_fields(exclude=['cargo', 'pickup_from', 'deliver_to'])
+
+            if _text(row, 'lumper_price'):
+                lumper = Lumper(
+                    price=_decimal(row, 'lumper_price'),
+                    price_currency=_text(row, 'lumper_price_currency') or cargo.price_currency,
+                    paid=_datetime(row, 'lumper_paid', required=True),
+                )
+                lumper.clean_fields(exclude=['pickup_order', 'image'])
+        return cargo, pickup, lumper
+
+    def _facility(self, row, column):
+        facility = self.facilities.get(_text(row, column))
+        if facility is None:
+            raise ValidationError('Unknown facility {0!r} in {1}'.format(row.get(column), column))
+        return facility
+
+    def _resolve(self, chunk):
+        """
+        Loads the brokers and facilities referenced by a chunk that are not cached yet.
+        """
+        usernames, facility_ids = set(), set()
+        for _, row in chunk:
+            if not isinstance(row, dict):
+                continue
+            usernames.add(_text(row, 'broker'))
+            facility_ids.update(_text(row, column) for column in ('pickup_from', 'deliver_to'))
+        usernames = {name for name in usernames if name and name not in self.brokers}
+        facility_ids = {pk for pk in facility_ids if pk and pk not in self.facilities}
+
+        if usernames:
+            self.brokers.update(dict.fromkeys(usernames))
+            for employee in Employee.objects.select_related('user').filter(user__username__in=usernames):
+                self.brokers[employee.user.username] = employee
+        if facility_ids:
+            self.facilities.update(dict.fromkeys(facility_ids))
+            for facility in Facility.objects.filter(pk__in=[pk for pk in facility_ids if pk.isdigit()]):
+                self.facilities[str(facility.pk)] = facility
+
+    def _insert(self, model, objs):
+        if not objs:
+            return
+        if connection.features.can_return_rows_from_bulk_insert:
+            model.objects.bulk_create(objs, batch_size=self.batch_size)
+        else:
+            # The dependent rows need the primary keys, which this backend cannot
+            # return from a bulk INSERT, so fall back to one INSERT per row.
+            for obj in objs:
+                obj.save(force_insert=True)
+
+
+def _text(row, column):
+    value = row.get(column)
+    return '' if value is None else str(value).strip()
+
+
+def _datetime(row, column, required=False):
+    """
+    Parses a timestamp column; naive timestamps are taken in the current time zone.
+    """
+    value = _text(row, column)
+    if not value:
+        if required:
+            raise ValidationError('Missing timestamp in {0}'.format(column))
+        return None
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError('Invalid timestamp {0!r} in {1}'.format(value, column))
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+def _decimal(row, column):
+    try:
+        return Decimal(_text(row, column))
+    except InvalidOperation:
+        raise ValidationError('Invalid amount {0!r} in {1}'.format(row.get(column), column))
@@ -0,0 +1,187 @@
+"""
+A database-backed background job queue.
+
+enqueue() stores a call (the dotted path of a function and JSON keyword
+arguments) in the Job table. Inside a transaction the job is committed or
+rolled back with the data it is about, so a worker never sees a job for rows
+that do not exist, and a request only pays for one INSERT.
+
+Worker processes ('manage.py run_jobs') take the due jobs in run_at order. A
+worker claims a job by moving its run_at to the end of a lease
+(settings.CARGO_JOB_LEASE seconds) with a conditional UPDATE, so two workers
+never run the same job, and the job of a worker that died is picked up again
+once its lease has run out. A job that finished is deleted. A job that raised
+is retried after a backoff that doubles on each attempt (BACKOFF, up to
+MAX_BACKOFF). After max_attempts it is moved to the DeadJob table, from which
+it can be queued again in the admin.
+
+Jobs may run more than once (e.g. when a worker dies after the work but before
+deleting the job), so they must be safe to repeat.
+
+The worker also queues the jobs of settings.CARGO_PERIODIC_JOBS (dotted path ->
+seconds between runs). With settings.CARGO_JOBS_EAGER the jobs are not queued
+but run in the calling process once its transaction commits (for development
+without a worker).
+"""
+import datetime
+import logging
+import os
+import socket
+import time
+import traceback
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from cargo.models import Job, DeadJob
+
+logger = logging.getLogger(__name__)
+
+BACKOFF     = datetime.timedelta(seconds=10)
+MAX_BACKOFF = datetime.timedelta(hours=1)
+
+
+def name_of(func):
+    return '{0}.{1}'.format(func.__module__, func.__qualname__)
+
+
+def enqueue(func, queue='default', key=None, run_at=None, max_attempts=5, **kwargs):
+    """
+    Queues a call of func (a module-level function or its dotted path) with the keyword
+    arguments, which must be JSON serializable. With a key, nothing is queued if a job with
+    the same key is already waiting. Returns the Job, or None if none was queued.
+    """
+    name = func if isinstance(func, str) else name_of(func)
+    if settings.CARGO_JOBS_EAGER:
+        transaction.on_commit(lambda: _call(name, kwargs))
+        return None
+    job = Job(queue=queue, name=name, kwargs=kwargs, key=key, max_attempts=max_attempts, run_at=run_at or timezone.now())
+    if key is None:
+        job.save()
+        return job
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        return None
+    return job
+
+
+def backoff(attempts):
+    """
+    Returns how long to wait before the next attempt of a job that failed the given number of times.
+    """
+    return min(BACKOFF * 2 ** (attempts - 1), MAX_BACKOFF)
+
+
+class Worker(object):
+    """
+    Runs the due jobs of some queues (all of them by default).
+    """
+
+    def __init__(self, queues=None, name=None, lease=None):
+        self.queues = queues
+        self.name   = name or '{0}:{1}'.format(socket.gethostname(), os.getpid())
+        self.lease  = datetime.timedelta(seconds=settings.CARGO_JOB_LEASE if lease is None else lease)
+        self.stopping = False
+        self.periodic_queued = {}  # Dotted path -> when this worker last queued it
+
+    def claim(self):
+        """
+        Takes the next due job, or returns None if there is none.
+        """
+        now = timezone.now()
+        due = Job.objects.filter(run_at__lte=now).order_by('run_at', 'id')
+        if self.queues:
+            due = due.filter(queue__in=self.queues)
+        with transaction.atomic():
+            if connection.features.has_select_for_update_skip_locked:
+                # Workers skip each other's candidates instead of all racing for the first one
+                due = due.select_for_update(skip_locked=True)
+            for job in due[:10]:
+                claimed = Job.objects.filter(pk=job.pk, run_at=job.run_at).update(
+                    run_at=now + self.lease, locked_by=self.name, attempts=F('attempts') + 1)
+                if claimed:
+                    job.run_at, job.locked_by, job.attempts = now + self.lease, self.name, job.attempts + 1
+                    return job
+        return None
+
+    def run(self, job):
+        """
+        Runs a claimed job. Returns True if it succeeded.
+        """
+        try:
+            _call(job.name, job.kwargs, raise_errors=True)
+        except Exception:
+            self.failed(job, traceback.format_exc())
+            return False
+        Job.objects.filter(pk=job.pk, locked_by=self.name).delete()
+        return True
+
+    def failed(self, job, error):
+        logger.warning('Job %s %s failed (attempt %s of %s)', job.pk, job.name, job.attempts, job.max_attempts)
+        if job.attempts < job.max_attempts:
+            Job.objects.filter(pk=job.pk, locked_by=self.name).update(
+                run_at=timezone.now() + backoff(job.attempts), locked_by='', last_error=error)
+            return
+        with transaction.atomic():
+            if Job.objects.filter(pk=job.pk, locked_by=self.name).delete()[0]:
+                DeadJob.objects.create(queue=job.queue, name=job.name, kwargs=job.kwargs, attempts=job.attempts, error=error, created=job.created)
+
+    def work_off(self, limit=None):
+        """
+        Runs due jobs until there are none left (or limit jobs ran). Returns (succeeded, failed).
+        """
+        succeeded = failed = 0
+        while not self.stopping and (limit is None or succeeded + failed < limit):
+            job = self.claim()
+            if job is None:
+                break
+            if self.run(job):
+                succeeded += 1
+            else:
+                failed += 1
+            close_old_connections()
+        return succeeded, failed
+
+    def queue_periodic(self):
+        """
+        Queues the periodic jobs that are due, unless one is still waiting.
+        """
+        now = time.monotonic()
+        for name, interval in settings.CARGO_PERIODIC_JOBS.items():
+            last = self.periodic_queued.get(name)
+            if last is None or now - last >= interval:
+                enqueue(name, key='periodic:' + name)
+                self.periodic_queued[name] = now
+
+    def run_forever(self, sleep=1.0):
+        while not self.stopping:
+            try:
+                self.queue_periodic()
+                succeeded, failed = self.work_off()
+            except Exception:
+                logger.exception('Job worker %s failed to poll the queue', self.name)
+                succeeded = failed = 0
+            finally:
+                close_old_connections()
+            if not succeeded + failed:
+                time.sleep(sleep)
+
+    def stop(self, *args):
+        """
+        Lets the job being run finish, then returns from run_forever/work_off.
+        """
+        self.stopping = True
+
+
+def _call(name, kwargs, raise_errors=False):
+    try:
+        import_string(name)(**kwargs)
+    except Exception:
+        if raise_errors:
+            raise
+        logger.exception('Job %s failed', name)
@@ -0,0 +1,285 @@
+"""
+Live cargo updates for the load board, instead of refreshing the page.
+
+Cargo creations, status changes and deletions are published once, after
+their transaction commits, as small events (see publish_on_commit). Each
+process keeps the latest events in a Broker, which wakes every client waiting
+on it: one change costs one event, however many dispatchers are watching, and
+none of them re-runs the cargo query.
+
+Each event gets its id when it is sent: the time it was sent (in microseconds)
+and a random suffix, the same in every process that receives it. Clients
+long-poll the 'cargo-updates' view with the cursor of the last event they saw
+(its id) and get the newer events as soon as there are any, or an empty list
+after settings.CARGO_LIVE_TIMEOUT seconds. The view is async, so under ASGI a
+waiting client does not hold a worker thread. Any process can continue from a
+cursor: after that event if it received it, or else after the cursor's time
+(an event still on its way, or from before the process started). Only a
+client that fell further behind than the events a broker keeps is told to
+reload the page; a malformed cursor starts again from the latest event.
+
+settings.CARGO_LIVE_BACKEND decides how events reach the brokers:
+- 'local' delivers them to the broker of the publishing process only, which
+  is enough for a single worker process (gunicorn.conf.py refuses to start
+  several workers with it).
+- 'postgresql' sends them with NOTIFY on the CARGO_LIVE_CHANNEL channel. A
+  thread in each process LISTENs on its own connection and feeds its broker,
+  so every worker sees the changes made by any of them.
+"""
+import asyncio
+import collections
+import json
+import logging
+import select
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# NOTIFY payloads must stay under 8000 bytes
+MAX_PAYLOAD = 7500
+
+
+class Broker(object):
+    """
+    In-process fan-out of events. Keeps the last `size` events, in the order they
+    arrived, and wakes the waiting clients when new ones come in. Waiters may be on
+    any thread and event loop.
+    """
+
+    def __init__(self, size=1000):
+        self.events  = collections.deque(maxlen=size)
+        self.dropped = False  # Whether older events have been dropped to keep `size`
+        self.lock    = threading.Lock()
+        self.waiters = set()  # (event loop, future) pairs
+
+    def cursor(self):
+        """
+        Returns the cursor pointing after the latest event (or after now, without any).
+        """
+        with self.lock:
+            return self.events[-1]['id'] if self.events else event_id(suffix='')
+
+    def publish(self, events):
+        """
+        Adds the events (given an id by stamp(), unless they have one) and wakes the waiters.
+        """
+        with self.lock:
+            for event in stamp(events):
+                self.dropped = self.dropped or len(self.events) == self.events.maxlen
+                self.events.append(event)
+            waiters, self.waiters = self.waiters, set()
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                pass  # The loop has been closed: that client is gone
+
+    def since(self, cursor):
+        """
+        Returns the events after the cursor, or None if some of them have been dropped already.
+        """
+        with self.lock:
+            return self._since(cursor)
+
+    async def wait(self, cursor, timeout):
+        """
+        Returns the events after the cursor as soon as there are any, an empty list after timeout
+        seconds without any, or None if some of them have been dropped already.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            with self.lock:
+                events = self._since(cursor)
+                if events != []:
+                    return events
+                waiter = (loop, loop.create_future())
+                self.waiters.add(waiter)
+            try:
+                await asyncio.wait_for(waiter[1], max(0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                with self.lock:
+                    self.waiters.discard(waiter)
+                return []
+
+    def _since(self, cursor):
+        for index in range(len(self.events) - 1, -1, -1):
+            if self.events[index]['id'] == cursor:
+                return list(self.events)[index + 1:]
+        # An event this process has not received (yet), or no event at all: go by its time
+        sent = _sent(cursor)
+        if not self.events or sent >= _sent(self.events[-1]['id']):
+            return []
+        if self.dropped and sent <= _sent(self.events[0]['id']):
+            return None
+        return [event for event in self.events if _sent(event['id']) > sent]
+
+
+def event_id(suffix=None):
+    """
+    Returns a new event id: the current time in microseconds and a random suffix.
+    """
+    return '{0}-{1}'.format(time.time_ns() // 1000, uuid.uuid4().hex[:8] if suffix is None else suffix)
+
+
+def stamp(events):
+    """
+    Returns the events, each with an id.
+    """
+    return [event if 'id' in event else dict(event, id=event_id()) for event in events]
+
+
+def valid(cursor):
+    try:
+        _sent(cursor)
+    except (AttributeError, ValueError):
+        return False
+    return True
+
+
+def _sent(cursor):
+    return int(cursor.partition('-')[0])
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class LocalBackend(object):
+    """
+    Delivers the events to the broker of this process.
+    """
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def send(self, events):
+        self.broker.publish(stamp(events))
+
+    def start(self):
+        pass
+
+
+class PostgreSQLBackend(object):
+    """
+    Sends the events with NOTIFY and LISTENs for them on a dedicated connection,
+    from a background thread that feeds the broker of this process.
+    """
+
+    def __init__(self, broker, channel, using=DEFAULT_DB_ALIAS):
+        self.broker  = broker
+        self.channel = channel
+        self.using   = using
+        self.lock    = threading.Lock()
+        self.thread  = None
+
+    def send(self, events):
+        with connections[self.using].cursor() as cursor:
+            for payload in _payloads(stamp(events)):
+                cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, payload])
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='cargo-live', daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self._listen()
+            except Exception:
+                logger.exception('Listening for cargo updates failed, reconnecting')
+                time.sleep(1)
+
+    def _listen(self):
+        import psycopg2
+
+        wrapper = connections[self.using]
+        conn = psycopg2.connect(**wrapper.get_connection_params())
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute('LISTEN "{0}"'.format(self.channel.replace('"', '""')))
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self.broker.publish(json.loads(conn.notifies.pop(0).payload))
+        finally:
+            conn.close()
+
+
+def _payloads(events):
+    """
+    Splits the events into JSON arrays that fit in a NOTIFY payload.
+    """
+    chunk = []
+    for event in events:
+        if chunk and len(json.dumps(chunk + [event])) > MAX_PAYLOAD:
+            yield json.dumps(chunk)
+            chunk = []
+        chunk.append(event)
+    if chunk:
+        yield json.dumps(chunk)
+
+
+broker = Broker()
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if settings.CARGO_LIVE_BACKEND == 'postgresql':
+                _backend = PostgreSQLBackend(broker, settings.CARGO_LIVE_CHANNEL)
+            else:
+                _backend = LocalBackend(broker)
+        return _backend
+
+
+def publish_on_commit(events, using=DEFAULT_DB_ALIAS):
+    """
+    Publishes the events once the current transaction commits (right away outside one).
+    """
+    events = list(events)
+    if events:
+        transaction.on_commit(lambda: backend().send(events), using=using)
+
+
+def cargo_event(kind, cargo, previous=None):
+    """
+    Returns the event for a created, changed (status) or deleted cargo.
+    """
+    event = {'type': kind, 'cargo': cargo.pk, 'status': cargo.status}
+    if previous is not None:
+        event['previous'] = previous
+    if kind == 'created':
+        # Enough for the load board to show the new cargo without asking for it
+        event.update(description=cargo.description, price=str(cargo.price), url=cargo.get_absolute_url())
+    return event
+
+
+async def wait(cursor, timeout=None):
+    """
+    Waits for the events after the cursor (see Broker.wait); a missing or malformed cursor
+    waits for the next ones. Returns (events, new cursor), or (None, current cursor) if the
+    client has to reload.
+    """
+    backend().start()
+    if not valid(cursor):
+        cursor = broker.cursor()
+    events = await broker.wait(cursor, settings.CARGO_LIVE_TIMEOUT if timeout is None else timeout)
+    if events is None:
+        return None, broker.cursor()
+    return events, events[-1]['id'] if events else cursor
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from cargo import archive
+
+
+class Command(BaseCommand):
+    help = (
+        'Moves the cargos delivered more than CARGO_ARCHIVE_AFTER_DAYS days ago, with their events, pickup orders '
+        'and lumpers, to the archive tables, in batches (see cargo.archive). The job workers (run_jobs) already do '
+        'so periodically.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.CARGO_ARCHIVE_AFTER_DAYS, help='Archive the cargos delivered more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=archive.BATCH_SIZE, help='Cargos moved per transaction')
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to sleep between batches')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the cargos that would be archived')
+
+    def handle(self, *args, **options):
+        if options['days'] < 0 or options['batch_size'] < 1:
+            raise CommandError('--days must not be negative and --batch-size must be positive')
+        if options['dry_run']:
+            count = archive.archivable(options['days']).count()
+            self.stdout.write('{0} cargos would be archived'.format(count))
+            return
+        count = archive.archive(options['days'], options['batch_size'], pause=options['pause'],
+                                progress=self.stdout.write if options['verbosity'] > 1 else None)
+        self.stdout.write(self.style.SUCCESS('Archived {0} cargos'.format(count)))
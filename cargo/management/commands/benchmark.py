@@ -0,0 +1,71 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from cargo import benchmarks
+from cargo.models import Cargo
+
+
+class Command(BaseCommand):
+    help = (
+        'Requests the home page, the cargo list and detail pages, the broker and carrier lists and the admin '
+        'changelists from concurrent clients, and reports the throughput, p50/p99 latency and queries per '
+        'request of each (see cargo.benchmarks). Fails when a page regressed against the baseline file; '
+        '--save records the run as the new baseline. Seed the same data first (manage.py seed_data) so runs '
+        'are comparable.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', help='Comma-separated scenarios (default: all of {0})'.format(', '.join(benchmarks.SCENARIOS)))
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent clients')
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per scenario')
+        parser.add_argument('--warmup', type=int, default=5, help='Unmeasured requests per client before each scenario')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the pages requested')
+        parser.add_argument('--host', default='localhost', help='Host header (must be in ALLOWED_HOSTS)')
+        parser.add_argument('--baseline', default=os.path.join(settings.BASE_DIR, 'benchmark_baseline.json'), help='Baseline file')
+        parser.add_argument('--tolerance', type=float, default=0.25, help='Latency growth and throughput drop allowed, as a fraction')
+        parser.add_argument('--save', action='store_true', help='Save this run as the baseline instead of comparing with it')
+
+    def handle(self, *args, **options):
+        scenarios = options['scenarios'].split(',') if options['scenarios'] else list(benchmarks.SCENARIOS)
+        unknown = set(scenarios) - set(benchmarks.SCENARIOS)
+        if unknown:
+            raise CommandError('Unknown scenarios: {0}'.format(', '.join(sorted(unknown))))
+        if options['workers'] < 1 or options['requests'] < 1:
+            raise CommandError('--workers and --requests must be positive')
+
+        conditions = {
+            'engine': connection.vendor,
+            'cargos': Cargo.objects.count(),
+            'workers': options['workers'],
+            'requests': options['requests'],
+            'seed': options['seed'],
+        }
+        baseline = None
+        if not options['save']:
+            try:
+                baseline = benchmarks.load_baseline(options['baseline'])
+            except FileNotFoundError:
+                self.stdout.write(self.style.WARNING('No baseline at {0}, nothing to compare with (see --save)'.format(options['baseline'])))
+            else:
+                differences = ['{0} {1} (baseline {2})'.format(name, value, baseline['conditions'].get(name))
+                               for name, value in conditions.items() if baseline['conditions'].get(name) != value]
+                if differences:
+                    self.stdout.write(self.style.WARNING('Measured in other conditions than the baseline: ' + ', '.join(differences)))
+
+        self.stdout.write('{0:<20} {1:>10} {2:>9} {3:>9} {4:>9} {5:>7}'.format('scenario', 'req/s', 'p50 ms', 'p99 ms', 'queries', 'errors'))
+        results = benchmarks.run(scenarios, options['workers'], options['requests'], options['warmup'], options['seed'], options['host'])
+        for name, result in results.items():
+            self.stdout.write('{0:<20} {throughput:>10.1f} {p50:>9.1f} {p99:>9.1f} {1:>9} {errors:>7}'.format(
+                name, '-' if result['queries'] is None else '{0:.1f}'.format(result['queries']), **result))
+
+        if options['save']:
+            benchmarks.save_baseline(options['baseline'], results, **conditions)
+            self.stdout.write(self.style.SUCCESS('Saved the baseline to {0}'.format(options['baseline'])))
+        elif baseline is not None:
+            regressions = benchmarks.compare(results, baseline['scenarios'], options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions against {0}:\n  {1}'.format(options['baseline'], '\n  '.join(regressions)))
+            self.stdout.write(self.style.SUCCESS('No regressions against {0}'.format(options['baseline'])))
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cargo import snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        'Writes the cargo data (and the user accounts of its employees, not the other accounts) to a compact snapshot file that '
+        'restore_snapshot loads in bulk, e.g. to copy production-sized data into staging (see cargo.snapshots).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Snapshot file to write (gzip compressed, e.g. cargo.snapshot.gz)')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        counts = snapshots.dump(options['path'], progress=self.stdout.write if options['verbosity'] > 1 else None)
+        self.stdout.write(self.style.SUCCESS('Dumped {0} rows of {1} models to {2} in {3:.1f}s'.format(
+            sum(counts.values()), len(counts), options['path'], time.monotonic() - started)))
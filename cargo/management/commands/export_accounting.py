@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cargo import exports
+
+
+class Command(BaseCommand):
+    help = 'Streams an accounting export of cargos, pickup orders or lumpers as CSV or NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(exports.EXPORTS))
+        parser.add_argument('--format', choices=sorted(exports.FORMATS), default='csv')
+        parser.add_argument('--from', dest='from', help='First day to export (YYYY-MM-DD)')
+        parser.add_argument('--to', help='Last day to export (YYYY-MM-DD)')
+        parser.add_argument('--status', help='Only rows whose cargo has this status (e.g. d)')
+        parser.add_argument('--output', help='File to write to (default: standard output)')
+
+    def handle(self, *args, **options):
+        try:
+            filters = exports.parse_filters(options)
+        except ValueError as e:
+            raise CommandError(e)
+
+        lines = exports.stream(exports.EXPORTS[options['kind']], options['format'], **filters)
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
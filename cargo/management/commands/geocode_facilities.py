@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from cargo import geo
+from cargo.models import Facility
+
+
+class Command(BaseCommand):
+    help = 'Queues the geocoding of the facilities that have no location yet (e.g. those saved before geocoding existed).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Geocode every facility again (answers already cached are not asked for again)')
+
+    def handle(self, *args, **options):
+        facilities = Facility.objects.all() if options['all'] else Facility.objects.filter(latitude__isnull=True)
+        count = 0
+        for pk in facilities.values_list('pk', flat=True).iterator():
+            geo.schedule(pk)
+            count += 1
+        self.stdout.write(self.style.SUCCESS('Queued {0} facilities'.format(count)))
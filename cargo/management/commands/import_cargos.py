@@ -0,0 +1,42 @@
+import csv
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cargo.importers import CargoImporter, FORMATS, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Imports loads (cargos, pickup orders and lumpers) from a CSV or JSONL load-board file in bulk.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV (with a header row) or JSONL file to import')
+        parser.add_argument('--format', choices=FORMATS, help='File format (default: guessed from the file extension)')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows validated and committed per transaction')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per INSERT statement')
+        parser.add_argument('--errors', help='Write the rejected rows to this CSV file')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if format not in FORMATS:
+            raise CommandError('Cannot guess the format of {0}, use --format'.format(path))
+
+        started = time.monotonic()
+        importer = CargoImporter(chunk_size=options['chunk_size'], batch_size=options['batch_size'])
+        with open(path, newline='', encoding='utf-8') as stream:
+            result = importer.run(read_rows(stream, format))
+        elapsed = time.monotonic() - started
+
+        if options['errors']:
+            with open(options['errors'], 'w', newline='', encoding='utf-8') as report:
+                writer = csv.writer(report)
+                writer.writerow(['line', 'error'])
+                writer.writerows(result.errors)
+
+        self.stdout.write(self.style.SUCCESS('Imported {0} cargos, {1} pickup orders and {2} lumpers in {3:.1f}s'.format(
+            result.cargos, result.pickups, result.lumpers, elapsed)))
+        if result.errors:
+            self.stdout.write(self.style.WARNING('{0} rows rejected{1}'.format(
+                len(result.errors), ', see ' + options['errors'] if options['errors'] else '')))
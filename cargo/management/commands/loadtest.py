@@ -0,0 +1,131 @@
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+
+from cargomonitoring.pooled_postgresql import pool
+
+
+class Command(BaseCommand):
+    help = (
+        'Requests a page from several worker threads at once and reports the throughput, latency and '
+        'database connections used for each number of workers. Run it once with DB_POOL_MAX_SIZE set '
+        'and once without to compare the pool with one persistent connection per worker. With --url '
+        'the requests go over HTTP to a running server instead, e.g. to compare the WSGI and ASGI '
+        'deployments described in gunicorn.conf.py.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/cargo/cargos/', help='Page to request')
+        parser.add_argument('--workers', default='1,4,16,32', help='Comma-separated numbers of concurrent workers')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per run')
+        parser.add_argument('--host', default='localhost', help='Host header (must be in ALLOWED_HOSTS)')
+        parser.add_argument('--url', help='Base URL of a running server (e.g. http://127.0.0.1:8000) to request the page from')
+
+    def handle(self, *args, **options):
+        try:
+            worker_counts = [int(count) for count in options['workers'].split(',')]
+        except ValueError:
+            raise CommandError('--workers must be a comma-separated list of numbers')
+        if options['url']:
+            self.stdout.write('Server {0}'.format(options['url']))
+        else:
+            database = settings.DATABASES['default']
+            self.stdout.write('Engine {0}, CONN_MAX_AGE {1}, pool {2}'.format(
+                database['ENGINE'], database.get('CONN_MAX_AGE'), database.get('POOL', 'off')))
+        self.stdout.write('{0:>8} {1:>10} {2:>9} {3:>9} {4:>9} {5:>7} {6:>12} {7:>14} {8:>11}'.format(
+            'workers', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors', 'connections', 'avg wait ms', 'saturation'))
+        for workers in worker_counts:
+            result = self.run(workers, options['requests'], options['path'], options['host'], options['url'])
+            self.stdout.write('{workers:>8} {throughput:>10.1f} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f} {errors:>7} {connections:>12} {wait:>14.2f} {saturation:>11}'.format(**result))
+
+    def run(self, workers, total, path, host, url=None):
+        latencies, errors, connection_ids = [], [0], set()
+        remaining = [total]
+        lock = threading.Lock()
+        pool_before = pool.stats().get('default', {})
+        peak_in_use = [0]
+
+        def work():
+            get = _http_get(url.rstrip('/') + path) if url else _client_get(Client(HTTP_HOST=host), path)
+            try:
+                while True:
+                    with lock:
+                        if not remaining[0]:
+                            return
+                        remaining[0] -= 1
+                    started = time.perf_counter()
+                    try:
+                        status = get()
+                    except Exception:
+                        status = 500
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        latencies.append(elapsed)
+                        errors[0] += status >= 400
+                        connection = connections['default'].connection
+                        if connection is not None:
+                            connection_ids.add(id(connection))
+                        in_use = pool.stats().get('default', {}).get('in_use', 0)
+                        peak_in_use[0] = max(peak_in_use[0], in_use)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=work) for _ in range(workers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        pool_after = None if url else pool.stats().get('default')
+        latencies.sort()
+        if url:
+            opened = '-'  # The server's connections are not visible from here
+        elif pool_after:
+            opened = pool_after['opened'] - pool_before.get('opened', 0)
+        else:
+            opened = len(connection_ids)
+        return {
+            'workers': workers,
+            'throughput': len(latencies) / elapsed,
+            'p50': statistics.median(latencies) * 1000,
+            'p95': _percentile(latencies, 0.95) * 1000,
+            'p99': _percentile(latencies, 0.99) * 1000,
+            'errors': errors[0],
+            # Pooled: connections opened by the pool; persistent: one per worker that kept its connection
+            'connections': opened,
+            'wait': _average_wait(pool_before, pool_after) * 1000 if pool_after else 0.0,
+            'saturation': '{0:.0%}'.format(peak_in_use[0] / pool_after['max_size']) if pool_after else '-',
+        }
+
+
+def _client_get(client, path):
+    return lambda: client.get(path).status_code
+
+
+def _http_get(url):
+    def get():
+        try:
+            with urllib.request.urlopen(url, timeout=30) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+    return get
+
+
+def _percentile(latencies, fraction):
+    return latencies[max(0, int(len(latencies) * fraction) - 1)] if latencies else 0
+
+
+def _average_wait(before, after):
+    checkouts = after['checkouts'] - before.get('checkouts', 0)
+    return (after['wait_time'] - before.get('wait_time', 0.0)) / checkouts if checkouts else 0.0
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from cargo import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the search documents of all cargos, companies, facilities and employees (e.g. after loading fixtures).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        count = search.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Indexed {0} objects'.format(count)))
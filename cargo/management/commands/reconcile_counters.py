@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from cargo import counters
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the dashboard counters from the tables and reports any drift. Meant to run periodically (e.g. from cron).'
+
+    def handle(self, *args, **options):
+        before = counters.current()
+        after = counters.reconcile()
+        for name in counters.COUNTER_FIELDS:
+            old, new = getattr(before, name), getattr(after, name)
+            if old != new:
+                self.stdout.write(self.style.WARNING('{0}: {1} -> {2}'.format(name, old, new)))
+        self.stdout.write(self.style.SUCCESS('Counters reconciled at {0}'.format(after.reconciled)))
@@ -0,0 +1,39 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cargo import exports, rollups
+
+
+class Command(BaseCommand):
+    help = 'Brings the daily revenue and lumper cost rollups up to date. The job workers (run_jobs) already do so periodically.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='Rollups to refresh: {0} (default: all)'.format(', '.join(sorted(rollups.ROLLUPS))))
+        parser.add_argument('--rebuild', action='store_true', help='Recompute from scratch instead of from the watermark')
+        parser.add_argument('--from', dest='from', help='With --rebuild, first day to recompute (YYYY-MM-DD)')
+        parser.add_argument('--to', help='With --rebuild, last day to recompute (YYYY-MM-DD)')
+        parser.add_argument('--batch-size', type=int, default=rollups.BATCH_SIZE)
+        parser.add_argument('--lag', type=int, default=int(rollups.LAG.total_seconds()), help='Seconds of recent changes to leave for the next run')
+
+    def handle(self, *args, **options):
+        try:
+            filters = exports.parse_filters(options)
+        except ValueError as e:
+            raise CommandError(e)
+        if filters and not options['rebuild']:
+            raise CommandError('--from and --to are only valid with --rebuild')
+        unknown = set(options['names']) - set(rollups.ROLLUPS)
+        if unknown:
+            raise CommandError('Unknown rollups: {0}'.format(', '.join(sorted(unknown))))
+        lag = datetime.timedelta(seconds=options['lag'])
+
+        for name in options['names'] or sorted(rollups.ROLLUPS):
+            rollup = rollups.ROLLUPS[name]
+            if options['rebuild'] and filters:
+                days = rollup.rebuild(filters.get('start'), filters.get('end'))
+                self.stdout.write(self.style.SUCCESS('{0}: recomputed {1} days'.format(name, days)))
+            else:
+                method = rollup.rebuild if options['rebuild'] else rollup.refresh
+                rows = method(batch_size=options['batch_size'], lag=lag)
+                self.stdout.write(self.style.SUCCESS('{0}: read {1} changed rows'.format(name, rows)))
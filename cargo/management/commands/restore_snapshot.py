@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cargo import snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        'Loads a snapshot written by dump_snapshot into a migrated database, in bulk and in one transaction '
+        '(see cargo.snapshots). No signals are sent, and the cache is cleared afterwards. With --replace, ALL the '
+        'user accounts of this database (superusers included) are deleted and replaced by the snapshot\'s employee '
+        'users; run createsuperuser afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Snapshot file to load')
+        parser.add_argument('--replace', action='store_true', help='Delete the current cargo data and ALL the user accounts first')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per executemany (not used by PostgreSQL, which COPYs)')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        try:
+            counts = snapshots.restore(
+                options['path'], replace=options['replace'], batch_size=options['batch_size'],
+                progress=self.stdout.write if options['verbosity'] > 1 else None,
+            )
+        except (snapshots.SnapshotError, OSError) as e:
+            raise CommandError(e)
+        self.stdout.write(self.style.SUCCESS('Restored {0} rows of {1} models in {2:.1f}s'.format(
+            sum(counts.values()), len(counts), time.monotonic() - started)))
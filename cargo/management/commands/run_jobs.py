@@ -0,0 +1,35 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from cargo import jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs the background jobs (onboarding emails, image processing, rollup refreshes, etc.; see '
+        'cargo.jobs) and queues the periodic ones. Start as many as needed, e.g. one per CPU; they share '
+        'the queue through the database. Stops after the current job on SIGTERM or Ctrl-C.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('queues', nargs='*', help='Queues to take jobs from (default: all)')
+        parser.add_argument('--once', action='store_true', help='Run the due jobs and exit instead of waiting for more')
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait between polls of an empty queue')
+
+    def handle(self, *args, **options):
+        if settings.CACHES['default']['BACKEND'].endswith('.LocMemCache'):
+            self.stderr.write(self.style.WARNING(
+                'The cache is in local memory, so the pages the jobs invalidate stay cached in the web '
+                'processes; set CACHE_BACKEND/CACHE_LOCATION to the cache the web processes use.'
+            ))
+        worker = jobs.Worker(queues=options['queues'] or None)
+        if options['once']:
+            succeeded, failed = worker.work_off()
+            self.stdout.write(self.style.SUCCESS('{0} jobs done, {1} failed'.format(succeeded, failed)))
+            return
+        signal.signal(signal.SIGTERM, worker.stop)
+        signal.signal(signal.SIGINT, worker.stop)
+        self.stdout.write('Worker {0} waiting for jobs'.format(worker.name))
+        worker.run_forever(sleep=options['sleep'])
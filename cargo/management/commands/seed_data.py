@@ -0,0 +1,37 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cargo import seeding
+
+
+class Command(BaseCommand):
+    help = (
+        'Fills the database with consistent synthetic companies, facilities, employees, cargos, pickup orders '
+        'and lumpers for load tests and benchmarks (see cargo.seeding). The same --seed and --end always '
+        'give the same data. Seeded users log in with the password "{0}".'.format(seeding.PASSWORD)
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cargos', type=int, default=100000, help='Cargos to create; the other tables grow with it')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed')
+        parser.add_argument('--end', help='Date (YYYY-MM-DD) the cargos are posted up to (default: today)')
+        parser.add_argument('--days', type=int, default=365, help='Days the cargos are posted over')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows per INSERT statement')
+
+    def handle(self, *args, **options):
+        try:
+            end = datetime.date.fromisoformat(options['end']) if options['end'] else None
+        except ValueError:
+            raise CommandError('--end must be a date like 2024-01-31')
+        if options['cargos'] < 1 or options['days'] < 1:
+            raise CommandError('--cargos and --days must be positive')
+
+        started = time.monotonic()
+        counts = seeding.seed(
+            options['cargos'], seed=options['seed'], end=end, days=options['days'], batch_size=options['batch_size'],
+            progress=lambda message: self.stdout.write(message) if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS('Seeded {0} in {1:.1f}s'.format(
+            ', '.join('{0} {1}'.format(count, model) for model, count in counts.items()), time.monotonic() - started)))
@@ -0,0 +1,202 @@
+"""
+Matching of the open loads with a carrier's trucks.
+
+Every posted cargo whose first pickup order has geocoded facilities (see
+cargo.geo) is a candidate. For a driver's truck, at its last reported
+location (Employee.latitude/longitude), a candidate is scored by what it pays
+per mile driven:
+
+    (price - WAIT_COST * hours waiting for the pickup) / (deadhead + loaded miles)
+
+where the deadhead is the distance from the truck to the pickup facility and
+the loaded miles those from the pickup to the delivery facility (both great
+circle). Loads further than MAX_DEADHEAD, or that the truck cannot reach
+(at AVERAGE_SPEED) by their 'loaded' time plus LATE_TOLERANCE, are left out.
+Only loads priced in CURRENCY are compared.
+
+The candidates are read once into NumPy arrays (cached until a cargo's status
+or pickup orders change), and the trucks are scored against all of them at
+once, TRUCK_BATCH trucks at a time (of similar latitude, against the loads
+close enough north or south). Each truck's best matches are cached too,
+under the versions of the candidates and of the truck's location, for at most
+MATCH_TIMEOUT seconds as their timing moves with the clock.
+"""
+import datetime
+
+import numpy as np
+from django.core.cache import cache
+from django.utils import timezone
+
+from cargo import caching
+from cargo.models import Employee, PickupOrder
+
+CURRENCY = 'USD'
+
+AVERAGE_SPEED  = 50.0   # Miles per hour
+MAX_DEADHEAD   = 500.0  # Miles
+LATE_TOLERANCE = 2.0    # Hours a truck may arrive after the cargo's 'loaded' time
+WAIT_COST      = 30.0   # Per hour a truck waits for a pickup, in CURRENCY
+
+TRUCK_BATCH   = 32   # Trucks scored together; each batch holds a few TRUCK_BATCH x candidates arrays
+MATCH_TIMEOUT = 300  # Seconds
+
+EARTH_RADIUS = 3958.8  # Miles
+
+# Single precision (a few feet at these distances) is plenty for ranking, and its trigonometry
+# runs several times faster than double's
+SCORE_TYPE = np.float32
+
+# Cache kind whose version the candidates (and so all matches) are cached under
+OPEN_CARGOS = 'open-cargos'
+
+
+def invalidate():
+    """
+    Drops the cached candidates and matches, once the current transaction commits.
+    """
+    caching.invalidate_on_commit(OPEN_CARGOS, None)
+
+
+def candidates():
+    """
+    Returns the candidate loads as a dict of NumPy arrays, one entry per cargo.
+    """
+    key = caching.make_key('match-candidates', [(OPEN_CARGOS, None)])
+    return caching.get_or_compute(key, _load_candidates)
+
+
+def _load_candidates():
+    rows = PickupOrder.objects.filter(
+        cargo__status='p', cargo__price_currency=CURRENCY,
+        pickup_from__latitude__isnull=False, deliver_to__latitude__isnull=False,
+    ).order_by('cargo_id', 'loaded', 'id').values_list(
+        'cargo_id', 'cargo__price', 'loaded',
+        'pickup_from__latitude', 'pickup_from__longitude', 'deliver_to__latitude', 'deliver_to__longitude',
+    )
+    first = {}
+    for row in rows.iterator():
+        first.setdefault(row[0], row)  # The first pickup of each cargo
+    rows = list(first.values())
+    columns = list(zip(*rows)) or [()] * 7
+    pickup = np.radians(np.array([columns[3], columns[4]], dtype=np.float64).reshape(2, -1))
+    delivery = np.radians(np.array([columns[5], columns[6]], dtype=np.float64).reshape(2, -1))
+    return {
+        'cargo': np.array(columns[0], dtype=np.int64),
+        'price': np.array([float(price) for price in columns[1]], dtype=SCORE_TYPE),
+        'loaded': np.array([loaded.timestamp() for loaded in columns[2]], dtype=np.float64),
+        'latitude': pickup[0].astype(SCORE_TYPE),
+        'longitude': pickup[1].astype(SCORE_TYPE),
+        'cos_latitude': np.cos(pickup[0]).astype(SCORE_TYPE),
+        'loaded_miles': _haversine(pickup[0], pickup[1], np.cos(pickup[0]), delivery[0], delivery[1]).astype(SCORE_TYPE),
+    }
+
+
+def _haversine(latitude1, longitude1, cos_latitude1, latitude2, longitude2):
+    # Latitudes and longitudes in radians; arrays broadcast against each other. In place where
+    # possible, as the arrays of a batch are large
+    a = np.sin((latitude2 - latitude1) / 2)
+    a *= a
+    b = np.sin((longitude2 - longitude1) / 2)
+    b *= b
+    b *= cos_latitude1
+    b *= np.cos(latitude2)
+    a += b
+    np.minimum(a, 1, out=a)
+    np.sqrt(a, out=a)
+    np.arcsin(a, out=a)
+    a *= 2 * EARTH_RADIUS
+    return a
+
+
+def score(loads, trucks, limit=10, now=None):
+    """
+    Scores the loads (as returned by candidates()) for the trucks, a sequence of
+    (latitude, longitude) in degrees. Returns, for each truck, its limit best matches
+    as dicts, best first.
+    """
+    now = (now or timezone.now()).timestamp()
+    if not len(loads['cargo']) or not len(trucks):
+        return [[] for _ in trucks]
+    # Loads by latitude, and trucks batched by latitude, so each batch only scores the band of
+    # loads within MAX_DEADHEAD north and south of its trucks
+    by_latitude = np.argsort(loads['latitude'], kind='stable')
+    loads = {name: values[by_latitude] for name, values in loads.items()}
+    hours_until_loaded = ((loads['loaded'] - now) / 3600.0).astype(SCORE_TYPE)
+    reach = MAX_DEADHEAD / EARTH_RADIUS
+    points = np.radians(np.asarray(trucks, dtype=np.float64).reshape(-1, 2)).astype(SCORE_TYPE)
+    trucks_by_latitude = np.argsort(points[:, 0], kind='stable')
+    results = [None] * len(points)
+    for start in range(0, len(points), TRUCK_BATCH):
+        batch = trucks_by_latitude[start:start + TRUCK_BATCH]
+        latitude, longitude = points[batch, 0:1], points[batch, 1:2]  # Columns, to broadcast over the loads
+        first, last = np.searchsorted(loads['latitude'], [latitude.min() - reach, latitude.max() + reach])
+        band = slice(first, last)
+        if first == last:
+            for truck in batch:
+                results[truck] = []
+            continue
+        deadhead = _haversine(loads['latitude'][band], loads['longitude'][band], loads['cos_latitude'][band], latitude, longitude)
+        driving = deadhead / SCORE_TYPE(AVERAGE_SPEED)
+        late = driving - hours_until_loaded[band]
+        waiting = np.maximum(-late, SCORE_TYPE(0))
+        miles = np.maximum(deadhead + loads['loaded_miles'][band], SCORE_TYPE(1))
+        scores = loads['price'][band] - SCORE_TYPE(WAIT_COST) * waiting
+        scores /= miles
+        scores[(deadhead > MAX_DEADHEAD) | (late > LATE_TOLERANCE)] = -np.inf
+
+        # The best limit of each row, unordered, then ordered
+        count = min(limit, last - first)
+        best = np.argpartition(-scores, count - 1, axis=1)[:, :count]
+        order = np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1, kind='stable')
+        best = np.take_along_axis(best, order, axis=1)
+        for row, (truck, indexes) in enumerate(zip(batch, best)):
+            results[truck] = [
+                {
+                    'cargo': int(loads['cargo'][first + index]),
+                    'score': round(float(scores[row, index]), 4),
+                    'rate_per_mile': round(float(loads['price'][first + index] / miles[row, index]), 4),
+                    'deadhead': round(float(deadhead[row, index]), 1),
+                    'loaded_miles': round(float(loads['loaded_miles'][first + index]), 1),
+                    'loaded': datetime.datetime.fromtimestamp(loads['loaded'][first + index], datetime.timezone.utc),
+                }
+                for index in indexes if scores[row, index] > -np.inf
+            ]
+    return results
+
+
+def matches(drivers, limit=10):
+    """
+    Returns {driver id: best matches} for the located drivers (Employees) given, from the
+    cache where possible. Drivers without a location get no matches.
+    """
+    located = [driver for driver in drivers if driver.latitude is not None]
+    # The version tokens of the candidates and of every truck's location, in one round trip
+    tokens = caching.versions((OPEN_CARGOS, None), *[('truck', driver.pk) for driver in located])
+    keys = {
+        driver.pk: ':'.join([caching.KEY_PREFIX, 'matches', str(driver.pk), str(limit), tokens[0], token])
+        for driver, token in zip(located, tokens[1:])
+    }
+    found = cache.get_many(list(keys.values()))
+    result = {driver.pk: [] for driver in drivers}
+    missing = []
+    for driver in located:
+        if keys[driver.pk] in found:
+            result[driver.pk] = found[keys[driver.pk]]
+        else:
+            missing.append(driver)
+    if missing:
+        scored = score(candidates(), [(driver.latitude, driver.longitude) for driver in missing], limit)
+        computed = {keys[driver.pk]: best for driver, best in zip(missing, scored)}
+        cache.set_many(computed, timeout=MATCH_TIMEOUT)
+        for driver, best in zip(missing, scored):
+            result[driver.pk] = best
+    return result
+
+
+def report_location(employee, latitude, longitude):
+    """
+    Stores where an employee's truck is now, which changes its matches.
+    """
+    Employee.objects.filter(pk=employee.pk).update(latitude=latitude, longitude=longitude, located=timezone.now())
+    employee.latitude, employee.longitude = latitude, longitude
+    caching.invalidate_on_commit('truck', employee.pk)
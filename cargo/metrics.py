@@ -0,0 +1,335 @@
+"""
+Request metrics, in the Prometheus text format at /cargo/metrics/.
+
+MetricsMiddleware (first in MIDDLEWARE) records for every request, labelled
+with the URL name of its view (e.g. 'cargos', 'admin:cargo_cargo_changelist'):
+
+- its latency (a histogram) and status;
+- the number of SQL queries it ran (a histogram) and their total time;
+- the queries it repeated: the same SQL (parameters aside) run at least
+  settings.CARGO_DUPLICATE_QUERY_THRESHOLD times, the sign of an N+1 pattern
+  such as a list rendering each row's related objects one by one. Each is
+  counted and logged with its SQL.
+
+Queries are seen through an execute wrapper added to every database
+connection when it is opened; it records into the current request's
+Recorder, a context variable, so the queries of views offloaded to other
+threads (see cargo.offload) count too.
+
+The page also has the cache hits and misses (cargo.caching), the connection
+pool metrics (cargomonitoring.pooled_postgresql) and the job queues.
+
+Metrics are kept in memory per process. With several worker processes, set
+settings.CARGO_METRICS_DIR to a directory they share: each process then
+writes its metrics there every METRICS_FLUSH_INTERVAL seconds, and the page
+adds up those of all processes, whichever one answers.
+"""
+import asyncio
+import bisect
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from cargo import caching
+from cargo.models import Job, DeadJob
+from cargomonitoring.pooled_postgresql import pool
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS   = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+METRICS_FLUSH_INTERVAL = 10  # Seconds
+STALE_GAUGES = 60            # Seconds after which a process' file no longer counts for the gauges
+
+# Name -> (type, help, buckets)
+METRICS = {
+    'cargo_http_requests_total': ('counter', 'Requests answered, by view, method and status', None),
+    'cargo_http_request_duration_seconds': ('histogram', 'Time to answer a request, by view', LATENCY_BUCKETS),
+    'cargo_http_request_queries': ('histogram', 'SQL queries run by a request, by view', QUERY_BUCKETS),
+    'cargo_http_request_query_seconds_total': ('counter', 'Time spent in SQL queries, by view', None),
+    'cargo_http_duplicate_queries_total': ('counter', 'Queries a request repeated at least CARGO_DUPLICATE_QUERY_THRESHOLD times, by view', None),
+    'cargo_cache_hits_total': ('counter', 'Page and object cache hits', None),
+    'cargo_cache_misses_total': ('counter', 'Page and object cache misses', None),
+    'cargo_db_pool_checkouts_total': ('counter', 'Connections taken from the pool, by database', None),
+    'cargo_db_pool_waits_total': ('counter', 'Checkouts that waited for a connection, by database', None),
+    'cargo_db_pool_wait_seconds_total': ('counter', 'Time spent waiting for a pooled connection, by database', None),
+    'cargo_db_pool_connections': ('gauge', 'Pooled connections open, by database and state', None),
+    'cargo_jobs_waiting': ('gauge', 'Jobs waiting or running, by queue', None),
+    'cargo_jobs_oldest_due_seconds': ('gauge', 'How long the oldest due job of a queue has been due', None),
+    'cargo_jobs_dead': ('gauge', 'Jobs that failed all their attempts', None),
+}
+
+_current = contextvars.ContextVar('cargo_request_recorder', default=None)
+
+
+class Registry(object):
+    """
+    A process' counters, gauges and histograms, by (name, labels).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}      # (name, labels) -> value, for counters and gauges
+        self.histograms = {}  # (name, labels) -> [count per bucket (and +Inf), sum]
+        self.flushed = 0.0
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, tuple(sorted(labels)))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels)))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * (len(buckets) + 1), 0.0]
+            histogram[0][bisect.bisect_left(buckets, value)] += 1
+            histogram[1] += value
+
+    def snapshot(self):
+        """
+        Returns the metrics as JSON-serializable lists.
+        """
+        with self.lock:
+            return {
+                'values': [[name, list(labels), value] for (name, labels), value in self.values.items()],
+                'histograms': [[name, list(labels), counts[:], total] for (name, labels), (counts, total) in self.histograms.items()],
+            }
+
+
+registry = Registry()
+
+
+class Recorder(object):
+    """
+    The queries of one request.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.statements = Counter()
+
+    def record(self, sql, duration):
+        self.count += 1
+        self.time += duration
+        self.statements[sql] += 1
+
+    def duplicates(self):
+        threshold = settings.CARGO_DUPLICATE_QUERY_THRESHOLD
+        return [(sql, count) for sql, count in self.statements.most_common() if count >= threshold]
+
+
+def instrument(connection):
+    """
+    Adds the query recording to a database connection (once).
+    """
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute)
+
+
+def _execute(execute, sql, params, many, context):
+    recorder = _current.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        recorder.record(sql, time.perf_counter() - started)
+
+
+def start_request():
+    """
+    Starts recording the queries of a request. Returns the token to pass to finish_request.
+    """
+    return time.perf_counter(), _current.set(Recorder())
+
+
+def finish_request(request, status, token):
+    """
+    Records a finished request.
+    """
+    started, recorder_token = token
+    duration = time.perf_counter() - started
+    recorder = _current.get()
+    _current.reset(recorder_token)
+    request.query_recorder = recorder  # The request's queries, e.g. for cargo.benchmarks
+    match = getattr(request, 'resolver_match', None)
+    view = (match.view_name if match else None) or 'unresolved'
+    registry.inc('cargo_http_requests_total', [('view', view), ('method', request.method), ('status', str(status))])
+    registry.observe('cargo_http_request_duration_seconds', [('view', view)], duration)
+    registry.observe('cargo_http_request_queries', [('view', view)], recorder.count)
+    registry.inc('cargo_http_request_query_seconds_total', [('view', view)], recorder.time)
+    for sql, count in recorder.duplicates():
+        registry.inc('cargo_http_duplicate_queries_total', [('view', view)])
+        logger.warning('%s %s ran the same query %s times: %s', request.method, view, count, sql[:500])
+    if settings.CARGO_METRICS_DIR and time.monotonic() - registry.flushed >= METRICS_FLUSH_INTERVAL:
+        flush()
+    return duration
+
+
+class MetricsMiddleware(object):
+    """
+    Records the latency, status and queries of every request. Works in both sync and
+    async (ASGI) middleware chains.
+    """
+    sync_capable  = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Marks the instance as a coroutine function, as Django's MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        token = start_request()
+        status = 500
+        try:
+            response = self.get_response(request)
+            status = response.status_code
+        finally:
+            finish_request(request, status, token)
+        return response
+
+    async def __acall__(self, request):
+        token = start_request()
+        status = 500
+        try:
+            response = await self.get_response(request)
+            status = response.status_code
+        finally:
+            finish_request(request, status, token)
+        return response
+
+
+def process_snapshot():
+    """
+    Returns this process' metrics, with its cache and pool figures.
+    """
+    snapshot = registry.snapshot()
+    cache_stats = caching.stats()
+    values = snapshot['values']
+    values.append(['cargo_cache_hits_total', [], cache_stats['hits']])
+    values.append(['cargo_cache_misses_total', [], cache_stats['misses']])
+    for alias, stats in pool.stats().items():
+        labels = [['database', alias]]
+        values.append(['cargo_db_pool_checkouts_total', labels, stats['checkouts']])
+        values.append(['cargo_db_pool_waits_total', labels, stats['waits']])
+        values.append(['cargo_db_pool_wait_seconds_total', labels, stats['wait_time']])
+        values.append(['cargo_db_pool_connections', labels + [['state', 'idle']], stats['idle']])
+        values.append(['cargo_db_pool_connections', labels + [['state', 'in_use']], stats['in_use']])
+    return snapshot
+
+
+def flush():
+    """
+    Writes this process' metrics to its file in settings.CARGO_METRICS_DIR.
+    """
+    registry.flushed = time.monotonic()
+    path = os.path.join(settings.CARGO_METRICS_DIR, 'metrics-{0}.json'.format(os.getpid()))
+    try:
+        with open(path + '.tmp', 'w') as f:
+            json.dump(process_snapshot(), f)
+        os.replace(path + '.tmp', path)
+    except OSError:
+        logger.exception('Could not write the metrics to %s', path)
+
+
+def collect():
+    """
+    Returns the metrics of every process (or of this one alone without CARGO_METRICS_DIR),
+    added up, as {(name, labels): value} and {(name, labels): [bucket counts, sum]}.
+    """
+    snapshots = [process_snapshot()]
+    if settings.CARGO_METRICS_DIR:
+        flush()
+        snapshots = []
+        now = time.time()
+        for name in os.listdir(settings.CARGO_METRICS_DIR):
+            if not (name.startswith('metrics-') and name.endswith('.json')):
+                continue
+            path = os.path.join(settings.CARGO_METRICS_DIR, name)
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+                stale = now - os.path.getmtime(path) > STALE_GAUGES
+            except (OSError, ValueError):
+                continue
+            if stale:
+                # Counters of exited processes still count, their gauges no longer do
+                snapshot['values'] = [value for value in snapshot['values'] if METRICS[value[0]][0] != 'gauge']
+            snapshots.append(snapshot)
+    values, histograms = {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['values']:
+            key = (name, tuple(tuple(label) for label in sorted(labels)))
+            values[key] = values.get(key, 0) + value
+        for name, labels, counts, total in snapshot['histograms']:
+            key = (name, tuple(tuple(label) for label in sorted(labels)))
+            merged = histograms.setdefault(key, [[0] * len(counts), 0.0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+    _job_gauges(values)
+    return values, histograms
+
+
+def _job_gauges(values):
+    now = timezone.now()
+    for row in Job.objects.values('queue').annotate(waiting=Count('id'), oldest=Min('run_at')).order_by():
+        labels = (('queue', row['queue']),)
+        values[('cargo_jobs_waiting', labels)] = row['waiting']
+        values[('cargo_jobs_oldest_due_seconds', labels)] = max((now - row['oldest']).total_seconds(), 0)
+    values[('cargo_jobs_dead', ())] = DeadJob.objects.count()
+
+
+def render():
+    """
+    Returns the metrics in the Prometheus text exposition format.
+    """
+    values, histograms = collect()
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = sorted(key for key in values if key[0] == name)
+        hist_series = sorted(key for key in histograms if key[0] == name)
+        if not series and not hist_series:
+            continue
+        lines.append('# HELP {0} {1}'.format(name, help_text))
+        lines.append('# TYPE {0} {1}'.format(name, kind))
+        for key in series:
+            lines.append('{0}{1} {2}'.format(name, _labels(key[1]), _number(values[key])))
+        for key in hist_series:
+            counts, total = histograms[key]
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], counts):
+                cumulative += count
+                le = bound if bound == '+Inf' else _number(bound)
+                lines.append('{0}_bucket{1} {2}'.format(name, _labels(tuple(sorted(key[1] + (('le', le),)))), cumulative))
+            lines.append('{0}_sum{1} {2}'.format(name, _labels(key[1]), _number(total)))
+            lines.append('{0}_count{1} {2}'.format(name, _labels(key[1]), cumulative))
+    return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = ('{0}="{1}"'.format(key, str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')) for key, value in labels)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
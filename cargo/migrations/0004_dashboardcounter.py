@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargo', '0003_auto_20181029_0048'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('num_cargos', models.IntegerField(default=0, help_text='Number of cargos in the system')),
+                ('num_pickuporders', models.IntegerField(default=0, help_text='Number of pickup orders in the system')),
+                ('num_cargos_available', models.IntegerField(default=0, help_text="Number of cargos with status 'Posted'")),
+                ('num_brokerages', models.IntegerField(default=0, help_text='Number of brokerage companies')),
+                ('num_carriers', models.IntegerField(default=0, help_text='Number of carrier companies')),
+                ('reconciled', models.DateTimeField(blank=True, help_text='Represents a timestamp of when the counters were last recomputed from the tables', null=True)),
+            ],
+        ),
+    ]
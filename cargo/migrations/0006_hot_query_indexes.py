@@ -0,0 +1,30 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:20
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargo', '0005_cargo_posted_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cargo',
+            index=models.Index(condition=models.Q(('status__in', ['p', 'n', 'a', 'o'])), fields=['status', '-posted', '-id'], name='cargo_open_posted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='companytype',
+            index=models.Index(django.db.models.functions.text.Upper('type'), name='cargo_companytype_upper_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['company', 'user'], name='cargo_employee_company_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='facility',
+            index=models.Index(fields=['company', 'name'], name='cargo_facility_company_idx'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargo', '0006_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lumper',
+            name='image_bytes',
+            field=models.PositiveIntegerField(blank=True, editable=False, help_text='Size in bytes of the stored lumper image', null=True),
+        ),
+        migrations.AddField(
+            model_name='lumper',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, help_text='Height in pixels of the stored lumper image', null=True),
+        ),
+        migrations.AddField(
+            model_name='lumper',
+            name='image_thumbnail',
+            field=models.ImageField(blank=True, editable=False, upload_to='lumper_images/thumbnails'),
+        ),
+        migrations.AddField(
+            model_name='lumper',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, help_text='Width in pixels of the stored lumper image', null=True),
+        ),
+        migrations.AddField(
+            model_name='pickuporder',
+            name='bol_bytes',
+            field=models.PositiveIntegerField(blank=True, editable=False, help_text='Size in bytes of the stored BOL image', null=True),
+        ),
+        migrations.AddField(
+            model_name='pickuporder',
+            name='bol_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, help_text='Height in pixels of the stored BOL image', null=True),
+        ),
+        migrations.AddField(
+            model_name='pickuporder',
+            name='bol_thumbnail',
+            field=models.ImageField(blank=True, editable=False, upload_to='bol_images/thumbnails'),
+        ),
+        migrations.AddField(
+            model_name='pickuporder',
+            name='bol_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, help_text='Width in pixels of the stored BOL image', null=True),
+        ),
+        migrations.AddField(
+            model_name='pickuporder',
+            name='pod_bytes',
+            field=models.PositiveIntegerField(blank=True, editable=False, help_text='Size in bytes of the stored POD image', null=True),
+        ),
+        migrations.AddField(
+            model_name='pickuporder',
+            name='pod_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, help_text='Height in pixels of the stored POD image', null=True),
+        ),
+        migrations.AddField(
+            model_name='pickuporder',
+            name='pod_thumbnail',
+            field=models.ImageField(blank=True, editable=False, upload_to='pod_images/thumbnails'),
+        ),
+        migrations.AddField(
+            model_name='pickuporder',
+            name='pod_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, help_text='Width in pixels of the stored POD image', null=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargo', '0007_image_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CargoEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(choices=[('p', 'Posted'), ('n', 'Negotiated'), ('a', 'Assigned'), ('o', 'On route'), ('d', 'Delivered')], help_text='Status the cargo left', max_length=1)),
+                ('to_status', models.CharField(choices=[('p', 'Posted'), ('n', 'Negotiated'), ('a', 'Assigned'), ('o', 'On route'), ('d', 'Delivered')], help_text='Status the cargo entered', max_length=1)),
+                ('occurred', models.DateTimeField(default=django.utils.timezone.now, help_text='Represents a timestamp of when the status changed')),
+                ('cargo', models.ForeignKey(help_text='Represents the cargo whose status changed', on_delete=django.db.models.deletion.CASCADE, related_name='events', to='cargo.cargo')),
+                ('employee', models.ForeignKey(blank=True, help_text='Represents the employee who changed the status, if known', null=True, on_delete=django.db.models.deletion.SET_NULL, to='cargo.employee')),
+            ],
+            options={
+                'ordering': ['cargo', 'occurred'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='cargoevent',
+            index=models.Index(fields=['to_status', 'occurred'], name='cargo_event_to_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cargoevent',
+            index=models.Index(fields=['from_status', 'occurred'], name='cargo_event_from_idx'),
+        ),
+    ]
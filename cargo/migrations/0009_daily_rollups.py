@@ -0,0 +1,88 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargo', '0008_cargoevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompanyRevenueDaily',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(help_text='Day the cargos were posted')),
+                ('role', models.CharField(choices=[('b', 'Brokerage'), ('c', 'Carrier')], help_text='Whether the company was the brokerage or the carrier', max_length=1)),
+                ('currency', models.CharField(help_text='Currency of the total', max_length=3)),
+                ('total', models.DecimalField(decimal_places=2, help_text='Sum of the price of the cargos', max_digits=18)),
+                ('cargos', models.PositiveIntegerField(help_text='Number of cargos')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FacilityLumperCostDaily',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(help_text='Day the lumpers were requested')),
+                ('currency', models.CharField(help_text='Currency of the total', max_length=3)),
+                ('total', models.DecimalField(decimal_places=2, help_text='Sum of the price of the lumpers', max_digits=18)),
+                ('lumpers', models.PositiveIntegerField(help_text='Number of lumpers')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('name', models.CharField(help_text='Name of the rollup', max_length=50, primary_key=True, serialize=False)),
+                ('position', models.DateTimeField(blank=True, help_text="Represents the 'updated' timestamp of the last processed row", null=True)),
+                ('last_id', models.IntegerField(default=0, help_text='Id of the last processed row')),
+                ('refreshed', models.DateTimeField(blank=True, help_text='Represents a timestamp of when the rollup was last refreshed', null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='cargo',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, help_text='Represents a timestamp of when the cargo was last changed'),
+        ),
+        migrations.AddField(
+            model_name='lumper',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, help_text='Represents a timestamp of when the lumper was last changed'),
+        ),
+        migrations.AddIndex(
+            model_name='cargo',
+            index=models.Index(fields=['updated', 'id'], name='cargo_updated_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lumper',
+            index=models.Index(fields=['updated', 'id'], name='cargo_lumper_updated_id_idx'),
+        ),
+        migrations.AddField(
+            model_name='facilitylumpercostdaily',
+            name='facility',
+            field=models.ForeignKey(help_text='Represents the facility the cargos were picked up from', on_delete=django.db.models.deletion.CASCADE, to='cargo.facility'),
+        ),
+        migrations.AddField(
+            model_name='companyrevenuedaily',
+            name='company',
+            field=models.ForeignKey(help_text="Represents the brokerage (broker's company) or carrier (dispatcher's company)", on_delete=django.db.models.deletion.CASCADE, to='cargo.company'),
+        ),
+        migrations.AddIndex(
+            model_name='facilitylumpercostdaily',
+            index=models.Index(fields=['day'], name='cargo_lumper_cost_day_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='facilitylumpercostdaily',
+            unique_together={('facility', 'day', 'currency')},
+        ),
+        migrations.AddIndex(
+            model_name='companyrevenuedaily',
+            index=models.Index(fields=['day', 'role'], name='cargo_revenue_day_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='companyrevenuedaily',
+            unique_together={('company', 'day', 'role', 'currency')},
+        ),
+    ]
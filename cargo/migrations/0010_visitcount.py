@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargo', '0009_daily_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisitCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page', models.CharField(help_text='Name of the page (e.g. index)', max_length=100)),
+                ('day', models.DateField(help_text='Day of the visits')),
+                ('count', models.BigIntegerField(default=0, help_text='Number of visits')),
+            ],
+            options={
+                'unique_together': {('page', 'day')},
+            },
+        ),
+    ]
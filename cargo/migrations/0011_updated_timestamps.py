@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargo', '0010_visitcount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, help_text='Represents a timestamp of when the company was last changed'),
+        ),
+        migrations.AddField(
+            model_name='facility',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, help_text='Represents a timestamp of when the facility was last changed'),
+        ),
+        migrations.AddField(
+            model_name='pickuporder',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, help_text='Represents a timestamp of when the pickup order was last changed'),
+        ),
+    ]
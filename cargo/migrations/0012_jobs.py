@@ -0,0 +1,47 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:51
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargo', '0011_updated_timestamps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeadJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('queue', models.CharField(help_text='Queue the job was in', max_length=50)),
+                ('name', models.CharField(help_text='Dotted path of the function to call', max_length=200)),
+                ('kwargs', models.JSONField(blank=True, default=dict, help_text='Keyword arguments of the call')),
+                ('attempts', models.PositiveIntegerField(help_text='Number of times the job was started')),
+                ('error', models.TextField(help_text='Traceback of the last failed attempt')),
+                ('created', models.DateTimeField(help_text='Represents a timestamp of when the job was queued')),
+                ('failed', models.DateTimeField(auto_now_add=True, help_text='Represents a timestamp of when the job was given up')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('queue', models.CharField(default='default', help_text='Queue the job is in', max_length=50)),
+                ('name', models.CharField(help_text='Dotted path of the function to call', max_length=200)),
+                ('kwargs', models.JSONField(blank=True, default=dict, help_text='Keyword arguments of the call')),
+                ('key', models.CharField(blank=True, help_text='Keeps a second job with the same key from being queued while this one waits', max_length=200, null=True, unique=True)),
+                ('attempts', models.PositiveIntegerField(default=0, help_text='Number of times the job was started')),
+                ('max_attempts', models.PositiveIntegerField(default=5, help_text='Number of attempts before the job is moved to the dead jobs')),
+                ('run_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Represents a timestamp of when the job can be run next')),
+                ('locked_by', models.CharField(blank=True, help_text='Worker running the job, if any', max_length=100)),
+                ('last_error', models.TextField(blank=True, help_text='Traceback of the last failed attempt')),
+                ('created', models.DateTimeField(auto_now_add=True, help_text='Represents a timestamp of when the job was queued')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['queue', 'run_at'], name='cargo_job_queue_run_at_idx'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:54
+
+from django.db import migrations, models
+
+# The full-text index over the documents (see cargo.search), which depends on the database
+
+POSTGRESQL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "ALTER TABLE cargo_searchdocument ADD COLUMN vector tsvector GENERATED ALWAYS AS ("
+    " setweight(to_tsvector('simple', title), 'A') || setweight(to_tsvector('simple', body), 'B')) STORED",
+    "CREATE INDEX cargo_search_vector_idx ON cargo_searchdocument USING gin (vector)",
+    "CREATE INDEX cargo_search_title_trgm_idx ON cargo_searchdocument USING gin (title gin_trgm_ops)",
+]
+
+SQLITE = [
+    "CREATE VIRTUAL TABLE cargo_searchdocument_fts USING fts5("
+    " title, body, content='cargo_searchdocument', content_rowid='id',"
+    " tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER cargo_searchdocument_ai AFTER INSERT ON cargo_searchdocument BEGIN"
+    " INSERT INTO cargo_searchdocument_fts (rowid, title, body) VALUES (new.id, new.title, new.body); END",
+    "CREATE TRIGGER cargo_searchdocument_ad AFTER DELETE ON cargo_searchdocument BEGIN"
+    " INSERT INTO cargo_searchdocument_fts (cargo_searchdocument_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); END",
+    "CREATE TRIGGER cargo_searchdocument_au AFTER UPDATE ON cargo_searchdocument BEGIN"
+    " INSERT INTO cargo_searchdocument_fts (cargo_searchdocument_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);"
+    " INSERT INTO cargo_searchdocument_fts (rowid, title, body) VALUES (new.id, new.title, new.body); END",
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS cargo_searchdocument_ai",
+    "DROP TRIGGER IF EXISTS cargo_searchdocument_ad",
+    "DROP TRIGGER IF EXISTS cargo_searchdocument_au",
+    "DROP TABLE IF EXISTS cargo_searchdocument_fts",
+]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for statement in POSTGRESQL if vendor == 'postgresql' else SQLITE if vendor == 'sqlite' else []:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    # On PostgreSQL the column and indexes go with the table
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in SQLITE_REVERSE:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargo', '0012_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('cargo', 'Cargo'), ('company', 'Company'), ('facility', 'Facility'), ('employee', 'Employee')], help_text='Kind of the indexed object', max_length=10)),
+                ('object_id', models.IntegerField(help_text='Id of the indexed object')),
+                ('title', models.CharField(help_text='Main text (e.g. cargo description, company name); ranks highest', max_length=300)),
+                ('body', models.TextField(blank=True, help_text='Secondary text (e.g. facility address)')),
+                ('url', models.CharField(blank=True, help_text='Page showing the object', max_length=200)),
+                ('updated', models.DateTimeField(auto_now=True, help_text='Represents a timestamp of when the document was last indexed')),
+            ],
+            options={
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
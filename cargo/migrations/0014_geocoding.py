@@ -0,0 +1,42 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargo', '0013_searchdocument'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='facility',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='Geohash of the location, to find facilities near a point', max_length=12),
+        ),
+        migrations.AddField(
+            model_name='facility',
+            name='latitude',
+            field=models.FloatField(blank=True, editable=False, help_text='Latitude of the address in degrees', null=True),
+        ),
+        migrations.AddField(
+            model_name='facility',
+            name='longitude',
+            field=models.FloatField(blank=True, editable=False, help_text='Longitude of the address in degrees', null=True),
+        ),
+        migrations.CreateModel(
+            name='GeocodeResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(help_text='Name of the geocoder', max_length=50)),
+                ('address', models.CharField(help_text='Normalized address (lowercase, single spaces)', max_length=200)),
+                ('latitude', models.FloatField(blank=True, help_text='Latitude in degrees, empty when the address was not found', null=True)),
+                ('longitude', models.FloatField(blank=True, help_text='Longitude in degrees, empty when the address was not found', null=True)),
+                ('created', models.DateTimeField(auto_now_add=True, help_text='Represents a timestamp of when the address was geocoded')),
+            ],
+            options={
+                'unique_together': {('provider', 'address')},
+            },
+        ),
+    ]
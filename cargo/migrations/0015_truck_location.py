@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargo', '0014_geocoding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='employee',
+            name='latitude',
+            field=models.FloatField(blank=True, editable=False, help_text="Latitude of the truck's last reported location in degrees", null=True),
+        ),
+        migrations.AddField(
+            model_name='employee',
+            name='located',
+            field=models.DateTimeField(blank=True, editable=False, help_text="Represents a timestamp of when the truck's location was last reported", null=True),
+        ),
+        migrations.AddField(
+            model_name='employee',
+            name='longitude',
+            field=models.FloatField(blank=True, editable=False, help_text="Longitude of the truck's last reported location in degrees", null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargo', '0016_archive'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lumper',
+            index=models.Index(fields=['-requested', '-id'], name='cargo_lumper_requested_idx'),
+        ),
+    ]
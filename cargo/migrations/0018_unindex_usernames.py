@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+def unindex_usernames(apps, schema_editor):
+    """
+    The employee documents no longer hold the usernames (see cargo.search): blanks their bodies,
+    and drops the documents of the employees without names, whose title was the username.
+    """
+    SearchDocument = apps.get_model('cargo', 'SearchDocument')
+    Employee = apps.get_model('cargo', 'Employee')
+    SearchDocument.objects.filter(kind='employee').exclude(body='').update(body='')
+    nameless = Employee.objects.filter(user__first_name='', user__last_name='').values_list('pk', flat=True)
+    SearchDocument.objects.filter(kind='employee', object_id__in=list(nameless)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargo', '0017_lumper_requested_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(unindex_usernames, migrations.RunPython.noop),
+    ]
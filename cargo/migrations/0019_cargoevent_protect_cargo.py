@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargo', '0018_unindex_usernames'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cargoevent',
+            name='cargo',
+            field=models.ForeignKey(help_text='Represents the cargo whose status changed', on_delete=django.db.models.deletion.PROTECT, related_name='events', to='cargo.cargo'),
+        ),
+    ]
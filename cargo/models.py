@@ -1,4 +1,8 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import Q, F, OuterRef, Subquery, ExpressionWrapper
+from django.utils import timezone
+from django.db.models.functions import Upper
 from django.urls import reverse #Used to generate urls by reversing the URL patterns
 #from address.models import AddressField
 from django.contrib.auth.models import User, Group
@@ -6,12 +10,101 @@ from phonenumber_field.modelfields import PhoneNumberField
 from djmoney.models.fields import MoneyField
 
 # Create your models here.
+
+
+class EmployeeQuerySet(models.QuerySet):
+    """
+    QuerySet for Employee with the joins needed to render employees without extra queries.
+    """
+    def with_names(self):
+        """
+        Fetches the user and company used by Employee.__str__ in the same query.
+        """
+        return self.select_related('user', 'company')
+
+
+class CargoQuerySet(models.QuerySet):
+    """
+    QuerySet for Cargo with the joins needed to render cargos without extra queries.
+    """
+    def with_parties(self):
+        """
+        Fetches the broker, dispatcher and driver (with their user and company) in the same query.
+        """
+        return self.select_related(
+            'broker__company', 'broker__user',
+            'dispatcher__company', 'dispatcher__user',
+            'driver__company', 'driver__user',
+        )
+
+    def transition(self, status, when=None, employee=None, **fields):
+        """
+        Moves every cargo of the queryset that is in the status right before `status`
+        to `status`, with one UPDATE and one bulk INSERT of their CargoEvent rows.
+        Cargos in any other status are left alone. Extra keyword arguments are set on
+        the moved cargos too (e.g. dispatcher=... when negotiating).
+        Returns the ids of the moved cargos.
+        """
+        from cargo import caching, counters, live, matching
+
+        previous = Cargo.PREVIOUS_STATUS.get(status)
+        if previous is None:
+            raise ValidationError('No cargo can be moved to status {0!r}'.format(status))
+        when = when or timezone.now()
+        updates = dict(fields, status=status, updated=timezone.now())
+        if status in Cargo.STATUS_TIMESTAMPS:
+            updates[Cargo.STATUS_TIMESTAMPS[status]] = when
+
+        with transaction.atomic():
+            ids = list(self.filter(status=previous).select_for_update().order_by().values_list('pk', flat=True))
+            if ids:
+                Cargo.objects.filter(pk__in=ids, status=previous).update(**updates)
+                CargoEvent.objects.bulk_create([
+                    CargoEvent(cargo_id=pk, from_status=previous, to_status=status, occurred=when, employee=employee)
+                    for pk in ids
+                ])
+                # update() does not send post_save, so the dashboard counters, cached pages, load board and matches are updated here
+                if previous == 'p':
+                    counters.adjust(num_cargos_available=-len(ids))
+                    matching.invalidate()
+                caching.invalidate_on_commit('cargo', *ids)
+                live.publish_on_commit({'type': 'changed', 'cargo': pk, 'status': status, 'previous': previous} for pk in ids)
+        return ids
+
+
+class PickupOrderQuerySet(models.QuerySet):
+    """
+    QuerySet for PickupOrder with the joins needed to render pickup orders without extra queries.
+    """
+    def with_facilities(self):
+        """
+        Fetches the pickup and delivery facilities in the same query.
+        """
+        return self.select_related('pickup_from', 'deliver_to')
+
+
+class LumperQuerySet(models.QuerySet):
+    """
+    QuerySet for Lumper with the joins needed to render lumpers without extra queries.
+    """
+    def with_pickup_order(self):
+        """
+        Fetches the pickup order used by Lumper.__str__ in the same query.
+        """
+        return self.select_related('pickup_order')
+
        
 class CompanyType(models.Model):
     """
     Model representing a company's type (e.g. brokerage, carrier, sender/receiver)
     """
     type = models.CharField(max_length=200, unique=True, help_text="Enter the company's type (e.g. brokerage, carrier, sender/receiver)")
+
+    class Meta:
+        indexes = [
+            # Companies are looked up by type with type__type__iexact, i.e. UPPER("type") = UPPER(...)
+            models.Index(Upper('type'), name='cargo_companytype_upper_idx'),
+        ]
     
     def __str__(self):
         """
@@ -26,6 +119,7 @@ class Company(models.Model):
     """
     name = models.CharField(max_length=200, unique=True, help_text="Enter the company's name (e.g. Galiano Corp, Bravo Supermarket, etc.)")
     type = models.ForeignKey(CompanyType, on_delete=models.PROTECT, help_text="Select a type for this company")
+    updated = models.DateTimeField(auto_now=True, db_index=True, help_text="Represents a timestamp of when the company was last changed")
     
     class Meta:
         ordering = ['type', 'name']
@@ -51,9 +145,18 @@ class Facility(models.Model):
     company = models.ForeignKey(Company, on_delete=models.PROTECT, null=True, help_text="Select the company this facility belongs to")
     address = models.CharField(max_length=200, help_text="Enter the address of the facility")
     phone   = PhoneNumberField(blank=True, help_text="Enter the facility contact number (e.g. +19999999999, etc.)")
+    updated = models.DateTimeField(auto_now=True, db_index=True, help_text="Represents a timestamp of when the facility was last changed")
+
+    # Filled in by the geocoding job (see cargo.geo) once the address is saved
+    latitude  = models.FloatField(null=True, blank=True, editable=False, help_text="Latitude of the address in degrees")
+    longitude = models.FloatField(null=True, blank=True, editable=False, help_text="Longitude of the address in degrees")
+    geohash   = models.CharField(max_length=12, blank=True, db_index=True, editable=False, help_text="Geohash of the location, to find facilities near a point")
 
     class Meta:
         ordering = ['company', 'name']
+        indexes = [
+            models.Index(fields=['company', 'name'], name='cargo_facility_company_idx'),
+        ]
         #permissions = (("can_edit_book", "Allowed to edit"),)    
     
     def get_absolute_url(self):
@@ -78,8 +181,18 @@ class Employee(models.Model):
     # role    = models.ManyToManyField(Group, help_text="Select the roles this employee have in the company")
     phone   = PhoneNumberField(blank=True, help_text="Enter the employee contact number (e.g. +19999999999, etc.)")
 
+    # Where a driver's truck last reported being, for matching it with loads (see cargo.matching)
+    latitude  = models.FloatField(null=True, blank=True, editable=False, help_text="Latitude of the truck's last reported location in degrees")
+    longitude = models.FloatField(null=True, blank=True, editable=False, help_text="Longitude of the truck's last reported location in degrees")
+    located   = models.DateTimeField(null=True, blank=True, editable=False, help_text="Represents a timestamp of when the truck's location was last reported")
+
+    objects = EmployeeQuerySet.as_manager()
+
     class Meta:
         ordering = ['company', 'user']
+        indexes = [
+            models.Index(fields=['company', 'user'], name='cargo_employee_company_idx'),
+        ]
         # permissions = (("can_edit_book", "Allowed to edit"),)   
 
     # def display_role(self):
@@ -121,6 +234,13 @@ class Cargo(models.Model):
         ('o', 'On route'),
         ('d', 'Delivered'),
     )
+    OPEN_STATUSES = ['p', 'n', 'a', 'o']
+
+    # The lifecycle only moves forward: status -> next status
+    NEXT_STATUS     = {'p': 'n', 'n': 'a', 'a': 'o', 'o': 'd'}
+    PREVIOUS_STATUS = {new: old for old, new in NEXT_STATUS.items()}
+    # Status -> timestamp field set when the cargo enters it
+    STATUS_TIMESTAMPS = {'n': 'negotiated', 'a': 'assigned', 'd': 'delivered'}
 
     status     = models.CharField(max_length=1, choices=CARGO_STATUS, default='p', help_text='Cargo status')
 
@@ -131,9 +251,20 @@ class Cargo(models.Model):
     assigned   = models.DateTimeField(null=True, blank=True, help_text="Represents a timestamp of when the cargo was assigned to the driver" )
     
     delivered  = models.DateTimeField(null=True, blank=True, help_text="Represents a timestamp of when the cargo was delivered" )
+    updated    = models.DateTimeField(auto_now=True, help_text="Represents a timestamp of when the cargo was last changed")
+
+    objects = CargoQuerySet.as_manager()
 
     class Meta:
         ordering = ['-posted','description', '-price']
+        indexes = [
+            # Backs the (posted, id) keyset pagination of the cargo lists
+            models.Index(fields=['-posted', '-id'], name='cargo_posted_id_idx'),
+            # Status board: cargos that are not delivered yet, newest first
+            models.Index(fields=['status', '-posted', '-id'], name='cargo_open_posted_idx', condition=Q(status__in=['p', 'n', 'a', 'o'])),
+            # Rows changed since a watermark (see cargo.rollups)
+            models.Index(fields=['updated', 'id'], name='cargo_updated_id_idx'),
+        ]
 
     def get_absolute_url(self):
         """
@@ -141,11 +272,101 @@ class Cargo(models.Model):
         """
         return reverse('cargo-detail', args=[str(self.id)])
 
+    def transition(self, status, when=None, employee=None, **fields):
+        """
+        Moves the cargo to the next status of its lifecycle (p -> n -> a -> o -> d) and
+        records the change as a CargoEvent. Raises ValidationError if `status` is not
+        the next one, or if the cargo was moved by someone else in the meantime.
+        """
+        if Cargo.NEXT_STATUS.get(self.status) != status:
+            raise ValidationError('A cargo cannot go from {0} to {1}'.format(
+                self.get_status_display(), dict(Cargo.CARGO_STATUS).get(status, status)))
+        when = when or timezone.now()
+        if not Cargo.objects.filter(pk=self.pk).transition(status, when, employee, **fields):
+            raise ValidationError('The cargo status was changed by someone else')
+        self.status = status
+        if status in Cargo.STATUS_TIMESTAMPS:
+            setattr(self, Cargo.STATUS_TIMESTAMPS[status], when)
+        for name, value in fields.items():
+            setattr(self, name, value)
+        # The counters were already updated by the transition (see cargo.signals)
+        self._counted_status = status
+
     def __str__(self):
         """
         String for representing the Model object.
         """
         return '{0} - {1} - {2} - {3}'.format(self.posted, self.description, self.price, self.broker.company.name) 
+
+
+class CargoEventQuerySet(models.QuerySet):
+    """
+    QuerySet for CargoEvent with the time-in-state queries.
+    """
+    def _between(self, start, end):
+        queryset = self
+        if start is not None:
+            queryset = queryset.filter(occurred__gte=start)
+        if end is not None:
+            queryset = queryset.filter(occurred__lt=end)
+        return queryset
+
+    def entered(self, status, start=None, end=None):
+        """
+        Events of cargos entering `status` within [start, end).
+        """
+        return self.filter(to_status=status)._between(start, end)
+
+    def left(self, status, start=None, end=None):
+        """
+        Events of cargos leaving `status` within [start, end), annotated with the
+        `duration` the cargo spent in that status. A cargo enters 'p' when it is posted.
+        """
+        if status == 'p':
+            since = F('cargo__posted')
+        else:
+            since = Subquery(
+                CargoEvent.objects.filter(cargo=OuterRef('cargo'), to_status=status).order_by('-occurred').values('occurred')[:1]
+            )
+        return self.filter(from_status=status)._between(start, end).annotate(
+            duration=ExpressionWrapper(F('occurred') - since, output_field=models.DurationField())
+        )
+
+    def time_in_state(self, status, start=None, end=None):
+        """
+        Returns the average time spent in `status` by the cargos that left it within [start, end),
+        or None when none did.
+        """
+        return self.left(status, start, end).aggregate(average=models.Avg('duration'))['average']
+
+
+class CargoEvent(models.Model):
+    """
+    Model representing a status change of a cargo (e.g. Cargo x was assigned at time t).
+    Rows are only ever added, by Cargo.transition and CargoQuerySet.transition, and a cargo
+    with events cannot be deleted (cargo.archive moves them to the archive with their cargo).
+    """
+    cargo       = models.ForeignKey(Cargo, related_name='events', on_delete=models.PROTECT, help_text="Represents the cargo whose status changed")
+    from_status = models.CharField(max_length=1, choices=Cargo.CARGO_STATUS, help_text='Status the cargo left')
+    to_status   = models.CharField(max_length=1, choices=Cargo.CARGO_STATUS, help_text='Status the cargo entered')
+    occurred    = models.DateTimeField(default=timezone.now, help_text="Represents a timestamp of when the status changed")
+    employee    = models.ForeignKey(Employee, on_delete=models.SET_NULL, blank=True, null=True, help_text="Represents the employee who changed the status, if known")
+
+    objects = CargoEventQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['cargo', 'occurred']
+        indexes = [
+            # Time-in-state reports: cargos entering/leaving a status within a time range
+            models.Index(fields=['to_status', 'occurred'], name='cargo_event_to_idx'),
+            models.Index(fields=['from_status', 'occurred'], name='cargo_event_from_idx'),
+        ]
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+        return '{0}: {1} -> {2} {3}'.format(self.cargo_id, self.from_status, self.to_status, self.occurred)
     
 
 class PickupOrder(models.Model):
@@ -159,8 +380,21 @@ class PickupOrder(models.Model):
     bol_image   = models.ImageField(upload_to='bol_images', blank=True)
     pod_image   = models.ImageField(upload_to='pod_images', blank=True)
 
+    # Filled in by the image post-processing (see cargo.images) once an image is uploaded
+    bol_thumbnail = models.ImageField(upload_to='bol_images/thumbnails', blank=True, editable=False)
+    bol_width     = models.PositiveIntegerField(null=True, blank=True, editable=False, help_text="Width in pixels of the stored BOL image")
+    bol_height    = models.PositiveIntegerField(null=True, blank=True, editable=False, help_text="Height in pixels of the stored BOL image")
+    bol_bytes     = models.PositiveIntegerField(null=True, blank=True, editable=False, help_text="Size in bytes of the stored BOL image")
+    pod_thumbnail = models.ImageField(upload_to='pod_images/thumbnails', blank=True, editable=False)
+    pod_width     = models.PositiveIntegerField(null=True, blank=True, editable=False, help_text="Width in pixels of the stored POD image")
+    pod_height    = models.PositiveIntegerField(null=True, blank=True, editable=False, help_text="Height in pixels of the stored POD image")
+    pod_bytes     = models.PositiveIntegerField(null=True, blank=True, editable=False, help_text="Size in bytes of the stored POD image")
+
     loaded      = models.DateTimeField(blank=True, help_text="Represents a timestamp of when the cargo was loaded" )
     delivered   = models.DateTimeField(blank=True, help_text="Represents a timestamp of when the cargo was delivered" )
+    updated     = models.DateTimeField(auto_now=True, db_index=True, help_text="Represents a timestamp of when the pickup order was last changed")
+
+    objects = PickupOrderQuerySet.as_manager()
 
     class Meta:
         ordering = ['-cargo', 'pickup_from']
@@ -175,7 +409,7 @@ class PickupOrder(models.Model):
         """
         String for representing the Model object.
         """
-        return '{0}-{1} {2}'.format(self.cargo.id, self.id, self.pickup_from.name) 
+        return '{0}-{1} {2}'.format(self.cargo_id, self.id, self.pickup_from.name) 
     
 
 class Lumper(models.Model):
@@ -184,13 +418,29 @@ class Lumper(models.Model):
     """
     pickup_order = models.ForeignKey(PickupOrder, on_delete=models.PROTECT, help_text="Represents the pickup order to which the lumper was done")
     image        = models.ImageField(upload_to='lumper_images', blank=True)
+
+    # Filled in by the image post-processing (see cargo.images) once an image is uploaded
+    image_thumbnail = models.ImageField(upload_to='lumper_images/thumbnails', blank=True, editable=False)
+    image_width     = models.PositiveIntegerField(null=True, blank=True, editable=False, help_text="Width in pixels of the stored lumper image")
+    image_height    = models.PositiveIntegerField(null=True, blank=True, editable=False, help_text="Height in pixels of the stored lumper image")
+    image_bytes     = models.PositiveIntegerField(null=True, blank=True, editable=False, help_text="Size in bytes of the stored lumper image")
+
     price        = MoneyField(max_digits=14, decimal_places=2, default_currency='USD')
     requested    = models.DateTimeField(auto_now_add=True, blank=False, help_text="Represents a timestamp of when the lumper was requested" )
 
     paid      = models.DateTimeField(blank=True, help_text="Represents a timestamp of when the lumper was payed (e.g. Electronic check received" )
+    updated   = models.DateTimeField(auto_now=True, help_text="Represents a timestamp of when the lumper was last changed")
+
+    objects = LumperQuerySet.as_manager()
         
     class Meta:
         ordering = ['-requested']
+        indexes = [
+            # Rows changed since a watermark (see cargo.rollups)
+            models.Index(fields=['updated', 'id'], name='cargo_lumper_updated_id_idx'),
+            # The admin changelist, newest first and by date
+            models.Index(fields=['-requested', '-id'], name='cargo_lumper_requested_idx'),
+        ]
 
     def get_absolute_url(self):
         """
@@ -202,7 +452,338 @@ class Lumper(models.Model):
         """
         String for representing the Model object.
         """
-        return '{0}-{1}-{2} {3}'.format(self.pickup_order.cargo.id, self.pickup_order.id, self.id, self.price) 
+        return '{0}-{1}-{2} {3}'.format(self.pickup_order.cargo_id, self.pickup_order_id, self.id, self.price) 
+
+
+# Delivered cargos, with their events, pickup orders and lumpers, are moved out of the tables above
+# into the archive tables below once they are old enough (see cargo.archive). The archived rows keep
+# their ids and columns; the archive models are for reading the history.
+
+class ArchivedCargoQuerySet(models.QuerySet):
+    """
+    QuerySet for ArchivedCargo with the joins needed to render archived cargos without extra queries.
+    """
+    def with_parties(self):
+        """
+        Fetches the broker, dispatcher and driver (with their user and company) in the same query.
+        """
+        return self.select_related(
+            'broker__company', 'broker__user',
+            'dispatcher__company', 'dispatcher__user',
+            'driver__company', 'driver__user',
+        )
+
+
+class ArchivedCargo(models.Model):
+    """
+    Model representing a delivered cargo moved to the archive.
+    """
+    id          = models.IntegerField(primary_key=True, help_text="The id the cargo had (and its page keeps)")
+    description = models.CharField(max_length=200)
+    price       = MoneyField(max_digits=14, decimal_places=2, default_currency='USD')
+    broker      = models.ForeignKey(Employee, related_name='+', on_delete=models.PROTECT)
+    posted      = models.DateTimeField(help_text="Represents a timestamp of when the cargo was posted")
+    status      = models.CharField(max_length=1, choices=Cargo.CARGO_STATUS)
+    dispatcher  = models.ForeignKey(Employee, related_name='+', on_delete=models.PROTECT, null=True)
+    negotiated  = models.DateTimeField(null=True, help_text="Represents a timestamp of when the cargo was negotiated with the broker")
+    driver      = models.ForeignKey(Employee, related_name='+', on_delete=models.PROTECT, null=True)
+    assigned    = models.DateTimeField(null=True, help_text="Represents a timestamp of when the cargo was assigned to the driver")
+    delivered   = models.DateTimeField(null=True, help_text="Represents a timestamp of when the cargo was delivered")
+    updated     = models.DateTimeField(help_text="Represents a timestamp of when the cargo was last changed")
+    archived    = models.DateTimeField(db_index=True, help_text="Represents a timestamp of when the cargo was moved to the archive")
+
+    objects = ArchivedCargoQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-posted', '-id']
+
+    def get_absolute_url(self):
+        return reverse('cargo-detail', args=[str(self.id)])
+
+    def __str__(self):
+        return '{0} {1} {2} (archived)'.format(self.id, self.description, self.price)
+
+
+class ArchivedCargoEvent(models.Model):
+    """
+    Model representing a status change of an archived cargo.
+    """
+    id          = models.IntegerField(primary_key=True)
+    cargo       = models.ForeignKey(ArchivedCargo, related_name='events', on_delete=models.CASCADE)
+    from_status = models.CharField(max_length=1, choices=Cargo.CARGO_STATUS)
+    to_status   = models.CharField(max_length=1, choices=Cargo.CARGO_STATUS)
+    occurred    = models.DateTimeField()
+    employee    = models.ForeignKey(Employee, related_name='+', on_delete=models.SET_NULL, null=True)
+
+    class Meta:
+        ordering = ['cargo', 'occurred']
+
+
+class ArchivedPickupOrder(models.Model):
+    """
+    Model representing a pickup order of an archived cargo.
+    """
+    id          = models.IntegerField(primary_key=True)
+    cargo       = models.ForeignKey(ArchivedCargo, related_name='pickuporder_set', on_delete=models.PROTECT)
+    pickup_from = models.ForeignKey(Facility, related_name='+', on_delete=models.PROTECT)
+    deliver_to  = models.ForeignKey(Facility, related_name='+', on_delete=models.PROTECT)
+
+    bol_image     = models.ImageField(upload_to='bol_images', blank=True)
+    pod_image     = models.ImageField(upload_to='pod_images', blank=True)
+    bol_thumbnail = models.ImageField(upload_to='bol_images/thumbnails', blank=True)
+    bol_width     = models.PositiveIntegerField(null=True)
+    bol_height    = models.PositiveIntegerField(null=True)
+    bol_bytes     = models.PositiveIntegerField(null=True)
+    pod_thumbnail = models.ImageField(upload_to='pod_images/thumbnails', blank=True)
+    pod_width     = models.PositiveIntegerField(null=True)
+    pod_height    = models.PositiveIntegerField(null=True)
+    pod_bytes     = models.PositiveIntegerField(null=True)
+
+    loaded      = models.DateTimeField()
+    delivered   = models.DateTimeField()
+    updated     = models.DateTimeField()
+
+    objects = PickupOrderQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-cargo', 'pickup_from']
+
+    def __str__(self):
+        return '{0}-{1} {2}'.format(self.cargo_id, self.id, self.pickup_from.name)
+
+
+class ArchivedLumper(models.Model):
+    """
+    Model representing a lumper of an archived cargo's pickup order.
+    """
+    id              = models.IntegerField(primary_key=True)
+    pickup_order    = models.ForeignKey(ArchivedPickupOrder, related_name='lumper_set', on_delete=models.PROTECT)
+    image           = models.ImageField(upload_to='lumper_images', blank=True)
+    image_thumbnail = models.ImageField(upload_to='lumper_images/thumbnails', blank=True)
+    image_width     = models.PositiveIntegerField(null=True)
+    image_height    = models.PositiveIntegerField(null=True)
+    image_bytes     = models.PositiveIntegerField(null=True)
+    price           = MoneyField(max_digits=14, decimal_places=2, default_currency='USD')
+    requested       = models.DateTimeField()
+    paid            = models.DateTimeField()
+    updated         = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-requested']
+
+    def __str__(self):
+        return '{0}-{1} {2}'.format(self.pickup_order_id, self.id, self.price)
+
+
+class DashboardCounter(models.Model):
+    """
+    Model representing the precomputed record counts shown on the home page.
+    There is a single row, kept up to date by the signal handlers in cargo.signals
+    and rebuilt from scratch by the reconcile_counters management command.
+    """
+    num_cargos           = models.IntegerField(default=0, help_text="Number of cargos in the system")
+    num_pickuporders     = models.IntegerField(default=0, help_text="Number of pickup orders in the system")
+    num_cargos_available = models.IntegerField(default=0, help_text="Number of cargos with status 'Posted'")
+    num_brokerages       = models.IntegerField(default=0, help_text="Number of brokerage companies")
+    num_carriers         = models.IntegerField(default=0, help_text="Number of carrier companies")
+    reconciled           = models.DateTimeField(null=True, blank=True, help_text="Represents a timestamp of when the counters were last recomputed from the tables")
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+        return 'Dashboard counters (reconciled {0})'.format(self.reconciled)
+
+
+class CompanyRevenueDaily(models.Model):
+    """
+    Model representing the revenue of a company on one day in one currency, either as
+    the brokerage or as the carrier of the cargos posted that day.
+    Filled from the cargo table by cargo.rollups.
+    """
+    ROLES = (
+        ('b', 'Brokerage'),
+        ('c', 'Carrier'),
+    )
+
+    company  = models.ForeignKey(Company, on_delete=models.CASCADE, help_text="Represents the brokerage (broker's company) or carrier (dispatcher's company)")
+    day      = models.DateField(help_text="Day the cargos were posted")
+    role     = models.CharField(max_length=1, choices=ROLES, help_text="Whether the company was the brokerage or the carrier")
+    currency = models.CharField(max_length=3, help_text="Currency of the total")
+    total    = models.DecimalField(max_digits=18, decimal_places=2, help_text="Sum of the price of the cargos")
+    cargos   = models.PositiveIntegerField(help_text="Number of cargos")
+
+    class Meta:
+        unique_together = ('company', 'day', 'role', 'currency')
+        indexes = [
+            models.Index(fields=['day', 'role'], name='cargo_revenue_day_idx'),
+        ]
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+        return '{0} {1} {2}: {3} {4}'.format(self.day, self.company_id, self.get_role_display(), self.total, self.currency)
+
+
+class FacilityLumperCostDaily(models.Model):
+    """
+    Model representing the lumper cost paid at a pickup facility on one day in one currency.
+    Filled from the lumper table by cargo.rollups.
+    """
+    facility = models.ForeignKey(Facility, on_delete=models.CASCADE, help_text="Represents the facility the cargos were picked up from")
+    day      = models.DateField(help_text="Day the lumpers were requested")
+    currency = models.CharField(max_length=3, help_text="Currency of the total")
+    total    = models.DecimalField(max_digits=18, decimal_places=2, help_text="Sum of the price of the lumpers")
+    lumpers  = models.PositiveIntegerField(help_text="Number of lumpers")
+
+    class Meta:
+        unique_together = ('facility', 'day', 'currency')
+        indexes = [
+            models.Index(fields=['day'], name='cargo_lumper_cost_day_idx'),
+        ]
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+        return '{0} {1}: {2} {3}'.format(self.day, self.facility_id, self.total, self.currency)
+
+
+class RollupWatermark(models.Model):
+    """
+    Model representing how far a rollup has read its source table: the (updated, id)
+    of the last row it processed. See cargo.rollups.
+    """
+    name      = models.CharField(max_length=50, primary_key=True, help_text="Name of the rollup")
+    position  = models.DateTimeField(null=True, blank=True, help_text="Represents the 'updated' timestamp of the last processed row")
+    last_id   = models.IntegerField(default=0, help_text="Id of the last processed row")
+    refreshed = models.DateTimeField(null=True, blank=True, help_text="Represents a timestamp of when the rollup was last refreshed")
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+        return '{0} at {1}/{2}'.format(self.name, self.position, self.last_id)
+
+
+class VisitCount(models.Model):
+    """
+    Model representing the number of visits to a page on one day, across all visitors.
+    Counted in memory and added up here in batches by cargo.visits.
+    """
+    page  = models.CharField(max_length=100, help_text="Name of the page (e.g. index)")
+    day   = models.DateField(help_text="Day of the visits")
+    count = models.BigIntegerField(default=0, help_text="Number of visits")
+
+    class Meta:
+        unique_together = ('page', 'day')
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+        return '{0} {1}: {2}'.format(self.page, self.day, self.count)
+
+
+class SearchDocument(models.Model):
+    """
+    Model representing the searchable text of a cargo, company, facility or employee.
+    Kept up to date by cargo.search, which also maintains the full-text index over it
+    (a generated tsvector column on PostgreSQL, an FTS5 table on SQLite).
+    """
+    KINDS = (
+        ('cargo', 'Cargo'),
+        ('company', 'Company'),
+        ('facility', 'Facility'),
+        ('employee', 'Employee'),
+    )
+
+    kind      = models.CharField(max_length=10, choices=KINDS, help_text="Kind of the indexed object")
+    object_id = models.IntegerField(help_text="Id of the indexed object")
+    title     = models.CharField(max_length=300, help_text="Main text (e.g. cargo description, company name); ranks highest")
+    body      = models.TextField(blank=True, help_text="Secondary text (e.g. facility address)")
+    url       = models.CharField(max_length=200, blank=True, help_text="Page showing the object")
+    updated   = models.DateTimeField(auto_now=True, help_text="Represents a timestamp of when the document was last indexed")
+
+    class Meta:
+        unique_together = ('kind', 'object_id')
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+        return '{0} {1}: {2}'.format(self.kind, self.object_id, self.title)
+
+
+class GeocodeResult(models.Model):
+    """
+    Model representing what a geocoder answered for an address (nothing found when the
+    coordinates are empty), so every address is only sent to it once. See cargo.geo.
+    """
+    provider  = models.CharField(max_length=50, help_text="Name of the geocoder")
+    address   = models.CharField(max_length=200, help_text="Normalized address (lowercase, single spaces)")
+    latitude  = models.FloatField(null=True, blank=True, help_text="Latitude in degrees, empty when the address was not found")
+    longitude = models.FloatField(null=True, blank=True, help_text="Longitude in degrees, empty when the address was not found")
+    created   = models.DateTimeField(auto_now_add=True, help_text="Represents a timestamp of when the address was geocoded")
+
+    class Meta:
+        unique_together = ('provider', 'address')
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+        return '{0}: {1}, {2}'.format(self.address, self.latitude, self.longitude)
+
+
+class Job(models.Model):
+    """
+    Model representing a background job waiting in the queue: a function to call with
+    keyword arguments. While a worker runs it, run_at is the end of the worker's lease.
+    See cargo.jobs.
+    """
+    queue        = models.CharField(max_length=50, default='default', help_text="Queue the job is in")
+    name         = models.CharField(max_length=200, help_text="Dotted path of the function to call")
+    kwargs       = models.JSONField(default=dict, blank=True, help_text="Keyword arguments of the call")
+    key          = models.CharField(max_length=200, unique=True, null=True, blank=True, help_text="Keeps a second job with the same key from being queued while this one waits")
+    attempts     = models.PositiveIntegerField(default=0, help_text="Number of times the job was started")
+    max_attempts = models.PositiveIntegerField(default=5, help_text="Number of attempts before the job is moved to the dead jobs")
+    run_at       = models.DateTimeField(default=timezone.now, help_text="Represents a timestamp of when the job can be run next")
+    locked_by    = models.CharField(max_length=100, blank=True, help_text="Worker running the job, if any")
+    last_error   = models.TextField(blank=True, help_text="Traceback of the last failed attempt")
+    created      = models.DateTimeField(auto_now_add=True, help_text="Represents a timestamp of when the job was queued")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['queue', 'run_at'], name='cargo_job_queue_run_at_idx'),
+        ]
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+        return '{0} ({1})'.format(self.name, self.queue)
+
+
+class DeadJob(models.Model):
+    """
+    Model representing a background job that failed all its attempts, kept for inspection
+    and to be queued again by hand (see the admin).
+    """
+    queue    = models.CharField(max_length=50, help_text="Queue the job was in")
+    name     = models.CharField(max_length=200, help_text="Dotted path of the function to call")
+    kwargs   = models.JSONField(default=dict, blank=True, help_text="Keyword arguments of the call")
+    attempts = models.PositiveIntegerField(help_text="Number of times the job was started")
+    error    = models.TextField(help_text="Traceback of the last failed attempt")
+    created  = models.DateTimeField(help_text="Represents a timestamp of when the job was queued")
+    failed   = models.DateTimeField(auto_now_add=True, help_text="Represents a timestamp of when the job was given up")
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+        return '{0} ({1})'.format(self.name, self.queue)
 
 
 # class Advancement(models.Model):
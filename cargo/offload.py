@@ -0,0 +1,51 @@
+"""
+Async versions of the sync views, for the ASGI entry point (cargomonitoring/asgi.py).
+
+Under ASGI, Django runs every sync view in one shared thread (thread-sensitive
+sync_to_async), so one slow page holds up all the others. offloaded() turns a
+sync view into an async one that runs it on a pool of
+settings.CARGO_ASYNC_VIEW_THREADS threads instead, with the same database
+connection handling Django gives a request (there is no async ORM before
+Django 4.1, so the queries themselves stay synchronous). Template responses
+are rendered in the pool too, as rendering can run queries.
+"""
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.CARGO_ASYNC_VIEW_THREADS, thread_name_prefix='cargo-views')
+        return _executor
+
+
+def offloaded(view):
+    """
+    Returns an async view running the given sync view on the view thread pool.
+    """
+    @functools.wraps(view)
+    async def async_view(request, *args, **kwargs):
+        return await sync_to_async(_run, thread_sensitive=False, executor=executor())(view, request, *args, **kwargs)
+    return async_view
+
+
+def _run(view, request, *args, **kwargs):
+    # As on request_started/request_finished, which only reach the handler's own thread
+    close_old_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render') and callable(response.render):
+            response.render()
+        return response
+    finally:
+        close_old_connections()
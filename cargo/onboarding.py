@@ -0,0 +1,45 @@
+"""
+Onboarding of new employees.
+
+The new user gets no password of its own (nobody can log in as them yet) and
+is emailed a link to choose one, by a background job (see cargo.jobs) so the
+request does not wait for the SMTP server and a failing send is retried.
+"""
+from django.contrib.auth.models import User
+from django.contrib.auth.tokens import default_token_generator
+from django.core.mail import send_mail
+from django.template.loader import render_to_string
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from cargo import jobs
+from cargo.models import Employee
+
+SUBJECT = 'Welcome to Cargo Monitoring'
+
+
+def welcome(user, domain, use_https):
+    """
+    Queues the welcome email of a new employee's user, with the site's domain for the link.
+    """
+    jobs.enqueue(send_welcome_email, queue='email', user_id=user.pk, domain=domain, use_https=use_https)
+
+
+def send_welcome_email(user_id, domain, use_https):
+    """
+    Job emailing a new employee the link to choose their password. Does nothing if they
+    have no email address or have already chosen a password.
+    """
+    user = User.objects.filter(pk=user_id).first()
+    if user is None or not user.email or user.has_usable_password():
+        return
+    company = Employee.objects.select_related('company').get(user=user).company
+    body = render_to_string('cargo/email/onboarding.txt', {
+        'user': user,
+        'company': company,
+        'domain': domain,
+        'protocol': 'https' if use_https else 'http',
+        'uid': urlsafe_base64_encode(force_bytes(user.pk)),
+        'token': default_token_generator.make_token(user),
+    })
+    send_mail(SUBJECT, body, None, [user.email])
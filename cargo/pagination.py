@@ -0,0 +1,211 @@
+"""
+Keyset (cursor) pagination.
+
+Django's Paginator pages with OFFSET and runs a COUNT(*) per page, so deep pages
+get slower as the table grows. CursorPaginator instead remembers the ordering
+key of the first/last row shown and asks for the rows right before/after it,
+which an index on the ordering columns answers directly. It never counts, and
+it hands out opaque next/previous tokens instead of page numbers.
+
+The ordering must be unique (end it with 'id' if needed) and made of non-null
+local fields, e.g. ('-posted', '-id') for cargos.
+
+EstimatedCountPaginator keeps the numbered pages (for the admin changelists)
+but, on PostgreSQL, takes the size of an unfiltered list of a large table from
+the planner's statistics instead of counting it.
+"""
+import base64
+import functools
+import json
+import operator
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+# Tables estimated to hold fewer rows than this are counted exactly
+ESTIMATE_THRESHOLD = 100000
+
+
+class InvalidCursor(Exception):
+    """
+    Raised when a cursor token cannot be decoded for the paginator's ordering.
+    """
+    pass
+
+
+class CursorPage(object):
+    """
+    One page of results, with tokens to reach the pages next to it.
+    """
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list     = object_list
+        self.next_cursor     = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<CursorPage of {0} objects>'.format(len(self.object_list))
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator(object):
+    """
+    Pages through a queryset ordered by the given keys (e.g. ('-posted', '-id'))
+    without OFFSET and without counting the rows.
+    """
+    NEXT     = 'n'
+    PREVIOUS = 'p'
+
+    def __init__(self, queryset, per_page, ordering):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        opts = queryset.model._meta
+        self.keys = [
+            (opts.pk if key.lstrip('-') == 'pk' else opts.get_field(key.lstrip('-')), key.startswith('-'))
+            for key in self.ordering
+        ]
+
+    def encode_cursor(self, direction, obj):
+        """
+        Returns the opaque token pointing just after (NEXT) or before (PREVIOUS) the given
+        object (or values() row, which must include the ordering fields).
+        """
+        if isinstance(obj, dict):
+            # A values() row: the key fields are serialized through a model instance holding them
+            obj = self.queryset.model(**{field.attname: obj[field.attname] for field, _ in self.keys})
+        values = [field.value_to_string(obj) for field, _ in self.keys]
+        data = json.dumps([direction] + values, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """
+        Returns the (direction, key values) pair a token was built from.
+        """
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            direction, *values = json.loads(data.decode())
+            if direction not in (self.NEXT, self.PREVIOUS) or len(values) != len(self.keys):
+                raise ValueError(cursor)
+            return direction, [field.to_python(value) for (field, _), value in zip(self.keys, values)]
+        except (ValueError, TypeError, ValidationError):
+            raise InvalidCursor(cursor)
+
+    def _seek(self, values, forward):
+        """
+        Builds the filter for the rows after (forward) or before the given key values:
+        (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ..., with each comparison flipped for descending keys.
+        """
+        conditions = []
+        equal = {}
+        for (field, descending), value in zip(self.keys, values):
+            lookup = '{0}__{1}'.format(field.attname, 'lt' if descending == forward else 'gt')
+            conditions.append(Q(**dict(equal, **{lookup: value})))
+            equal[field.attname] = value
+        condition = functools.reduce(operator.or_, conditions)
+        # Repeat the bound on the leading key on its own, so it can drive an index range scan
+        field, descending = self.keys[0]
+        bound = Q(**{'{0}__{1}'.format(field.attname, 'lte' if descending == forward else 'gte'): values[0]})
+        return bound & condition
+
+    def page(self, cursor=None):
+        """
+        Returns the CursorPage the token points to (the first page when no token is given).
+        """
+        direction, values = self.decode_cursor(cursor) if cursor else (self.NEXT, None)
+        forward = direction == self.NEXT
+        ordering = self.ordering if forward else tuple(
+            key[1:] if key.startswith('-') else '-' + key for key in self.ordering
+        )
+        queryset = self.queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, forward))
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_more or not forward:
+                next_cursor = self.encode_cursor(self.NEXT, rows[-1])
+            if (has_more and not forward) or (forward and values is not None):
+                previous_cursor = self.encode_cursor(self.PREVIOUS, rows[0])
+        return CursorPage(rows, next_cursor, previous_cursor)
+
+
+class CursorPaginationMixin(object):
+    """
+    ListView mixin that switches the view to keyset pagination when cursor_ordering
+    is set, reading the page token from the 'cursor' query parameter.
+    Leave cursor_ordering unset to keep Django's numbered pages.
+    """
+    cursor_ordering = None
+    cursor_kwarg    = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.cursor_ordering:
+            return super(CursorPaginationMixin, self).paginate_queryset(queryset, page_size)
+        paginator = CursorPaginator(queryset, page_size, self.cursor_ordering)
+        try:
+            page = self.get_cursor_page(paginator, self.request.GET.get(self.cursor_kwarg))
+        except InvalidCursor:
+            raise Http404('Invalid page cursor.')
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    def get_cursor_page(self, paginator, cursor):
+        return paginator.page(cursor)
+
+
+def estimated_count(queryset):
+    """
+    Returns PostgreSQL's estimate of the number of rows of an unfiltered queryset's table
+    (pg_class.reltuples, as of the last ANALYZE), or None when there is none to use.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql' or queryset.query.where or queryset.query.distinct:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [connection.ops.quote_name(queryset.model._meta.db_table)])
+        row = cursor.fetchone()
+    # -1 (or 0 on older versions) until the table is analyzed
+    return int(row[0]) if row and row[0] > 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator counting an unfiltered list of ESTIMATE_THRESHOLD rows or more from the table
+    statistics (see estimated_count) rather than with a COUNT(*) reading the whole table.
+    Filtered lists, smaller tables and other databases are counted exactly. The last pages of
+    an estimated list may be empty or missing, which the admin changelists put up with.
+    """
+
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list) if hasattr(self.object_list, 'query') else None
+        if estimate is not None and estimate >= ESTIMATE_THRESHOLD:
+            return estimate
+        return super(EstimatedCountPaginator, self).count
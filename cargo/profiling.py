@@ -0,0 +1,136 @@
+"""
+Opt-in profiling of slow requests.
+
+With settings.CARGO_PROFILE_SAMPLE_RATE above 0, ProfilingMiddleware profiles
+that fraction of the requests (chosen at random, so the overhead stays
+bounded). When a profiled request takes longer than
+settings.CARGO_PROFILE_SLOW seconds, two files are written to
+settings.CARGO_PROFILE_DIR, named after the time, the view and the duration:
+
+- <name>.prof: the cProfile statistics, e.g. for 'python -m pstats' or snakeviz;
+- <name>.folded: the request thread's stacks, sampled every SAMPLE_INTERVAL
+  seconds, in the collapsed format of flamegraph.pl and speedscope
+  ('frame;frame;frame count' lines).
+
+Only the newest settings.CARGO_PROFILE_KEEP profiles are kept. Requests run
+as async views (under ASGI) are not profiled, as their work happens in other
+threads.
+"""
+import asyncio
+import cProfile
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_INTERVAL = 0.005  # Seconds
+
+
+class StackSampler(object):
+    """
+    Samples the stack of one thread from a background thread, counting each distinct stack.
+    """
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval  = interval
+        self.stacks    = Counter()
+        self.stopped   = threading.Event()
+        self.thread    = threading.Thread(target=self.run, name='cargo-stack-sampler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{0}:{1}'.format(frame.f_globals.get('__name__', '?'), code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def folded(self):
+        return ''.join('{0} {1}\n'.format(stack, count) for stack, count in sorted(self.stacks.items()))
+
+
+class ProfilingMiddleware(object):
+    """
+    Profiles a sample of the requests and saves the profiles of the slow ones. In an async
+    (ASGI) middleware chain it lets requests through unprofiled.
+    """
+    sync_capable  = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Marks the instance as a coroutine function, as Django's MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.get_response(request)
+        rate = settings.CARGO_PROFILE_SAMPLE_RATE
+        if not rate or random.random() >= rate:
+            return self.get_response(request)
+        profile = cProfile.Profile()
+        sampler = StackSampler(threading.get_ident())
+        started = time.perf_counter()
+        sampler.start()
+        profile.enable()
+        try:
+            return self.get_response(request)
+        finally:
+            profile.disable()
+            sampler.stop()
+            duration = time.perf_counter() - started
+            if duration >= settings.CARGO_PROFILE_SLOW:
+                save(request, duration, profile, sampler)
+
+
+def save(request, duration, profile, sampler):
+    """
+    Writes the profile of a slow request to CARGO_PROFILE_DIR.
+    """
+    match = getattr(request, 'resolver_match', None)
+    view = re.sub(r'[^\w.-]', '_', (match.view_name if match else None) or 'unresolved')
+    name = '{0}-{1}-{2}ms'.format(time.strftime('%Y%m%d-%H%M%S'), view, int(duration * 1000))
+    directory = settings.CARGO_PROFILE_DIR
+    try:
+        os.makedirs(directory, exist_ok=True)
+        profile.dump_stats(os.path.join(directory, name + '.prof'))
+        with open(os.path.join(directory, name + '.folded'), 'w') as f:
+            f.write(sampler.folded())
+        prune(directory, settings.CARGO_PROFILE_KEEP)
+    except OSError:
+        logger.exception('Could not save the profile of %s %s', request.method, request.path)
+        return
+    logger.info('Profiled %s %s (%.0f ms) into %s', request.method, request.path, duration * 1000, name)
+
+
+def prune(directory, keep):
+    """
+    Deletes all but the newest keep profiles.
+    """
+    names = sorted({name.rsplit('.', 1)[0] for name in os.listdir(directory) if name.endswith(('.prof', '.folded'))})
+    for name in names[:max(len(names) - keep, 0)]:
+        for extension in ('.prof', '.folded'):
+            try:
+                os.remove(os.path.join(directory, name + extension))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,209 @@
+"""
+Daily rollups of the revenue per company and of the lumper cost per facility.
+
+Summing Cargo.price per broker__company / dispatcher__company, or Lumper.price
+per pickup_order__pickup_from, over the whole history is a multi-join
+aggregation the reports cannot afford on every request. Instead the sums are
+kept per day and currency in CompanyRevenueDaily and FacilityLumperCostDaily,
+and the reports add up those (few) rows.
+
+refresh() brings a rollup up to date incrementally. It reads the source rows
+changed since the rollup's watermark (their 'updated' timestamp and id, in
+batches, through the (updated, id) index), and recomputes every day those rows
+fall on from the source table. Each batch is recomputed and the watermark
+moved forward in the same transaction, so an interrupted refresh resumes where
+it stopped and running it twice changes nothing. Rows changed during the last
+LAG are left for the next run, so that a transaction that is still open when
+the refresh runs is not skipped over.
+
+Deleted rows leave nothing behind to find them by, so the handlers in
+cargo.signals queue a job recomputing their day when they are deleted. rebuild() recomputes a
+range of days, or everything, from scratch.
+
+Cargos and lumpers moved to the archive (see cargo.archive) keep counting:
+the days are computed from the live and the archive tables together.
+
+Days are the days of the current time zone; a cargo counts on the day it was
+posted and a lumper on the day it was requested. Amounts are never converted:
+each currency has its own rows.
+"""
+import datetime
+import functools
+import operator
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from cargo.models import Cargo, Lumper, ArchivedCargo, ArchivedLumper, CompanyRevenueDaily, FacilityLumperCostDaily, RollupWatermark
+
+BATCH_SIZE = 1000
+
+LAG = datetime.timedelta(minutes=1)
+
+
+class Rollup(object):
+    """
+    A daily rollup of the price of a source model (and of its archive model, which has the
+    same fields) into a table, grouped by day, currency, and one or more (fixed values, key
+    field, source lookup) groupings.
+    """
+
+    def __init__(self, name, source, archive, date_field, table, count_field, groups):
+        self.name        = name
+        self.source      = source
+        self.archive     = archive
+        self.date_field  = date_field
+        self.table       = table
+        self.count_field = count_field
+        self.groups      = groups
+
+    def compute(self, days):
+        """
+        Returns the (unsaved) rollup rows of the given days, computed from the source and archive tables.
+        """
+        days = sorted(days)
+        if not days:
+            return []
+        in_days = functools.reduce(operator.or_, [
+            Q(**{self.date_field + '__gte': _start_of(day), self.date_field + '__lt': _start_of(day + datetime.timedelta(days=1))})
+            for day in days
+        ])
+        rows = {}
+        for fixed, key, lookup in self.groups:
+            for model in (self.source, self.archive):
+                totals = model.objects.filter(in_days).exclude(**{lookup: None}).order_by().values(
+                    key_id=F(lookup), currency=F('price_currency'), day=TruncDate(self.date_field),
+                ).annotate(total=Sum('price'), count=Count('pk'))
+                for total in totals:
+                    group = (tuple(sorted(fixed.items())), total['key_id'], total['day'], total['currency'])
+                    row = rows.get(group)
+                    if row is None:
+                        rows[group] = self.table(
+                            day=total['day'], currency=total['currency'], total=total['total'],
+                            **dict(fixed, **{key: total['key_id'], self.count_field: total['count']})
+                        )
+                    else:
+                        row.total += total['total']
+                        setattr(row, self.count_field, getattr(row, self.count_field) + total['count'])
+        return list(rows.values())
+
+    def recompute(self, days):
+        """
+        Replaces the rollup rows of the given days with freshly computed ones.
+        """
+        with transaction.atomic():
+            self.table.objects.filter(day__in=days).delete()
+            self.table.objects.bulk_create(self.compute(days))
+
+    def refresh(self, batch_size=BATCH_SIZE, lag=LAG):
+        """
+        Recomputes the days of the source rows changed since the watermark, one batch at a time.
+        Returns the number of source rows read.
+        """
+        until = timezone.now() - lag
+        processed = 0
+        while True:
+            with transaction.atomic():
+                watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(name=self.name)
+                changed = self.source.objects.filter(updated__lt=until)
+                if watermark.position is not None:
+                    changed = changed.filter(
+                        Q(updated__gt=watermark.position) | Q(updated=watermark.position, id__gt=watermark.last_id)
+                    )
+                batch = list(changed.order_by('updated', 'id').values_list('updated', 'id', self.date_field)[:batch_size])
+                if batch:
+                    self.recompute({timezone.localdate(date) for _, _, date in batch})
+                    watermark.position, watermark.last_id, _ = batch[-1]
+                watermark.refreshed = timezone.now()
+                watermark.save()
+            processed += len(batch)
+            if len(batch) < batch_size:
+                return processed
+
+    def rebuild(self, start=None, end=None, batch_size=BATCH_SIZE, lag=LAG):
+        """
+        Recomputes the days from start to end (both included). Without a range, empties
+        the rollup and reads the whole source table again (and the archive's days).
+        """
+        if start is None and end is None:
+            with transaction.atomic():
+                self.table.objects.all().delete()
+                RollupWatermark.objects.filter(name=self.name).delete()
+                # Archived rows never change, so the watermark would not bring them back
+                self.recompute(self._days(self.archive, None, None))
+            return self.refresh(batch_size, lag)
+        days = self._days(self.source, start, end) | self._days(self.archive, start, end)
+        # Days that have rollup rows but no source rows any more must be emptied too
+        days.update(_between(self.table.objects.all(), start, end).values_list('day', flat=True).distinct())
+        self.recompute(days)
+        return len(days)
+
+    def _days(self, model, start, end):
+        rows = model.objects.all()
+        if start is not None:
+            rows = rows.filter(**{self.date_field + '__gte': _start_of(start)})
+        if end is not None:
+            rows = rows.filter(**{self.date_field + '__lt': _start_of(end + datetime.timedelta(days=1))})
+        return set(rows.order_by().annotate(day=TruncDate(self.date_field)).values_list('day', flat=True).distinct())
+
+
+ROLLUPS = {
+    'revenue': Rollup('revenue', Cargo, ArchivedCargo, 'posted', CompanyRevenueDaily, 'cargos', [
+        ({'role': 'b'}, 'company_id', 'broker__company'),
+        ({'role': 'c'}, 'company_id', 'dispatcher__company'),
+    ]),
+    'lumper_costs': Rollup('lumper_costs', Lumper, ArchivedLumper, 'requested', FacilityLumperCostDaily, 'lumpers', [
+        ({}, 'facility_id', 'pickup_order__pickup_from'),
+    ]),
+}
+
+
+def refresh_all():
+    """
+    Job refreshing every rollup, queued periodically by the job workers (see CARGO_PERIODIC_JOBS).
+    """
+    for name in sorted(ROLLUPS):
+        ROLLUPS[name].refresh()
+
+
+def recompute_days(name, days):
+    """
+    Job recomputing the given days (ISO dates) of a rollup.
+    """
+    ROLLUPS[name].recompute({datetime.date.fromisoformat(day) for day in days})
+
+
+def revenue(start=None, end=None, role=None):
+    """
+    Revenue per company, role and currency over the days from start to end (both included).
+    """
+    rows = _between(CompanyRevenueDaily.objects.all(), start, end)
+    if role:
+        rows = rows.filter(role=role)
+    return rows.values('company_id', 'company__name', 'role', 'currency').annotate(
+        total=Sum('total'), cargos=Sum('cargos'),
+    ).order_by('company__name', 'role', 'currency')
+
+
+def lumper_costs(start=None, end=None):
+    """
+    Lumper cost per pickup facility and currency over the days from start to end (both included).
+    """
+    rows = _between(FacilityLumperCostDaily.objects.all(), start, end)
+    return rows.values('facility_id', 'facility__name', 'currency').annotate(
+        total=Sum('total'), lumpers=Sum('lumpers'),
+    ).order_by('facility__name', 'currency')
+
+
+def _between(rows, start, end):
+    if start is not None:
+        rows = rows.filter(day__gte=start)
+    if end is not None:
+        rows = rows.filter(day__lte=end)
+    return rows
+
+
+def _start_of(date):
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
@@ -0,0 +1,212 @@
+"""
+Search over cargo descriptions, company names, facility names and addresses and
+employee names.
+
+Each searchable object has a SearchDocument row holding its text: a title (the
+description or name, ranked highest) and a body (e.g. the facility address).
+The signal handlers in cargo.signals (and the bulk import) keep the documents
+current; 'manage.py rebuild_search_index' rebuilds them all.
+
+The full-text index over the documents depends on the database (see migration
+0013_searchdocument):
+
+- PostgreSQL: a generated tsvector column (title weighted A, body B, 'simple'
+  configuration: no stemming, which suits names and addresses) with a GIN
+  index, and a pg_trgm GIN index on the title for queries with typos.
+- SQLite (development): an FTS5 table over the documents, kept in sync by
+  triggers, ranked with bm25.
+- Anything else: case-insensitive substring matching, unranked.
+
+Queries are split into words that must all match; the last word may be
+incomplete (it matches as a prefix), so the same query serves as-you-type
+autocompletion. autocomplete() only looks at titles. Of the matches, at most
+MAX_CANDIDATES (the newest documents) are ranked.
+"""
+import re
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.urls import reverse
+
+from cargo.models import Cargo, Company, Employee, Facility, SearchDocument
+
+MAX_TERMS = 8
+# Only the most recently indexed matches are ranked, so a word found in most documents does not
+# cost a ranking of all of them
+MAX_CANDIDATES = 500
+
+
+def _cargo(cargo):
+    return cargo.description, '', reverse('cargo-detail', args=[cargo.pk])
+
+
+def _company(company):
+    return company.name, '', reverse('company-detail', args=[company.pk])
+
+
+def _facility(facility):
+    return facility.name, facility.address, reverse('company-detail', args=[facility.company_id]) if facility.company_id else ''
+
+
+def _employee(employee):
+    # Only the names: the search is public, so the usernames (the login names) are not indexed
+    user = employee.user
+    if user is None or not user.get_full_name():
+        return '', '', ''
+    return user.get_full_name(), '', reverse('company-detail', args=[employee.company_id])
+
+
+# Model -> (kind, document builder returning (title, body, url), queryset for rebuilding)
+INDEXED = {
+    Cargo: ('cargo', _cargo, lambda: Cargo.objects.only('id', 'description')),
+    Company: ('company', _company, lambda: Company.objects.only('id', 'name')),
+    Facility: ('facility', _facility, lambda: Facility.objects.only('id', 'name', 'address', 'company_id')),
+    Employee: ('employee', _employee, lambda: Employee.objects.select_related('user').only(
+        'id', 'company_id', 'user__first_name', 'user__last_name')),
+}
+
+
+def index(model, objs):
+    """
+    Replaces the search documents of the given (saved) objects of a model.
+    """
+    kind, build, _ = INDEXED[model]
+    documents = []
+    for obj in objs:
+        title, body, url = build(obj)
+        if title or body:
+            documents.append(SearchDocument(kind=kind, object_id=obj.pk, title=title[:300], body=body, url=url))
+    with transaction.atomic():
+        SearchDocument.objects.filter(kind=kind, object_id__in=[obj.pk for obj in objs]).delete()
+        SearchDocument.objects.bulk_create(documents)
+
+
+def unindex(model, pks):
+    SearchDocument.objects.filter(kind=INDEXED[model][0], object_id__in=pks).delete()
+
+
+def rebuild(batch_size=2000):
+    """
+    Rebuilds every search document. Returns the number of objects indexed.
+    """
+    count = 0
+    for model, (kind, _, queryset) in INDEXED.items():
+        SearchDocument.objects.filter(kind=kind).delete()
+        batch = []
+        for obj in queryset().order_by('pk').iterator(chunk_size=batch_size):
+            batch.append(obj)
+            if len(batch) == batch_size:
+                index(model, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            index(model, batch)
+            count += len(batch)
+    return count
+
+
+def terms(query):
+    """
+    Returns the words of a query (lowercased, at most MAX_TERMS).
+    """
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def search(query, kinds=None, limit=20):
+    """
+    Returns the best matching SearchDocuments for the query (best first), each with a 'rank'.
+    """
+    words = terms(query)
+    if not words:
+        return []
+    kinds = list(kinds or [])
+    if connection.vendor == 'postgresql':
+        results = _postgresql(words, kinds, limit, title_only=False)
+        return results or _postgresql_similar(' '.join(words), kinds, limit)
+    if connection.vendor == 'sqlite':
+        return _sqlite(words, kinds, limit, title_only=False)
+    return _substring(words, kinds, limit, title_only=False)
+
+
+def autocomplete(prefix, kinds=None, limit=10):
+    """
+    Returns the distinct titles of the best documents whose title matches the prefix.
+    """
+    words = terms(prefix)
+    if not words:
+        return []
+    kinds = list(kinds or [])
+    if connection.vendor == 'postgresql':
+        documents = _postgresql(words, kinds, limit * 2, title_only=True)
+    elif connection.vendor == 'sqlite':
+        documents = _sqlite(words, kinds, limit * 2, title_only=True)
+    else:
+        documents = _substring(words, kinds, limit * 2, title_only=True)
+    return list(dict.fromkeys(document.title for document in documents))[:limit]
+
+
+def _kind_filter(kinds, column='kind'):
+    if not kinds:
+        return '', []
+    return ' AND {0} IN ({1})'.format(column, ', '.join(['%s'] * len(kinds))), kinds
+
+
+def _postgresql(words, kinds, limit, title_only):
+    # Words are \w+ only, so they are safe inside a tsquery; ':*' is a prefix match and 'A' the title weight
+    weight = 'A' if title_only else ''
+    tsquery = ' & '.join(['{0}:{1}'.format(word, weight) if weight else word for word in words[:-1]] + ['{0}:*{1}'.format(words[-1], weight)])
+    kind_sql, kind_params = _kind_filter(kinds)
+    return list(SearchDocument.objects.raw(
+        "SELECT id, kind, object_id, title, body, url, updated, ts_rank(vector, query) AS rank"
+        " FROM (SELECT * FROM cargo_searchdocument, to_tsquery('simple', %s) query"
+        "       WHERE vector @@ query" + kind_sql + " ORDER BY id DESC LIMIT %s) candidates"
+        " ORDER BY rank DESC, id LIMIT %s",
+        [tsquery] + kind_params + [MAX_CANDIDATES, limit],
+    ))
+
+
+def _postgresql_similar(text, kinds, limit):
+    # For when no word matched (e.g. a typo): titles at least pg_trgm.similarity_threshold similar (% uses the trigram index)
+    kind_sql, kind_params = _kind_filter(kinds)
+    return list(SearchDocument.objects.raw(
+        "SELECT id, kind, object_id, title, body, url, updated, similarity(title, %s) AS rank"
+        " FROM cargo_searchdocument"
+        " WHERE title %% %s" + kind_sql +
+        " ORDER BY rank DESC, id LIMIT %s",
+        [text, text] + kind_params + [limit],
+    ))
+
+
+def _sqlite(words, kinds, limit, title_only):
+    # Quoted so FTS5 takes them as plain words; the trailing * makes the last one a prefix
+    match = ' '.join('"{0}"'.format(word) for word in words) + '*'
+    if title_only:
+        match = 'title : ({0})'.format(match)
+    kind_sql, kind_params = _kind_filter(kinds, 'd.kind')
+    # FTS5 reads the matches newest first without ranking them, so the candidates are the rowids
+    # from the oldest of the newest MAX_CANDIDATES on
+    return list(SearchDocument.objects.raw(
+        "SELECT d.id, d.kind, d.object_id, d.title, d.body, d.url, d.updated, bm25(cargo_searchdocument_fts, 10.0, 1.0) AS rank"
+        " FROM cargo_searchdocument_fts JOIN cargo_searchdocument d ON d.id = cargo_searchdocument_fts.rowid"
+        " WHERE cargo_searchdocument_fts MATCH %s" + kind_sql +
+        " AND cargo_searchdocument_fts.rowid >= (SELECT min(rowid) FROM ("
+        "     SELECT cargo_searchdocument_fts.rowid FROM cargo_searchdocument_fts JOIN cargo_searchdocument d ON d.id = cargo_searchdocument_fts.rowid"
+        "     WHERE cargo_searchdocument_fts MATCH %s" + kind_sql + " ORDER BY cargo_searchdocument_fts.rowid DESC LIMIT %s))"
+        " ORDER BY rank, d.id LIMIT %s",
+        [match] + kind_params + [match] + kind_params + [MAX_CANDIDATES, limit],
+    ))
+
+
+def _substring(words, kinds, limit, title_only):
+    documents = SearchDocument.objects.all()
+    if kinds:
+        documents = documents.filter(kind__in=kinds)
+    for word in words:
+        if title_only:
+            documents = documents.filter(title__icontains=word)
+        else:
+            documents = documents.filter(Q(title__icontains=word) | Q(body__icontains=word))
+    documents = list(documents.order_by('id')[:limit])
+    for document in documents:
+        document.rank = None
+    return documents
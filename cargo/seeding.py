@@ -0,0 +1,288 @@
+"""
+Synthetic data for measuring the app at production scale.
+
+Seeder fills the tables with consistent companies, facilities, employees
+(with their users), cargos, pickup orders, lumpers and the cargos' status
+events, at a given number of cargos; the other tables grow with it by the
+PER_CARGO ratios. The same seed (and end date) always gives the same rows, so
+benchmark runs on different machines or branches measure the same data.
+
+Rows are inserted with bulk_create, batch_size at a time, with their primary
+keys assigned here (continuing after the largest existing one), so related
+rows can point at them without reading them back. The database sequences are
+reset afterwards. Cargos are generated and inserted chunk by chunk, with their
+pickup orders, lumpers and events, so memory use does not grow with the scale.
+
+Cargos are posted over the days before the end date; those of the last OPEN_DAYS
+are partly still open (OPEN_SHARES), the older ones all delivered. Every cargo that
+moved on has a dispatcher (and from 'assigned' on a driver) of one carrier, the
+timestamps of its statuses and a CargoEvent per step, as if it had gone through
+Cargo.transition. bulk_create sends no signals, so the dashboard counters,
+search documents and rollups are rebuilt at the end.
+"""
+import contextlib
+import datetime
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from djmoney.money import Money
+
+from cargo import caching, counters, geo, matching, rollups, search
+from cargo.models import CompanyType, Company, Facility, Employee, Cargo, CargoEvent, PickupOrder, Lumper
+
+# Rows of each kind per cargo (at least one of each is created)
+PER_CARGO = {
+    'companies': 0.002,  # A third each of brokerages, carriers and senders/receivers
+    'facilities': 0.02,
+    'employees': 0.01,   # Of the brokerages and carriers
+}
+
+# Share of the cargos posted in the last OPEN_DAYS days still in each open status; the rest are delivered
+OPEN_DAYS = 14
+OPEN_SHARES = (('p', 0.35), ('n', 0.15), ('a', 0.15), ('o', 0.15))
+
+LUMPER_SHARE = 0.2      # Of the pickup orders
+LOCATED_SHARE = 0.5     # Of the carrier employees, with a truck location
+PASSWORD = 'seeded'     # Of every seeded user
+
+FIRST_NAMES = ['Ana', 'Luis', 'Maria', 'Jose', 'Carmen', 'Juan', 'Elena', 'Pedro', 'Rosa', 'Carlos', 'Lucia', 'Miguel']
+LAST_NAMES  = ['Garcia', 'Lopez', 'Perez', 'Gomez', 'Diaz', 'Ruiz', 'Torres', 'Ramos', 'Flores', 'Vargas', 'Castro', 'Ortiz']
+WORDS = ['Blue', 'Star', 'Eagle', 'Summit', 'Coastal', 'Prairie', 'Iron', 'Swift', 'Golden', 'Northern', 'Lone', 'Harbor']
+COMPANY_KINDS = (('Brokerage', ['Logistics', 'Freight Brokers']), ('Carrier', ['Trucking', 'Transport']), ('Sender/Receiver', ['Foods', 'Supply']))
+FACILITY_KINDS = ['Warehouse', 'Distribution Center', 'Plant', 'Cold Storage', 'Yard', 'Store']
+GOODS = ['frozen chicken', 'produce', 'paper rolls', 'beverages', 'steel coils', 'lumber', 'electronics', 'furniture', 'dry grocery', 'auto parts']
+CURRENCIES = (('USD', 0.9), ('EUR', 0.1))
+
+
+@contextlib.contextmanager
+def explicit_timestamps(model, *names):
+    """
+    Lets bulk_create store the given auto_now/auto_now_add fields as set on the objects.
+    """
+    fields = [model._meta.get_field(name) for name in names]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Seeder(object):
+    """
+    Inserts the given number of cargos, and the rows they need, generated from the seed.
+    """
+
+    def __init__(self, cargos, seed=0, end=None, days=365, batch_size=2000, progress=None):
+        self.cargos     = cargos
+        self.seed       = seed
+        self.end        = end or timezone.localdate()
+        self.days       = days
+        self.batch_size = batch_size
+        self.progress   = progress or (lambda message: None)
+        self.random     = random.Random(seed)
+        self.counts     = {}
+
+    def count_of(self, kind):
+        return max(int(self.cargos * PER_CARGO[kind]), len(COMPANY_KINDS) if kind == 'companies' else 1)
+
+    def run(self):
+        """
+        Inserts all the rows and rebuilds what depends on them. Returns the number of rows by model name.
+        """
+        self.end_time = timezone.make_aware(datetime.datetime.combine(self.end, datetime.time()))
+        self.seed_companies()
+        self.seed_facilities()
+        self.seed_employees()
+        self.seed_cargos()
+        self.reset_sequences()
+        self.progress('Rebuilding the counters, search documents and rollups')
+        counters.reconcile()
+        search.rebuild(batch_size=self.batch_size)
+        rollups.refresh_all()
+        matching.invalidate()
+        caching.invalidate('companies', None)
+        return self.counts
+
+    def insert(self, model, objs):
+        model.objects.bulk_create(objs, batch_size=self.batch_size)
+        self.counts[model.__name__] = self.counts.get(model.__name__, 0) + len(objs)
+
+    def next_pk(self, model):
+        return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+    def reset_sequences(self):
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [User, Company, Facility, Employee, Cargo, PickupOrder, Lumper]):
+                cursor.execute(sql)
+
+    def seed_companies(self):
+        types = [CompanyType.objects.get_or_create(type=name)[0] for name, _ in COMPANY_KINDS]
+        start = self.next_pk(Company)
+        companies = []
+        for n in range(self.count_of('companies')):
+            kind = n % len(COMPANY_KINDS)
+            name = '{0} {1} {2} {3}'.format(
+                self.random.choice(WORDS), self.random.choice(WORDS), self.random.choice(COMPANY_KINDS[kind][1]), start + n)
+            companies.append(Company(pk=start + n, name=name, type=types[kind]))
+        with transaction.atomic(), explicit_timestamps(Company, 'updated'):
+            for company in companies:
+                company.updated = self.end_time
+            self.insert(Company, companies)
+        self.brokerages = [company.pk for company in companies if company.type_id == types[0].pk]
+        self.carriers   = [company.pk for company in companies if company.type_id == types[1].pk]
+        self.shippers   = [company.pk for company in companies if company.type_id == types[2].pk]
+        self.progress('{0} companies'.format(len(companies)))
+
+    def seed_facilities(self):
+        cities = sorted(geo.StubGeocoder.CITIES.items())
+        start = self.next_pk(Facility)
+        facilities = []
+        for n in range(self.count_of('facilities')):
+            city, (latitude, longitude) = self.random.choice(cities)
+            latitude += self.random.uniform(-0.3, 0.3)
+            longitude += self.random.uniform(-0.3, 0.3)
+            facilities.append(Facility(
+                pk=start + n, company_id=self.random.choice(self.shippers),
+                name='{0} {1}'.format(self.random.choice(FACILITY_KINDS), n + 1),
+                address='{0} {1} St, {2}'.format(self.random.randint(1, 9999), self.random.choice(WORDS), city.title()),
+                latitude=latitude, longitude=longitude, geohash=geo.encode(latitude, longitude), updated=self.end_time,
+            ))
+        with transaction.atomic(), explicit_timestamps(Facility, 'updated'):
+            self.insert(Facility, facilities)
+        self.facilities = [facility.pk for facility in facilities]
+        self.progress('{0} facilities'.format(len(facilities)))
+
+    def seed_employees(self):
+        password = make_password(PASSWORD)  # Hashed once, it is the slow part of creating users
+        user_start, start = self.next_pk(User), self.next_pk(Employee)
+        users, employees = [], []
+        companies = self.brokerages + self.carriers
+        carriers = set(self.carriers)
+        cities = sorted(geo.StubGeocoder.CITIES.values())
+        for n in range(max(self.count_of('employees'), len(companies))):
+            company = companies[n] if n < len(companies) else self.random.choice(companies)  # At least one per company
+            user = User(
+                pk=user_start + n, username='seed{0}'.format(user_start + n), password=password,
+                first_name=self.random.choice(FIRST_NAMES), last_name=self.random.choice(LAST_NAMES),
+                date_joined=self.end_time,
+            )
+            employee = Employee(pk=start + n, user_id=user.pk, company_id=company)
+            if company in carriers and self.random.random() < LOCATED_SHARE:
+                latitude, longitude = self.random.choice(cities)
+                employee.latitude = latitude + self.random.uniform(-1, 1)
+                employee.longitude = longitude + self.random.uniform(-1, 1)
+                employee.located = self.end_time - datetime.timedelta(minutes=self.random.randint(0, 600))
+            users.append(user)
+            employees.append(employee)
+        with transaction.atomic():
+            self.insert(User, users)
+            self.insert(Employee, employees)
+        self.brokers = [employee.pk for employee in employees if employee.company_id not in carriers]
+        self.carrier_staff = {}
+        for employee in employees:
+            if employee.company_id in carriers:
+                self.carrier_staff.setdefault(employee.company_id, []).append(employee.pk)
+        self.carrier_staff = [staff for _, staff in sorted(self.carrier_staff.items())]
+        self.progress('{0} employees'.format(len(employees)))
+
+    def seed_cargos(self):
+        start = self.next_pk(Cargo)
+        pickup_start = self.next_pk(PickupOrder)
+        chunks = range(0, self.cargos, self.batch_size)
+        for first in chunks:
+            cargos, events, pickups, lumpers = [], [], [], []
+            for n in range(first, min(first + self.batch_size, self.cargos)):
+                cargo, steps = self.cargo(start + n)
+                cargos.append(cargo)
+                events.extend(steps)
+                for pickup in self.pickups(cargo, pickup_start + len(pickups) + self.counts.get('PickupOrder', 0)):
+                    pickups.append(pickup)
+                    if self.random.random() < LUMPER_SHARE:
+                        lumpers.append(self.lumper(pickup))
+            with transaction.atomic(), \
+                    explicit_timestamps(Cargo, 'posted', 'updated'), \
+                    explicit_timestamps(PickupOrder, 'updated'), \
+                    explicit_timestamps(Lumper, 'requested', 'updated'):
+                self.insert(Cargo, cargos)
+                self.insert(CargoEvent, events)
+                self.insert(PickupOrder, pickups)
+                self.insert(Lumper, lumpers)
+            self.progress('{0} of {1} cargos'.format(self.counts['Cargo'], self.cargos))
+
+    def cargo(self, pk):
+        """
+        Returns an unsaved cargo, and the CargoEvents Cargo.transition would have written for its steps.
+        """
+        age = self.random.random() * self.days * 86400  # Seconds before the end
+        posted = self.end_time - datetime.timedelta(seconds=age)
+        status = 'd'
+        if age < OPEN_DAYS * 86400:
+            draw = self.random.random()
+            for candidate, share in OPEN_SHARES:
+                if draw < share:
+                    status = candidate
+                    break
+                draw -= share
+        currency = 'USD' if self.random.random() < CURRENCIES[0][1] else CURRENCIES[1][0]
+        cargo = Cargo(
+            pk=pk, description='{0} {1} lbs of {2}'.format(self.random.choice(WORDS), self.random.randint(1, 45) * 1000, self.random.choice(GOODS)),
+            price=Money(self.random.randint(300, 9000), currency), broker_id=self.random.choice(self.brokers),
+            posted=posted, status='p', updated=posted,
+        )
+        if status != 'p':
+            staff = self.random.choice(self.carrier_staff)
+            cargo.dispatcher_id = self.random.choice(staff)
+            cargo.driver_id = self.random.choice(staff) if status != 'n' else None
+        # Hours each step took, and who took it
+        steps = {
+            'n': (self.random.randint(1, 24), cargo.dispatcher_id),
+            'a': (self.random.randint(1, 12), cargo.dispatcher_id),
+            'o': (self.random.randint(1, 24), cargo.driver_id),
+            'd': (self.random.randint(4, 72), cargo.driver_id),
+        }
+        events = []
+        when = posted
+        while cargo.status != status:
+            following = Cargo.NEXT_STATUS[cargo.status]
+            hours, employee = steps[following]
+            when = min(when + datetime.timedelta(hours=hours), self.end_time)
+            events.append(CargoEvent(cargo_id=pk, from_status=cargo.status, to_status=following, occurred=when, employee_id=employee))
+            if following in Cargo.STATUS_TIMESTAMPS:
+                setattr(cargo, Cargo.STATUS_TIMESTAMPS[following], when)
+            cargo.status, cargo.updated = following, when
+        return cargo, events
+
+    def pickups(self, cargo, start):
+        loaded = cargo.posted + datetime.timedelta(hours=self.random.randint(12, 96))
+        pickups = []
+        for n in range(self.random.choice((1, 1, 1, 2, 3))):
+            pickup_from, deliver_to = self.random.sample(self.facilities, 2) if len(self.facilities) > 1 else self.facilities * 2
+            delivered = loaded + datetime.timedelta(hours=self.random.randint(4, 72))
+            pickups.append(PickupOrder(
+                pk=start + n, cargo_id=cargo.pk, pickup_from_id=pickup_from, deliver_to_id=deliver_to,
+                loaded=loaded, delivered=delivered, updated=cargo.updated,
+            ))
+            loaded += datetime.timedelta(hours=self.random.randint(1, 8))
+        return pickups
+
+    def lumper(self, pickup):
+        requested = pickup.loaded - datetime.timedelta(hours=self.random.randint(1, 12))
+        return Lumper(
+            pickup_order_id=pickup.pk, price=Money(self.random.randint(50, 600), 'USD'),
+            requested=requested, paid=requested + datetime.timedelta(days=self.random.randint(0, 30)), updated=pickup.updated,
+        )
+
+
+def seed(cargos, **kwargs):
+    """
+    Inserts the synthetic data (see Seeder). Returns the number of rows by model name.
+    """
+    return Seeder(cargos, **kwargs).run()
@@ -0,0 +1,348 @@
+"""
+Signal handlers for the cargo app. They are connected in CargoConfig.ready().
+"""
+from django.db import transaction
+from django.db.models import Q
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_init, post_save, post_delete
+from django.contrib.auth.models import User
+from django.dispatch import receiver
+from django.utils import timezone
+
+from cargo import caching, counters, geo, images, jobs, live, matching, metrics, rollups, search
+from cargo.models import Cargo, PickupOrder, Lumper, Company, CompanyType, Employee, Facility, ArchivedCargo, ArchivedPickupOrder
+
+
+@receiver(post_init, sender=Cargo)
+def remember_cargo_status(sender, instance, **kwargs):
+    """
+    Keeps the status (and description) the cargo was loaded with, so a later save can tell whether it changed.
+    """
+    instance._counted_status = instance.__dict__.get('status')
+    instance._indexed_description = instance.__dict__.get('description')
+
+
+@receiver(post_save, sender=Cargo)
+def publish_saved_cargo(sender, instance, created, raw=False, **kwargs):
+    """
+    Tells the load board about new cargos and status changes. Connected before
+    count_saved_cargo, which moves _counted_status on to the saved status.
+    """
+    if raw:
+        return
+    if created:
+        live.publish_on_commit([live.cargo_event('created', instance)])
+    elif instance._counted_status is not None and instance._counted_status != instance.status:
+        live.publish_on_commit([live.cargo_event('changed', instance, previous=instance._counted_status)])
+
+
+@receiver(post_delete, sender=Cargo)
+def publish_deleted_cargo(sender, instance, **kwargs):
+    live.publish_on_commit([live.cargo_event('deleted', instance)])
+
+
+@receiver(post_save, sender=Cargo)
+def invalidate_matches(sender, instance, created, raw=False, **kwargs):
+    """
+    Posted cargos are the candidates of the load matching (see cargo.matching). Connected
+    before count_saved_cargo, which moves _counted_status on to the saved status.
+    """
+    if not raw and (instance.status == 'p' or instance._counted_status == 'p'):
+        matching.invalidate()
+
+
+@receiver(post_delete, sender=Cargo)
+def invalidate_deleted_matches(sender, instance, **kwargs):
+    if instance._counted_status == 'p':
+        matching.invalidate()
+
+
+@receiver(post_save, sender=PickupOrder)
+@receiver(post_delete, sender=PickupOrder)
+def invalidate_pickup_matches(sender, instance, raw=False, **kwargs):
+    """
+    A cargo is matched by its first pickup order's facilities and time.
+    """
+    if not raw:
+        matching.invalidate()
+
+
+@receiver(post_save, sender=Cargo)
+def count_saved_cargo(sender, instance, created, **kwargs):
+    if created:
+        counters.adjust(num_cargos=1, num_cargos_available=int(instance.status == 'p'))
+    elif instance._counted_status is not None and instance._counted_status != instance.status:
+        counters.adjust(num_cargos_available=int(instance.status == 'p') - int(instance._counted_status == 'p'))
+    instance._counted_status = instance.status
+
+
+@receiver(post_delete, sender=Cargo)
+def count_deleted_cargo(sender, instance, **kwargs):
+    counters.adjust(num_cargos=-1, num_cargos_available=-int(instance._counted_status == 'p'))
+
+
+@receiver(post_save, sender=PickupOrder)
+def count_saved_pickuporder(sender, instance, created, **kwargs):
+    if created:
+        counters.adjust(num_pickuporders=1)
+
+
+@receiver(post_delete, sender=PickupOrder)
+def count_deleted_pickuporder(sender, instance, **kwargs):
+    counters.adjust(num_pickuporders=-1)
+
+
+@receiver(post_init, sender=Company)
+def remember_company_type(sender, instance, **kwargs):
+    """
+    Keeps the type the company was loaded with, so a later save can tell whether it changed.
+    """
+    instance._counted_type_id = instance.__dict__.get('type_id')
+
+
+@receiver(post_save, sender=Company)
+def count_saved_company(sender, instance, created, **kwargs):
+    old_type_id = None if created else instance._counted_type_id
+    if created or (old_type_id is not None and old_type_id != instance.type_id):
+        deltas = {}
+        new_field = counters.company_type_counter(instance.type_id)
+        old_field = counters.company_type_counter(old_type_id)
+        if new_field:
+            deltas[new_field] = deltas.get(new_field, 0) + 1
+        if old_field:
+            deltas[old_field] = deltas.get(old_field, 0) - 1
+        counters.adjust(**deltas)
+    instance._counted_type_id = instance.type_id
+
+
+@receiver(post_delete, sender=Company)
+def count_deleted_company(sender, instance, **kwargs):
+    field = counters.company_type_counter(instance._counted_type_id)
+    if field:
+        counters.adjust(**{field: -1})
+
+
+@receiver(post_save, sender=CompanyType)
+@receiver(post_delete, sender=CompanyType)
+def recount_companies(sender, instance, created=False, **kwargs):
+    """
+    Renaming a company type can move every company of that type in or out of
+    the brokerage/carrier counters, so those two are recomputed.
+    """
+    if not created:
+        counters.reconcile(fields=['num_brokerages', 'num_carriers'])
+
+
+@receiver(post_save, sender=CompanyType)
+def touch_companies(sender, instance, created, **kwargs):
+    """
+    The API shows the type name of each company, so renaming a type changes its companies.
+    """
+    if not created:
+        Company.objects.filter(type=instance.pk).update(updated=timezone.now())
+
+
+@receiver(post_init, sender=PickupOrder)
+@receiver(post_init, sender=Lumper)
+def remember_image_names(sender, instance, **kwargs):
+    """
+    Keeps the names of the images the object was loaded with, so a later save can tell which were uploaded.
+    """
+    instance._image_names = images.names_of(instance)
+
+
+@receiver(post_save, sender=PickupOrder)
+@receiver(post_save, sender=Lumper)
+def process_uploaded_images(sender, instance, created, raw=False, **kwargs):
+    """
+    Queues the post-processing of newly uploaded images, in the transaction of the upload.
+    """
+    if raw:
+        return
+    names = images.names_of(instance)
+    for field_name, name in names.items():
+        if name and name != instance._image_names.get(field_name):
+            images.schedule(sender, instance.pk, field_name)
+    instance._image_names = names
+
+
+@receiver(post_delete, sender=Cargo)
+@receiver(post_delete, sender=Lumper)
+def recompute_rollup_day(sender, instance, **kwargs):
+    """
+    A deleted row cannot be found through the rollup watermark, so the day it counted on is recomputed.
+    """
+    rollup = rollups.ROLLUPS['revenue' if sender is Cargo else 'lumper_costs']
+    date = getattr(instance, rollup.date_field)
+    if date is not None:
+        jobs.enqueue(rollups.recompute_days, queue='rollups', name=rollup.name, days=[timezone.localdate(date).isoformat()])
+
+
+@receiver(post_save, sender=Cargo)
+@receiver(post_delete, sender=Cargo)
+def invalidate_cargo(sender, instance, **kwargs):
+    caching.invalidate_on_commit('cargo', instance.pk)
+
+
+@receiver(post_save, sender=PickupOrder)
+@receiver(post_delete, sender=PickupOrder)
+def invalidate_pickup_cargo(sender, instance, **kwargs):
+    """
+    Pickup orders are shown on their cargo's page.
+    """
+    caching.invalidate_on_commit('cargo', instance.cargo_id)
+
+
+@receiver(post_save, sender=Lumper)
+@receiver(post_delete, sender=Lumper)
+def invalidate_lumper_cargo(sender, instance, **kwargs):
+    """
+    Lumpers are shown on their cargo's page.
+    """
+    pickup_order_id = instance.pickup_order_id
+    transaction.on_commit(lambda: caching.invalidate('cargo', *PickupOrder.objects.filter(pk=pickup_order_id).values_list('cargo_id', flat=True)))
+
+
+def cargos_of(employees):
+    """
+    Ids of the cargos brokered, dispatched or driven by the given employees (ids or a queryset).
+    """
+    parties = Q(broker__in=employees) | Q(dispatcher__in=employees) | Q(driver__in=employees)
+    # Archived cargos keep their pages, which show their parties too
+    return list(Cargo.objects.filter(parties).values_list('pk', flat=True)) + list(ArchivedCargo.objects.filter(parties).values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+def invalidate_company(sender, instance, created=None, **kwargs):
+    """
+    A company is shown on its own page, in the broker/carrier lists and on the pages of its employees' cargos.
+    """
+    caching.invalidate_on_commit('company', instance.pk)
+    caching.invalidate_on_commit('companies', None)
+    if created is False:  # Only an update; new companies have no cargos, and companies with cargos cannot be deleted
+        company_id = instance.pk
+        transaction.on_commit(lambda: caching.invalidate('cargo', *cargos_of(Employee.objects.filter(company=company_id))))
+
+
+@receiver(post_save, sender=CompanyType)
+@receiver(post_delete, sender=CompanyType)
+def invalidate_company_type(sender, instance, created=False, **kwargs):
+    """
+    The type is shown on the page of each company of that type, and decides the broker/carrier lists.
+    """
+    if not created:
+        caching.invalidate_on_commit('company', *Company.objects.filter(type=instance.pk).values_list('pk', flat=True))
+        caching.invalidate_on_commit('companies', None)
+
+
+@receiver(post_save, sender=Employee)
+@receiver(post_delete, sender=Employee)
+def invalidate_employee(sender, instance, created=None, **kwargs):
+    """
+    Employees are shown on the pages of the cargos they broker, dispatch or drive.
+    """
+    if created is False:  # Only an update; new employees have no cargos, and employees with cargos cannot be deleted
+        employee_id = instance.pk
+        transaction.on_commit(lambda: caching.invalidate('cargo', *cargos_of([employee_id])))
+
+
+@receiver(post_save, sender=User)
+def invalidate_employee_user(sender, instance, created, update_fields=None, **kwargs):
+    """
+    The names of the employees' users are shown on the pages of their cargos. Logins only save last_login, which is skipped.
+    """
+    if created or (update_fields is not None and not {'username', 'first_name', 'last_name'} & set(update_fields)):
+        return
+    user_id = instance.pk
+    transaction.on_commit(lambda: caching.invalidate('cargo', *cargos_of(Employee.objects.filter(user=user_id))))
+
+
+def cargos_at(facility_id):
+    """
+    Ids of the cargos with a pickup order from or to the given facility.
+    """
+    places = Q(pickup_from=facility_id) | Q(deliver_to=facility_id)
+    return list(PickupOrder.objects.filter(places).values_list('cargo_id', flat=True)) + list(ArchivedPickupOrder.objects.filter(places).values_list('cargo_id', flat=True))
+
+
+@receiver(post_save, sender=Facility)
+def invalidate_facility(sender, instance, created, **kwargs):
+    """
+    Facilities are shown on the pickup orders of the cargo pages.
+    """
+    if not created:  # Only an update; new facilities have no pickup orders, and facilities with pickup orders cannot be deleted
+        facility_id = instance.pk
+        transaction.on_commit(lambda: caching.invalidate('cargo', *cargos_at(facility_id)))
+
+
+# Fields each indexed model's search document is built from (see cargo.search)
+SEARCH_FIELDS = {
+    Cargo: {'description'},
+    Company: {'name'},
+    Facility: {'name', 'address', 'company', 'company_id'},
+    Employee: {'user', 'user_id', 'company', 'company_id'},
+}
+
+
+@receiver(post_save, sender=Cargo)
+@receiver(post_save, sender=Company)
+@receiver(post_save, sender=Facility)
+@receiver(post_save, sender=Employee)
+def index_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """
+    Keeps the search documents current. Fixtures (raw saves) need 'manage.py rebuild_search_index'.
+    """
+    if raw or (update_fields is not None and not SEARCH_FIELDS[sender] & set(update_fields)):
+        return
+    if sender is Cargo and not created and instance._indexed_description == instance.description:
+        return
+    search.index(sender, [instance])
+    if sender is Cargo:
+        instance._indexed_description = instance.description
+
+
+@receiver(post_delete, sender=Cargo)
+@receiver(post_delete, sender=Company)
+@receiver(post_delete, sender=Facility)
+@receiver(post_delete, sender=Employee)
+def unindex_deleted(sender, instance, **kwargs):
+    search.unindex(sender, [instance.pk])
+
+
+@receiver(post_save, sender=User)
+def index_employee_names(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """
+    Employees are found by their user's names. Logins only save last_login, which is skipped.
+    """
+    if raw or created or (update_fields is not None and not {'first_name', 'last_name'} & set(update_fields)):
+        return
+    search.index(Employee, Employee.objects.select_related('user').filter(user=instance))
+
+
+@receiver(post_init, sender=Facility)
+def remember_facility_address(sender, instance, **kwargs):
+    """
+    Keeps the address the facility was loaded with, so a later save can tell whether it changed.
+    """
+    instance._located_address = instance.__dict__.get('address')
+
+
+@receiver(post_save, sender=Facility)
+def locate_saved_facility(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """
+    Queues the geocoding of new and changed addresses (see cargo.geo).
+    """
+    if raw or (update_fields is not None and 'address' not in update_fields):
+        return
+    if created or instance._located_address != instance.address:
+        geo.schedule(instance.pk)
+    instance._located_address = instance.address
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    """
+    Lets the request metrics count the queries of every database connection.
+    """
+    metrics.instrument(connection)
@@ -0,0 +1,329 @@
+"""
+Snapshots of the cargo data, to restore production-sized data sets into
+staging and test databases in bulk.
+
+dump() writes the rows of the snapshot models (the cargo app's, and the users
+its employees are: only those auth_user rows, so the source's staff and other
+accounts and their password hashes stay behind) to a gzip file: for each model, a header line (a JSON
+object with the model and its columns), then one line per row (a JSON array
+of its column values). Rows are read with plain SQL, never as model instances.
+Dates, times and decimals are written as strings in the form both SQLite and
+PostgreSQL take them back without conversion (times in UTC), so a snapshot of
+one backend can be restored into the other.
+
+restore() loads a snapshot in one transaction, model by model in dependency
+order (CompanyType, Company, Facility and Employee, Cargo, PickupOrder,
+Lumper...): into PostgreSQL each table is streamed through COPY ... FROM
+STDIN, into other backends it is inserted with executemany, batch_size rows
+at a time. Constraint checks are disabled (deferred) while loading and run
+once at the end, then the primary key sequences are reset. No signals are
+sent, so the snapshot carries the derived tables too (dashboard counters,
+rollups, search documents). The job queues are not part of a snapshot, so a
+restored staging database does not send the source's queued emails.
+
+The snapshot's tables must be empty, unless replace=True: they are then
+flushed first, along with the rows pointing at them from outside the snapshot.
+That includes the whole auth_user table, so every account of the target
+database (superusers included) is deleted, with its groups, permissions and
+admin log, and replaced by the snapshot's employee users: create the staff
+accounts again afterwards (manage.py createsuperuser). The whole cache is
+cleared once the restore commits, as the cached pages and version tokens
+describe the replaced data.
+"""
+import base64
+import datetime
+import gzip
+import json
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from cargo.models import Job, DeadJob, Employee
+
+FORMAT = 'cargo-snapshot'
+VERSION = 1
+
+# Rows read from the database per round trip while dumping
+FETCH_SIZE = 2000
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def snapshot_models():
+    """
+    Returns the models a snapshot holds, each after the models its foreign keys point to.
+    """
+    included = [User] + [
+        model for model in apps.get_app_config('cargo').get_models()
+        if model._meta.managed and not model._meta.proxy and model not in (Job, DeadJob)
+    ]
+    ordered = []
+
+    def visit(model):
+        if model in ordered:
+            return
+        for field in model._meta.concrete_fields:
+            target = field.related_model if field.is_relation else None
+            if target is not None and target is not model and target in included:
+                visit(target)
+        ordered.append(model)
+
+    for model in included:
+        visit(model)
+    return ordered
+
+
+def _dependents(models):
+    """
+    Models outside the given ones whose rows point at theirs (through foreign keys or many-to-many tables).
+    """
+    found = []
+    pending = list(models)
+    while pending:
+        model = pending.pop()
+        related = [field.remote_field.through for field in model._meta.many_to_many]
+        related += [relation.through if relation.many_to_many else relation.related_model for relation in model._meta.related_objects]
+        for other in related:
+            if other not in models and other not in found:
+                found.append(other)
+                pending.append(other)
+    return found
+
+
+def _rows_of(model):
+    """
+    Returns the WHERE condition selecting the rows of model that go into a snapshot, or None for all of them.
+    """
+    if model is User:
+        quote = connection.ops.quote_name
+        return '{0} IN (SELECT {1} FROM {2})'.format(quote(User._meta.pk.column), quote(Employee._meta.get_field('user').column), quote(Employee._meta.db_table))
+    return None
+
+
+def _writer(field):
+    """
+    Returns the function turning the column's database values into JSON values, or None.
+    """
+    kind = field.get_internal_type()
+    if kind == 'DateTimeField':
+        return _datetime
+    if kind in ('DateField', 'TimeField', 'DecimalField'):
+        return lambda value: None if value is None else str(value)
+    if kind == 'BinaryField':
+        return lambda value: None if value is None else base64.b64encode(bytes(value)).decode()
+    return None
+
+
+def _datetime(value):
+    # As the SQLite backend stores them: naive, in UTC (with USE_TZ), which PostgreSQL reads in
+    # its connection's time zone, UTC too. So they are restored as they are, without parsing
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return str(value)
+    return value
+
+
+def _reader(field):
+    """
+    Returns the function turning the column's JSON values into values for this database, or None.
+    """
+    if field.get_internal_type() == 'BinaryField':
+        return lambda value: None if value is None else base64.b64decode(value)
+    return None
+
+
+def _convert(rows, converters):
+    if not any(converters):
+        return rows
+    converters = [(index, convert) for index, convert in enumerate(converters) if convert]
+
+    def convert(row):
+        row = list(row)
+        for index, function in converters:
+            row[index] = function(row[index])
+        return row
+    return map(convert, rows)
+
+
+def dump(path, models=None, progress=None):
+    """
+    Writes the rows of the snapshot models (or of the given ones) to a snapshot file. Returns
+    the number of rows by model label.
+    """
+    models = models or snapshot_models()
+    counts = {}
+    with gzip.open(path, 'wt', encoding='utf-8', compresslevel=1) as f:
+        f.write(json.dumps({'format': FORMAT, 'version': VERSION, 'vendor': connection.vendor}) + '\n')
+        with transaction.atomic():  # One consistent view of all the tables
+            for model in models:
+                fields = model._meta.concrete_fields
+                f.write(json.dumps({'model': model._meta.label_lower, 'columns': [field.column for field in fields]}) + '\n')
+                where = _rows_of(model)
+                sql = 'SELECT {0} FROM {1}{2} ORDER BY {3}'.format(
+                    ', '.join(connection.ops.quote_name(field.column) for field in fields),
+                    connection.ops.quote_name(model._meta.db_table),
+                    ' WHERE ' + where if where else '',
+                    connection.ops.quote_name(model._meta.pk.column),
+                )
+                count = 0
+                with connection.chunked_cursor() as cursor:
+                    cursor.execute(sql)
+                    converters = [_writer(field) for field in fields]
+                    while True:
+                        rows = cursor.fetchmany(FETCH_SIZE)
+                        if not rows:
+                            break
+                        f.writelines(json.dumps(row, separators=(',', ':')) + '\n' for row in _convert(rows, converters))
+                        count += len(rows)
+                counts[model._meta.label_lower] = count
+                if progress:
+                    progress('{0} {1}'.format(count, model._meta.label_lower))
+    return counts
+
+
+def _read(path):
+    """
+    Yields (model, columns, rows) for each model in a snapshot file; rows is an iterator
+    of the model's rows, to be consumed before the next model is read.
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        header = json.loads(f.readline() or 'null')
+        if not isinstance(header, dict) or header.get('format') != FORMAT:
+            raise SnapshotError('{0} is not a snapshot'.format(path))
+        if header.get('version') != VERSION:
+            raise SnapshotError('Snapshot version {0} is not supported'.format(header.get('version')))
+        pending = [f.readline()]
+
+        def rows():
+            for line in f:
+                if line.startswith('{'):
+                    pending[0] = line
+                    return
+                yield json.loads(line)
+            pending[0] = ''
+
+        while pending[0]:
+            table = json.loads(pending[0])
+            pending[0] = ''
+            try:
+                model = apps.get_model(table['model'])
+            except LookupError:
+                raise SnapshotError('Unknown model {0}'.format(table['model']))
+            table_rows = rows()
+            yield model, table['columns'], table_rows
+            for _ in table_rows:  # Whatever the caller left
+                pass
+
+
+def restore(path, replace=False, batch_size=5000, progress=None):
+    """
+    Loads a snapshot file (see the module docstring). Returns the number of rows by model label.
+    """
+    models = snapshot_models()
+    counts = {}
+    with transaction.atomic():
+        if replace:
+            tables = [model._meta.db_table for model in models + _dependents(models)]
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sql_flush(no_style(), tables, allow_cascade=True):
+                    cursor.execute(sql)
+        else:
+            filled = [model._meta.label_lower for model in models if model._default_manager.using(connection.alias).exists()]
+            if filled:
+                raise SnapshotError('The tables of {0} are not empty; restore with replace to flush them'.format(', '.join(filled)))
+
+        loaded = []
+        with connection.constraint_checks_disabled():
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SET CONSTRAINTS ALL DEFERRED')
+            for model, columns, rows in _read(path):
+                if model not in models:
+                    raise SnapshotError('{0} is not part of a snapshot'.format(model._meta.label_lower))
+                fields = {field.column: field for field in model._meta.concrete_fields}
+                unknown = set(columns) - set(fields)
+                if unknown:
+                    raise SnapshotError('{0} has no columns {1}; migrate the database first'.format(model._meta.label_lower, ', '.join(sorted(unknown))))
+                rows = _convert(rows, [_reader(fields[column]) for column in columns])
+                if connection.vendor == 'postgresql':
+                    count = _copy(model, columns, rows)
+                else:
+                    count = _insert(model, columns, rows, batch_size)
+                counts[model._meta.label_lower] = count
+                loaded.append(model)
+                if progress:
+                    progress('{0} {1}'.format(count, model._meta.label_lower))
+        # Checked once for all the rows loaded, rather than row by row
+        connection.check_constraints(table_names=[model._meta.db_table for model in loaded])
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), loaded):
+                cursor.execute(sql)
+        transaction.on_commit(cache.clear)
+    return counts
+
+
+def _insert(model, columns, rows, batch_size):
+    sql = 'INSERT INTO {0} ({1}) VALUES ({2})'.format(
+        connection.ops.quote_name(model._meta.db_table),
+        ', '.join(connection.ops.quote_name(column) for column in columns),
+        ', '.join(['%s'] * len(columns)),
+    )
+    count = 0
+    with connection.cursor() as cursor:
+        while True:
+            batch = [row for _, row in zip(range(batch_size), rows)]
+            if not batch:
+                return count
+            cursor.executemany(sql, batch)
+            count += len(batch)
+
+
+class _CopyStream(object):
+    """
+    A file-like object reading rows in PostgreSQL's COPY text format, for cursor.copy_expert.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.buffer = ''
+        self.count = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.buffer += '\t'.join(_copy_value(value) for value in row) + '\n'
+            self.count += 1
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    readline = read
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if value is True or value is False:
+        return 't' if value else 'f'
+    if isinstance(value, bytes):
+        return '\\\\x' + value.hex()
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _copy(model, columns, rows):
+    stream = _CopyStream(iter(rows))
+    with connection.cursor() as cursor:
+        cursor.copy_expert('COPY {0} ({1}) FROM STDIN'.format(
+            connection.ops.quote_name(model._meta.db_table),
+            ', '.join(connection.ops.quote_name(column) for column in columns),
+        ), stream)
+    return stream.count
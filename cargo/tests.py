@@ -1,3 +1,1859 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import Group, User, Permission
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import ProtectedError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core import mail
+from django.core.management import call_command, CommandError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.test.client import AsyncRequestFactory, RequestFactory
+from django.contrib.admin.templatetags.admin_list import date_hierarchy
+from django.http import HttpResponse
+from PIL import Image
+from django.urls import reverse
+from django.utils import timezone
+from djmoney.money import Money
+from asgiref.sync import async_to_sync, sync_to_async
+import numpy as np
+
+from cargo import archive, benchmarks, caching, counters, exports, geo, jobs, live, matching, metrics, profiling, rollups, search, seeding, snapshots, visits, views
+from cargo.offload import offloaded
+from cargomonitoring import routers
+from cargomonitoring.pooled_postgresql.pool import ConnectionPool, PoolTimeout
+from cargo.pagination import CursorPaginator, EstimatedCountPaginator, InvalidCursor, estimated_count
+from cargo.admin import IndexedDatesQuerySet
+from cargo.importers import CargoImporter, read_rows
+from cargo.models import CompanyType, Company, Facility, Employee, Cargo, CargoEvent, PickupOrder, Lumper, DashboardCounter
+from cargo.models import CompanyRevenueDaily, FacilityLumperCostDaily, RollupWatermark, VisitCount, Job, DeadJob
+from cargo.models import SearchDocument, GeocodeResult
+from cargo.models import ArchivedCargo, ArchivedLumper
 
 # Create your tests here.
+
+
+def create_world():
+    """
+    Creates a small, consistent set of companies, employees and facilities the tests can build on.
+    """
+    brokerage = CompanyType.objects.create(type='Brokerage')
+    carrier   = CompanyType.objects.create(type='Carrier')
+    shipper   = CompanyType.objects.create(type='Sender/Receiver')
+
+    broker_co  = Company.objects.create(name='Galiano Corp', type=brokerage)
+    carrier_co = Company.objects.create(name='Bravo Trucking', type=carrier)
+    shipper_co = Company.objects.create(name='Bravo Supermarket', type=shipper)
+
+    broker_user     = User.objects.create_user('lolo', first_name='Lolo', last_name='Perez', password='w12sdQd!')
+    dispatcher_user = User.objects.create_user('pepe', first_name='Pepe', last_name='Gomez', password='w12sdQd!')
+    driver_user     = User.objects.create_user('juan', first_name='Juan', last_name='Diaz', password='w12sdQd!')
+
+    return {
+        'brokerage': brokerage,
+        'carrier': carrier,
+        'broker_co': broker_co,
+        'carrier_co': carrier_co,
+        'shipper_co': shipper_co,
+        'broker': Employee.objects.create(user=broker_user, company=broker_co),
+        'dispatcher': Employee.objects.create(user=dispatcher_user, company=carrier_co),
+        'driver': Employee.objects.create(user=driver_user, company=carrier_co),
+        'origin': Facility.objects.create(name='Storage 23', company=shipper_co, address='23 Main St, Miami, FL'),
+        'destination': Facility.objects.create(name='Main office', company=shipper_co, address='1 Bay Rd, Tampa, FL'),
+    }
+
+
+def create_cargo(world, description='Frozen food', price=1500, **kwargs):
+    price = price if isinstance(price, Money) else Money(price, 'USD')
+    return Cargo.objects.create(description=description, price=price, broker=world['broker'], **kwargs)
+
+
+def create_pickup(world, cargo, **kwargs):
+    now = timezone.now()
+    kwargs.setdefault('loaded', now)
+    kwargs.setdefault('delivered', now + datetime.timedelta(days=1))
+    kwargs.setdefault('pickup_from', world['origin'])
+    kwargs.setdefault('deliver_to', world['destination'])
+    return PickupOrder.objects.create(cargo=cargo, **kwargs)
+
+
+class DashboardCounterTests(TestCase):
+
+    def setUp(self):
+        self.world = create_world()
+
+    def assertCountersMatchTables(self):
+        counter = DashboardCounter.objects.get(pk=counters.COUNTER_PK)
+        for name, value in counters.compute().items():
+            self.assertEqual(getattr(counter, name), value, name)
+
+    def test_counters_follow_saves_and_deletes(self):
+        cargo = create_cargo(self.world)
+        create_cargo(self.world, status='a')
+        pickup = create_pickup(self.world, cargo)
+        self.assertCountersMatchTables()
+
+        cargo.status = 'n'
+        cargo.save()
+        self.assertCountersMatchTables()
+
+        pickup.delete()
+        cargo.delete()
+        self.assertCountersMatchTables()
+
+    def test_company_type_changes_are_counted(self):
+        counters.reconcile()
+        self.world['shipper_co'].type = self.world['carrier']
+        self.world['shipper_co'].save()
+        self.assertEqual(DashboardCounter.objects.get().num_carriers, 2)
+
+        self.world['carrier'].type = 'Brokerage carrier'
+        self.world['carrier'].save()
+        self.assertCountersMatchTables()
+
+    def test_reconcile_fixes_drift(self):
+        create_cargo(self.world)
+        Cargo.objects.update(status='d')  # bypasses the signals
+        counters.reconcile()
+        self.assertCountersMatchTables()
+        self.assertIsNotNone(DashboardCounter.objects.get().reconciled)
+
+    @override_settings(VISIT_FLUSH_INTERVAL=0)
+    def test_index_reads_the_counters(self):
+        create_cargo(self.world)
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['num_cargos'], 1)
+        self.assertEqual(response.context['num_cargos_available'], 1)
+        self.assertEqual(response.context['num_brokerages'], 1)
+        self.assertEqual(response.context['num_carriers'], 1)
+
+
+class QueryCountTests(TestCase):
+    """
+    Pins the number of queries of each list page, so a template or __str__ change
+    that reintroduces a query per row fails here.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.world = create_world()
+        for i in range(6):
+            cargo = create_cargo(self.world, description='Load {0}'.format(i), dispatcher=self.world['dispatcher'], driver=self.world['driver'])
+            pickup = create_pickup(self.world, cargo)
+            Lumper.objects.create(pickup_order=pickup, price=Money(50, 'USD'), paid=timezone.now())
+        for i in range(4):
+            user = User.objects.create_user('employee{0}'.format(i), first_name='Emp', last_name=str(i))
+            Employee.objects.create(user=user, company=self.world['broker_co'])
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'w12sdQd!')
+        Employee.objects.create(user=self.admin, company=self.world['broker_co'])
+
+    def test_public_list_pages(self):
+        for name in ('cargos', 'cargos-available', 'brokers', 'carriers'):
+            with self.subTest(page=name), self.assertNumQueries(1):  # keyset page, no COUNT(*)
+                self.assertEqual(self.client.get(reverse(name)).status_code, 200)
+
+    def test_detail_pages(self):
+        cargo = Cargo.objects.first()
+        with self.assertNumQueries(3):  # cargo with its parties, pickup orders, lumpers
+            response = self.client.get(cargo.get_absolute_url())
+        self.assertContains(response, 'Galiano Corp')
+        with self.assertNumQueries(1):
+            self.client.get(self.world['broker_co'].get_absolute_url())
+        with self.assertNumQueries(0):  # cached
+            self.client.get(cargo.get_absolute_url())
+
+    def test_employees_by_company(self):
+        user = self.world['broker'].user
+        user.user_permissions.add(Permission.objects.get(codename='view_employee'))
+        self.client.force_login(user)
+        # session, user, permissions (x2), keyset page; the session is not saved
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('employees-by-company'))
+        self.assertEqual(len(response.context['employee_list']), 6)
+
+    def test_admin_changelists(self):
+        self.client.force_login(self.admin)
+        # session, user, COUNT(*) filtered, COUNT(*) total (small tables only), page, list filter choices,
+        # date hierarchy (date range twice, then the periods in one query)
+        expected = {'cargo': 7, 'pickuporder': 4, 'lumper': 7, 'employee': 5, 'facility': 5, 'company': 6}
+        for model, queries in expected.items():
+            url = reverse('admin:cargo_{0}_changelist'.format(model))
+            with self.subTest(model=model), self.assertNumQueries(queries):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_admin_cargo_changelist_is_constant(self):
+        self.client.force_login(self.admin)
+        url = reverse('admin:cargo_cargo_changelist')
+        now = timezone.now()
+        for days in range(0, 600, 30):
+            cargo = create_cargo(self.world, description='Older load', status='d', dispatcher=self.world['dispatcher'])
+            Cargo.objects.filter(pk=cargo.pk).update(posted=now - datetime.timedelta(days=days))
+        # A drilled-down date hierarchy skips the date range the admin reads to pick the level
+        for params, queries in (({}, 7), ({'status__exact': 'd'}, 7), ({'q': 'load'}, 7), ({'posted__year': now.year}, 6)):
+            with self.subTest(params=params), self.assertNumQueries(queries):
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+        years = [str(year) for year in sorted({(now - datetime.timedelta(days=days)).year for days in range(0, 600, 30)})]
+        changelist = self.client.get(url).context['cl']
+        self.assertEqual([choice['title'] for choice in date_hierarchy(changelist)['choices']], years)
+        self.assertTrue(hasattr(changelist.queryset, 'transition'))  # Still a CargoQuerySet
+
+    def test_indexed_dates(self):
+        posted = [datetime.datetime(2025, 12, 31, 23, 30), datetime.datetime(2026, 1, 2, 8), datetime.datetime(2026, 3, 5, 8)]
+        for when in posted:
+            cargo = create_cargo(self.world)
+            Cargo.objects.filter(pk=cargo.pk).update(posted=timezone.make_aware(when))
+        queryset = IndexedDatesQuerySet(Cargo).filter(posted__year__gte=2025)
+        for kind in ('year', 'month', 'day'):
+            with self.subTest(kind=kind):
+                self.assertEqual(list(queryset.datetimes('posted', kind)), list(Cargo.objects.filter(posted__year__gte=2025).datetimes('posted', kind)))
+        self.assertEqual(IndexedDatesQuerySet(Cargo).none().datetimes('posted', 'year'), [])
+
+    def test_estimated_count_paginator(self):
+        queryset = Cargo.objects.all()
+        self.assertEqual(EstimatedCountPaginator(queryset, 10).count, 6)
+        with mock.patch('cargo.pagination.estimated_count', return_value=2000000):
+            self.assertEqual(EstimatedCountPaginator(queryset, 10).count, 2000000)
+        with mock.patch('cargo.pagination.estimated_count', return_value=50):  # small tables are counted
+            self.assertEqual(EstimatedCountPaginator(queryset, 10).count, 6)
+        self.assertIsNone(estimated_count(queryset))  # not PostgreSQL
+
+    def test_admin_autocomplete(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('admin:autocomplete'), {'term': 'Emp', 'app_label': 'cargo', 'model_name': 'cargo', 'field_name': 'broker'})
+        self.assertEqual(len(response.json()['results']), 4)
+        response = self.client.get(reverse('admin:cargo_cargo_add'))
+        self.assertNotContains(response, '<option value="{0}">'.format(self.world['origin'].pk))
+        self.assertContains(response, 'admin-autocomplete')
+
+
+class CursorPaginationTests(TestCase):
+
+    def setUp(self):
+        self.world = create_world()
+        posted = timezone.now()
+        for i in range(12):
+            create_cargo(self.world, description='Load {0}'.format(i), status='p' if i % 3 else 'd')
+        # Ties on the leading key must not lose or repeat rows
+        Cargo.objects.filter(description__in=['Load 4', 'Load 5', 'Load 6']).update(posted=posted)
+
+    def test_walks_forward_and_back_over_every_row(self):
+        paginator = CursorPaginator(Cargo.objects.all(), 5, ('-posted', '-id'))
+        expected = list(Cargo.objects.order_by('-posted', '-id'))
+
+        pages, page = [], paginator.page()
+        self.assertFalse(page.has_previous())
+        while True:
+            pages.append(page)
+            if not page.has_next():
+                break
+            page = paginator.page(page.next_cursor)
+        self.assertEqual([cargo for page in pages for cargo in page], expected)
+        self.assertEqual([len(page) for page in pages], [5, 5, 2])
+
+        page = paginator.page(pages[-1].previous_cursor)
+        self.assertEqual(list(page), list(pages[1]))
+        page = paginator.page(page.previous_cursor)
+        self.assertEqual(list(page), list(pages[0]))
+        self.assertFalse(page.has_previous())
+
+    def test_list_views_link_to_the_next_page(self):
+        response = self.client.get(reverse('cargos-available'))
+        page = response.context['page_obj']
+        self.assertTrue(response.context['is_paginated'])
+        self.assertContains(response, '?cursor={0}'.format(page.next_cursor))
+        response = self.client.get(reverse('cargos-available'), {'cursor': page.next_cursor})
+        self.assertEqual(len(response.context['cargo_list']), 3)
+        self.assertTrue(all(cargo.status == 'p' for cargo in response.context['cargo_list']))
+
+    def test_invalid_cursor(self):
+        paginator = CursorPaginator(Cargo.objects.all(), 5, ('-posted', '-id'))
+        for cursor in ('garbage', 'WzFd', paginator.encode_cursor('x', Cargo.objects.first())):
+            with self.assertRaises(InvalidCursor):
+                paginator.page(cursor)
+        self.assertEqual(self.client.get(reverse('cargos'), {'cursor': 'garbage'}).status_code, 404)
+
+
+class IndexUsageTests(TestCase):
+    """
+    EXPLAIN-based checks that the hot queries are answered from their indexes
+    on a seeded dataset (run against Postgres to check the Postgres-only ones too).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.world = create_world()
+        Company.objects.bulk_create([
+            Company(name='Company {0}'.format(i), type=cls.world['brokerage'] if i % 2 else cls.world['carrier'])
+            for i in range(200)
+        ])
+        companies = list(Company.objects.filter(name__startswith='Company '))  # bulk_create may not set pks
+        Facility.objects.bulk_create([
+            Facility(name='Storage {0}'.format(i), company=companies[i % 200], address='{0} Main St'.format(i))
+            for i in range(2000)
+        ])
+        User.objects.bulk_create([User(username='user{0}'.format(i)) for i in range(2000)])
+        users = User.objects.filter(username__startswith='user')
+        Employee.objects.bulk_create([Employee(user=user, company=companies[i % 200]) for i, user in enumerate(users)])
+        Cargo.objects.bulk_create([
+            Cargo(description='Load {0}'.format(i), price=Money(1000, 'USD'), broker=cls.world['broker'], status='d' if i % 10 else 'p')
+            for i in range(5000)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, plan)
+
+    def test_cargo_status_board(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest("SQLite cannot prove that status = 'p' implies the partial index condition")
+        self.assertUsesIndex(Cargo.objects.filter(status='p').order_by('-posted', '-id')[:6], 'cargo_open_posted_idx')
+
+    def test_cargo_list(self):
+        self.assertUsesIndex(Cargo.objects.order_by('-posted', '-id')[:6], 'cargo_posted_id_idx')
+
+    def test_facilities_of_a_company(self):
+        self.assertUsesIndex(Facility.objects.filter(company=self.world['shipper_co']).order_by('name'), 'cargo_facility_company_idx')
+
+    def test_employees_of_a_company(self):
+        self.assertUsesIndex(Employee.objects.filter(company=self.world['broker_co']).order_by('user'), 'cargo_employee_company_idx')
+
+    def test_company_type_lookup(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('iexact only compiles to UPPER() = UPPER() on PostgreSQL')
+        self.assertUsesIndex(CompanyType.objects.filter(type__iexact='brokerage'), 'cargo_companytype_upper_idx')
+
+
+class BulkImportTests(TestCase):
+
+    def setUp(self):
+        self.world = create_world()
+        origin, destination = self.world['origin'].pk, self.world['destination'].pk
+        self.csv = (
+            'description,price,price_currency,broker,status,pickup_from,deliver_to,loaded,delivered,lumper_price,lumper_paid\n'
+            'Frozen food,1500.00,USD,lolo,p,{0},{1},2018-11-01 08:00,2018-11-02 17:00,75,2018-11-01 09:00\n'
+            'Produce,900,,lolo,a,,,,,,\n'
+            'Unknown broker,900,USD,nobody,p,,,,,,\n'
+            'Bad price,lots,USD,lolo,p,,,,,,\n'
+            'Bad status,100,USD,lolo,x,,,,,,\n'
+            'Bad facility,100,USD,lolo,p,999,{1},2018-11-01 08:00,2018-11-02 17:00,,\n'
+            'Not loaded,100,USD,lolo,p,{0},{1},,2018-11-02 17:00,,\n'
+            'Unpaid lumper,100,USD,lolo,p,{0},{1},2018-11-01 08:00,2018-11-02 17:00,75,\n'
+        ).format(origin, destination)
+
+    def test_import_csv(self):
+        result = CargoImporter(chunk_size=2, batch_size=1).run(read_rows(io.StringIO(self.csv), 'csv'))
+        self.assertEqual((result.cargos, result.pickups, result.lumpers), (2, 1, 1))
+        self.assertEqual([line for line, _ in result.errors], [4, 5, 6, 7, 8, 9])
+        self.assertIn('nobody', result.errors[0][1])
+        # Timestamps the tables require are rejected with the row, not at the INSERT
+        self.assertEqual(result.errors[4][1], 'Missing timestamp in loaded')
+        self.assertEqual(result.errors[5][1], 'Missing timestamp in lumper_paid')
+
+        cargo = Cargo.objects.get(description='Frozen food')
+        self.assertEqual(cargo.price, Money('1500.00', 'USD'))
+        self.assertEqual(cargo.broker, self.world['broker'])
+        lumper = Lumper.objects.get()
+        self.assertEqual(lumper.pickup_order.cargo, cargo)
+        self.assertEqual(lumper.price, Money(75, 'USD'))
+        self.assertEqual(DashboardCounter.objects.get().num_cargos, 2)
+        self.assertEqual(DashboardCounter.objects.get().num_cargos_available, 1)
+
+    def test_import_jsonl(self):
+        lines = [
+            json.dumps({'description': 'Frozen food', 'price': 1500, 'broker': 'lolo'}),
+            '{not json',
+            json.dumps({'description': 'Produce', 'price': '900.50', 'price_currency': 'EUR', 'broker': 'lolo'}),
+        ]
+        result = CargoImporter().run(read_rows(io.StringIO('\n'.join(lines)), 'jsonl'))
+        self.assertEqual(result.cargos, 2)
+        self.assertEqual([line for line, _ in result.errors], [2])
+        self.assertEqual(Cargo.objects.get(description='Produce').price, Money('900.50', 'EUR'))
+
+    def test_import_endpoint(self):
+        url = reverse('cargo-import')
+        upload = SimpleUploadedFile('loads.csv', self.csv.encode())
+        self.assertEqual(self.client.post(url, {'file': upload}).status_code, 403)
+
+        user = self.world['broker'].user
+        user.user_permissions.add(Permission.objects.get(codename='add_cargo'))
+        self.client.force_login(user)
+        upload = SimpleUploadedFile('loads.csv', self.csv.encode())
+        response = self.client.post(url, {'file': upload})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['cargos'], 2)
+        self.assertEqual(len(response.json()['errors']), 6)
+        self.assertEqual(self.client.post(url, {}).status_code, 400)
+
+        upload = SimpleUploadedFile('loads.csv', 'description,price,broker\nCafé,100,lolo\n'.encode('latin-1'))
+        response = self.client.post(url, {'file': upload})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('UTF-8', response.json()['error'])
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.world = create_world()
+        self.cargo = create_cargo(self.world, status='d', dispatcher=self.world['dispatcher'])
+        create_cargo(self.world, description='Produce', price=Money('900.50', 'EUR'))
+        pickup = create_pickup(self.world, self.cargo)
+        Lumper.objects.create(pickup_order=pickup, price=Money(75, 'USD'), paid=timezone.now())
+
+    def test_csv_export_splits_money(self):
+        user = self.world['broker'].user
+        user.user_permissions.add(Permission.objects.get(codename='view_cargo'))
+        self.client.force_login(user)
+        response = self.client.get(reverse('export', args=['cargos', 'csv']), {'status': 'p'})
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:5], ['id', 'description', 'status', 'price', 'price_currency'])
+        self.assertEqual(len(lines), 2)
+        self.assertIn(',Produce,p,900.50,EUR,Galiano Corp,,', lines[1])
+
+        self.assertEqual(self.client.get(reverse('export', args=['lumpers', 'csv'])).status_code, 403)
+        self.assertEqual(self.client.get(reverse('export', args=['cargos', 'csv']), {'from': 'yesterday'}).status_code, 400)
+
+    def test_ndjson_export_with_date_range(self):
+        today = timezone.localdate()
+        out = io.StringIO()
+        call_command('export_accounting', 'lumpers', format='ndjson', stdout=out, **{'from': str(today), 'to': str(today)})
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]['price'], rows[0]['price_currency'], rows[0]['cargo_id']), ('75.00', 'USD', str(self.cargo.pk)))
+
+        out = io.StringIO()
+        call_command('export_accounting', 'pickups', stdout=out, to=str(today - datetime.timedelta(days=1)))
+        self.assertEqual(len(out.getvalue().splitlines()), 1)  # header only
+
+    def test_archived_rows_are_exported(self):
+        live = create_cargo(self.world, description='Dry goods')
+        with transaction.atomic():
+            archive.move([self.cargo.pk])
+        user = self.world['broker'].user
+        user.user_permissions.add(*Permission.objects.filter(codename__in=['view_cargo', 'view_lumper']))
+        self.client.force_login(user)
+        today = timezone.localdate()
+
+        response = self.client.get(reverse('export', args=['cargos', 'ndjson']), {'from': str(today), 'to': str(today)})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], [str(self.cargo.pk), str(self.cargo.pk + 1), str(live.pk)])
+        self.assertEqual((rows[0]['status'], rows[0]['brokerage']), ('d', 'Galiano Corp'))
+        response = self.client.get(reverse('export', args=['lumpers', 'csv']), {'status': 'd'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn(',{0},'.format(self.cargo.pk), lines[1])
+
+        # A range starting after the last archival does not read the archive
+        tomorrow = today + datetime.timedelta(days=1)
+        with self.assertNumQueries(2):  # the last archival, the live rows
+            self.assertEqual(len(list(exports.stream(exports.EXPORTS['cargos'], 'csv', start=tomorrow))), 1)
+
+
+class ImageProcessingTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.world = create_world()
+
+    def photo(self, name='bol.jpg', size=(4000, 3000)):
+        exif = Image.Exif()
+        exif[0x0110] = 'Phone camera'  # Model
+        exif[0x0112] = 6               # Orientation: rotated 90 degrees
+        buffer = io.BytesIO()
+        Image.new('RGB', size, 'white').save(buffer, 'JPEG', quality=95, exif=exif)
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    def test_upload_is_compressed_and_thumbnailed(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            pickup = create_pickup(self.world, create_cargo(self.world), bol_image=self.photo())
+            self.assertEqual(Job.objects.get(queue='images').name, 'cargo.images.run')
+            self.assertEqual(jobs.Worker(queues=['images']).work_off(), (1, 0))
+            pickup.refresh_from_db()
+
+            self.assertEqual((pickup.bol_width, pickup.bol_height), (1536, 2048))  # EXIF orientation applied
+            self.assertEqual(pickup.bol_bytes, pickup.bol_image.size)
+            with Image.open(pickup.bol_image) as stored:
+                self.assertNotIn(0x0110, stored.getexif())
+            with Image.open(pickup.bol_thumbnail) as thumbnail:
+                self.assertLessEqual(max(thumbnail.size), 320)
+            self.assertFalse(pickup.pod_thumbnail)
+
+            # Saving again without a new upload leaves the processed image alone
+            stored_name = pickup.bol_image.name
+            pickup.save()
+            PickupOrder.objects.get(pk=pickup.pk).save()
+            jobs.Worker().work_off()
+            pickup.refresh_from_db()
+            self.assertEqual(pickup.bol_image.name, stored_name)
+
+            response = self.client.get(pickup.cargo.get_absolute_url())
+            self.assertContains(response, pickup.bol_thumbnail.url)
+
+
+class CargoLifecycleTests(TestCase):
+
+    def setUp(self):
+        self.world = create_world()
+
+    def test_transition_records_event_and_timestamp(self):
+        cargo = create_cargo(self.world)
+        cargo.transition('n', employee=self.world['dispatcher'], dispatcher=self.world['dispatcher'])
+
+        cargo.refresh_from_db()
+        self.assertEqual(cargo.status, 'n')
+        self.assertEqual(cargo.dispatcher, self.world['dispatcher'])
+        event = cargo.events.get()
+        self.assertEqual((event.from_status, event.to_status), ('p', 'n'))
+        self.assertEqual(event.occurred, cargo.negotiated)
+        self.assertEqual(event.employee, self.world['dispatcher'])
+        self.assertEqual(counters.current().num_cargos_available, 0)
+
+        # The event log keeps its cargo
+        with self.assertRaises(ProtectedError):
+            cargo.delete()
+
+    def test_invalid_transitions_are_rejected(self):
+        cargo = create_cargo(self.world)
+        with self.assertRaises(ValidationError):
+            cargo.transition('a')
+        stale = Cargo.objects.get(pk=cargo.pk)
+        cargo.transition('n')
+        with self.assertRaises(ValidationError):
+            stale.transition('n')
+        self.assertEqual(CargoEvent.objects.count(), 1)
+        with self.assertRaises(ValidationError):
+            Cargo.objects.transition('p')
+
+    def test_admin_changes_status_through_the_state_machine(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'w12sdQd!')
+        self.client.force_login(admin_user)
+        posted, negotiated = create_cargo(self.world), create_cargo(self.world, status='n')
+
+        # The form shows the status but ignores it
+        response = self.client.post(reverse('admin:cargo_cargo_change', args=[posted.pk]), {
+            'description': 'Frozen food', 'price_0': '1500', 'price_1': 'USD', 'broker': self.world['broker'].pk, 'status': 'd',
+        })
+        self.assertEqual(response.status_code, 302)
+        posted.refresh_from_db()
+        self.assertEqual(posted.status, 'p')
+
+        response = self.client.post(reverse('admin:cargo_cargo_changelist'), {
+            'action': 'move_to_negotiated', '_selected_action': [posted.pk, negotiated.pk],
+        }, follow=True)
+        self.assertContains(response, '1 cargos moved to Negotiated. 1 were not Posted and were left alone.')
+        self.assertEqual(dict(Cargo.objects.values_list('pk', 'status')), {posted.pk: 'n', negotiated.pk: 'n'})
+        self.assertEqual(list(CargoEvent.objects.values_list('cargo', 'from_status', 'to_status')), [(posted.pk, 'p', 'n')])
+
+    def test_bulk_transition(self):
+        cargos = [create_cargo(self.world) for _ in range(3)]
+        create_cargo(self.world, status='a')
+        with self.assertNumQueries(6):  # savepoint, SELECT, UPDATE, INSERT, counter UPDATE, release
+            ids = Cargo.objects.transition('n', dispatcher=self.world['dispatcher'])
+        self.assertEqual(sorted(ids), sorted(cargo.pk for cargo in cargos))
+        self.assertEqual(Cargo.objects.filter(status='n', dispatcher=self.world['dispatcher'], negotiated__isnull=False).count(), 3)
+        self.assertEqual(CargoEvent.objects.entered('n').count(), 3)
+        self.assertEqual(counters.current().num_cargos_available, 0)
+        self.assertEqual(Cargo.objects.transition('n'), [])
+
+    def test_time_in_state(self):
+        start = timezone.now()
+        cargo = create_cargo(self.world)
+        other = create_cargo(self.world)
+        Cargo.objects.filter(pk__in=[cargo.pk, other.pk]).update(posted=start)
+        Cargo.objects.filter(pk__in=[cargo.pk, other.pk]).transition('n', when=start + datetime.timedelta(hours=1))
+        cargo.refresh_from_db()
+        cargo.transition('a', when=start + datetime.timedelta(hours=4))
+
+        self.assertEqual(CargoEvent.objects.time_in_state('p'), datetime.timedelta(hours=1))
+        self.assertEqual(CargoEvent.objects.time_in_state('n'), datetime.timedelta(hours=3))
+        self.assertIsNone(CargoEvent.objects.time_in_state('a'))
+        self.assertIsNone(CargoEvent.objects.time_in_state('n', end=start + datetime.timedelta(hours=2)))
+
+
+class RollupTests(TestCase):
+
+    def setUp(self):
+        self.world = create_world()
+        self.cargo = create_cargo(self.world, dispatcher=self.world['dispatcher'])
+        create_cargo(self.world, price=500)
+        create_cargo(self.world, price=Money('900.50', 'EUR'))
+        self.lumper = Lumper.objects.create(pickup_order=create_pickup(self.world, self.cargo), price=Money(75, 'USD'), paid=timezone.now())
+
+    def refresh(self):
+        call_command('refresh_rollups', lag=0, stdout=io.StringIO())
+
+    def revenue(self):
+        return {(row['company__name'], row['role'], row['currency']): (row['total'], row['cargos']) for row in rollups.revenue()}
+
+    def test_refresh_is_incremental_and_idempotent(self):
+        self.refresh()
+        today = timezone.localdate()
+        self.assertEqual(self.revenue(), {
+            ('Bravo Trucking', 'c', 'USD'): (Decimal('1500.00'), 1),
+            ('Galiano Corp', 'b', 'EUR'): (Decimal('900.50'), 1),
+            ('Galiano Corp', 'b', 'USD'): (Decimal('2000.00'), 2),
+        })
+        self.assertEqual([(row['facility__name'], row['total']) for row in rollups.lumper_costs(today, today)], [('Storage 23', Decimal('75.00'))])
+        self.assertEqual(list(rollups.lumper_costs(end=today - datetime.timedelta(days=1))), [])
+
+        # Nothing changed: the watermark is past every row
+        with self.assertNumQueries(10):  # per rollup: savepoint, watermark, changed rows, save, release
+            self.assertEqual(rollups.ROLLUPS['revenue'].refresh(lag=datetime.timedelta(0)), 0)
+            self.assertEqual(rollups.ROLLUPS['lumper_costs'].refresh(lag=datetime.timedelta(0)), 0)
+
+        self.cargo.price = Money(1000, 'USD')
+        self.cargo.save()
+        self.refresh()
+        self.assertEqual(self.revenue()[('Galiano Corp', 'b', 'USD')], (Decimal('1500.00'), 2))
+        self.assertEqual(CompanyRevenueDaily.objects.count(), 3)
+
+    def test_refresh_resumes_in_batches(self):
+        self.assertEqual(rollups.ROLLUPS['revenue'].refresh(batch_size=2, lag=datetime.timedelta(0)), 3)
+        watermark = RollupWatermark.objects.get(name='revenue')
+        self.assertEqual(watermark.last_id, Cargo.objects.order_by('updated', 'id').last().pk)
+        self.assertEqual(rollups.ROLLUPS['revenue'].refresh(lag=datetime.timedelta(hours=1)), 0)
+
+    def test_deletes_and_rebuilds(self):
+        self.refresh()
+        self.lumper.delete()
+        jobs.Worker().work_off()
+        self.assertFalse(FacilityLumperCostDaily.objects.exists())
+
+        CompanyRevenueDaily.objects.update(total=0)
+        call_command('refresh_rollups', 'revenue', rebuild=True, stdout=io.StringIO(), **{'from': str(timezone.localdate())})
+        self.assertEqual(self.revenue()[('Galiano Corp', 'b', 'USD')], (Decimal('2000.00'), 2))
+
+    def test_report_views(self):
+        self.refresh()
+        user = self.world['broker'].user
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse('revenue-report')).status_code, 403)
+        user.user_permissions.add(Permission.objects.get(codename='view_companyrevenuedaily'))
+        response = self.client.get(reverse('revenue-report'), {'role': 'c', 'from': str(timezone.localdate())})
+        rows = response.json()['revenue']
+        self.assertEqual([(row['company__name'], row['role'], row['currency'], Decimal(row['total']), row['cargos']) for row in rows], [
+            ('Bravo Trucking', 'c', 'USD', Decimal('1500.00'), 1),
+        ])
+        self.assertEqual(self.client.get(reverse('revenue-report'), {'role': 'x'}).status_code, 400)
+
+
+class CachingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.world = create_world()
+        self.cargo = create_cargo(self.world)
+
+    def get(self, url):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.get(url)
+
+    def test_detail_pages_are_cached_until_changed(self):
+        url = self.cargo.get_absolute_url()
+        self.assertContains(self.get(url), 'Frozen food')
+        before = caching.stats()
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(url), 'Frozen food')
+        self.assertEqual(caching.stats()['hits'], before['hits'] + 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cargo.description = 'Fresh fruit'
+            self.cargo.save()
+        self.assertContains(self.get(url), 'Fresh fruit')
+
+        # Renaming the broker's company reaches the cargo page too
+        with self.captureOnCommitCallbacks(execute=True):
+            self.world['broker_co'].name = 'Galiano Logistics'
+            self.world['broker_co'].save()
+        self.assertContains(self.get(url), 'Galiano Logistics')
+
+        # Pickup orders are part of the cargo page
+        with self.captureOnCommitCallbacks(execute=True):
+            create_pickup(self.world, self.cargo)
+        self.assertContains(self.get(url), 'Storage 23')
+
+        # So are the names of its facilities and of its parties' users
+        with self.captureOnCommitCallbacks(execute=True):
+            self.world['origin'].name = 'Storage 24'
+            self.world['origin'].save()
+        self.assertContains(self.get(url), 'Storage 24')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.world['broker'].user.last_name = 'Pereira'
+            self.world['broker'].user.save()
+        self.assertContains(self.get(url), 'Pereira')
+
+    def test_only_affected_keys_are_invalidated(self):
+        other = create_cargo(self.world, description='Produce')
+        self.get(self.cargo.get_absolute_url())
+        self.get(other.get_absolute_url())
+        self.get(self.world['carrier_co'].get_absolute_url())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cargo.transition('n')
+        with self.assertNumQueries(0):
+            self.client.get(other.get_absolute_url())
+            self.client.get(self.world['carrier_co'].get_absolute_url())
+        with self.assertNumQueries(2):  # cargo with its parties, pickup orders (none, so no lumpers)
+            self.assertContains(self.client.get(self.cargo.get_absolute_url()), 'Negotiated')
+
+    def test_company_lists(self):
+        self.get(reverse('brokers'))
+        with self.assertNumQueries(0):
+            self.client.get(reverse('brokers'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Company.objects.create(name='Alpha Freight', type=self.world['brokerage'])
+        self.assertContains(self.get(reverse('brokers')), 'Alpha Freight')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.world['brokerage'].type = 'Broker'
+            self.world['brokerage'].save()
+        self.assertNotContains(self.get(reverse('brokers')), 'Alpha Freight')
+
+    def test_stats_view(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'w12sdQd!')
+        self.client.force_login(admin)
+        self.assertEqual(set(self.client.get(reverse('cache-stats')).json()), {'hits', 'misses', 'ratio'})
+
+
+class VisitCountTests(TestCase):
+
+    def setUp(self):
+        visits.counter.pending.clear()
+
+    def test_index_view_does_not_write(self):
+        self.client.force_login(User.objects.create_user('lolo', password='w12sdQd!'))
+        self.client.get(reverse('index'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('index'))
+        self.assertEqual([query['sql'].split()[0] for query in queries if not query['sql'].startswith('SELECT')], [])
+        self.assertEqual(response.context['num_visits'], 1)
+        self.assertEqual(self.client.get(reverse('index')).context['num_visits'], 2)
+
+        self.client.cookies[visits.COOKIE_NAME] = '41'  # Not signed
+        self.assertEqual(self.client.get(reverse('index')).context['num_visits'], 0)
+
+        self.assertEqual(visits.counter.flush(), 4)
+        self.assertEqual(VisitCount.objects.get(page='index', day=timezone.localdate()).count, 4)
+        self.assertEqual(visits.counter.flush(), 0)
+
+    def test_flush_adds_to_existing_counts(self):
+        today = timezone.localdate()
+        VisitCount.objects.create(page='index', day=today, count=10)
+        for _ in range(3):
+            visits.counter.record('index')
+        with self.assertNumQueries(3):  # savepoint, UPDATE, release
+            visits.counter.flush()
+        self.assertEqual(VisitCount.objects.get(page='index', day=today).count, 13)
+
+    @override_settings(VISIT_FLUSH_INTERVAL=0)
+    def test_synchronous_mode(self):
+        visits.counter.record('index')
+        self.assertEqual(VisitCount.objects.get().count, 1)
+        self.assertFalse(visits.counter.pending)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+class ReplicaRouterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.router = routers.PrimaryReplicaRouter()
+        routers._state.pinned = routers._state.wrote = False
+
+    def test_reads_round_robin_and_writes_to_primary(self):
+        reads = {self.router.db_for_read(Cargo) for _ in range(4)}
+        self.assertEqual(reads, {'replica1', 'replica2'})
+        self.assertEqual(self.router.db_for_write(Cargo), 'default')
+        # Once the request wrote, it reads its own writes
+        self.assertEqual(self.router.db_for_read(Cargo), 'default')
+
+    def test_use_primary_and_migrations(self):
+        with routers.use_primary():
+            self.assertEqual(self.router.db_for_read(Cargo), 'default')
+        self.assertNotEqual(self.router.db_for_read(Cargo), 'default')
+        self.assertTrue(self.router.allow_migrate('default', 'cargo'))
+        self.assertFalse(self.router.allow_migrate('replica1', 'cargo'))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas(self):
+        self.assertEqual(self.router.db_for_read(Cargo), 'default')
+
+
+class PrimaryStickinessTests(TestCase):
+
+    @override_settings(DATABASE_REPLICAS=['default'], DATABASE_REPLICA_LAG=5)
+    def test_client_sticks_to_primary_after_writing(self):
+        User.objects.create_user('lolo', password='w12sdQd!')
+        response = self.client.get(reverse('login'))
+        self.assertNotIn(routers.STICKY_COOKIE, response.cookies)
+        response = self.client.post(reverse('login'), {'username': 'lolo', 'password': 'w12sdQd!'})
+        self.assertEqual(response.cookies[routers.STICKY_COOKIE]['max-age'], 5)
+        self.assertFalse(routers.pinned())  # Reset after the request
+
+        request = RequestFactory().get('/')
+        request.COOKIES[routers.STICKY_COOKIE] = response.cookies[routers.STICKY_COOKIE].value
+        seen = []
+        routers.PrimaryStickinessMiddleware(lambda request: seen.append(routers.pinned()) or HttpResponse())(request)
+        self.assertEqual(seen, [True])
+
+    @override_settings(DATABASE_REPLICAS=['default'], DATABASE_REPLICA_LAG=5)
+    async def test_async_middleware_chain(self):
+        await sync_to_async(User.objects.create_user)('lolo', password='w12sdQd!')
+        # Form-encoded: the multipart encoding of Django 3.2's AsyncClient cannot be read back
+        response = await self.async_client.post(reverse('login'), 'username=lolo&password=w12sdQd%21', content_type='application/x-www-form-urlencoded')
+        self.assertEqual(response.cookies[routers.STICKY_COOKIE]['max-age'], 5)
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.closed = False
+        self.healthy = True
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+
+    def make_pool(self, **kwargs):
+        self.opened = []
+
+        def connect():
+            self.opened.append(FakeConnection())
+            return self.opened[-1]
+        return ConnectionPool(connect, check=lambda conn: conn.healthy, reset=lambda conn: not conn.closed, **kwargs)
+
+    def test_connections_are_reused_up_to_max_size(self):
+        pool = self.make_pool(min_size=1, max_size=2, timeout=0.05)
+        pool.fill()
+        first, second = pool.getconn(), pool.getconn()
+        self.assertEqual(len(self.opened), 2)
+        with self.assertRaises(PoolTimeout):
+            pool.getconn()
+        pool.putconn(first)
+        self.assertIs(pool.getconn(), first)
+        stats = pool.stats()
+        self.assertEqual((stats['in_use'], stats['saturation'], stats['timeouts'], stats['checkouts']), (2, 1.0, 1, 3))
+
+    def test_waiting_checkout_gets_returned_connection(self):
+        pool = self.make_pool(max_size=1, timeout=2)
+        conn = pool.getconn()
+        threading.Timer(0.05, pool.putconn, [conn]).start()
+        self.assertIs(pool.getconn(), conn)
+        self.assertEqual(pool.stats()['waits'], 1)
+        self.assertGreater(pool.stats()['max_wait_time'], 0.01)
+
+    def test_unhealthy_and_broken_connections_are_replaced(self):
+        pool = self.make_pool(max_size=2, check_interval=0)
+        conn = pool.getconn()
+        pool.putconn(conn)
+        conn.healthy = False
+        replacement = pool.getconn()
+        self.assertIsNot(replacement, conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.stats()['failed_checks'], 1)
+
+        replacement.close()  # e.g. the server went away
+        pool.putconn(replacement)
+        self.assertEqual(pool.stats()['idle'], 0)
+        self.assertEqual(pool.stats()['size'], 0)
+
+
+class ApiTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.world = create_world()
+        self.cargos = [create_cargo(self.world, description='Cargo {0}'.format(i), price=1000 + i) for i in range(5)]
+        self.user = User.objects.create_user('reader')
+        self.user.user_permissions.add(*Permission.objects.filter(codename__in=['view_cargo', 'view_company']))
+        self.client.force_login(self.user)
+
+    def test_requires_the_view_permission(self):
+        url = reverse('api-list', args=['cargos'])
+        detail = reverse('api-detail', args=['cargos', self.cargos[0].pk])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.get(detail).status_code, 200)
+        self.assertEqual(self.client.get(reverse('api-list', args=['facilities'])).status_code, 403)
+
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(detail).status_code, 403)
+
+    def test_fields_are_projected(self):
+        response = self.client.get(reverse('api-list', args=['cargos']), {'fields': 'id,status,price'})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(len(results), 5)
+        self.assertEqual(set(results[0]), {'id', 'status', 'price'})
+        self.assertEqual(results[0], {'id': self.cargos[-1].pk, 'status': 'p', 'price': '1004.00'})
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('api-list', args=['cargos']), {'fields': 'description'})
+        select = queries.captured_queries[-1]['sql']
+        self.assertIn('"description"', select)
+        self.assertNotIn('"price"', select)
+
+        self.assertEqual(self.client.get(reverse('api-list', args=['cargos']), {'fields': 'id,secret'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('api-list', args=['lumpers'])).status_code, 404)
+
+    def test_filters(self):
+        self.cargos[0].transition('n', dispatcher=self.world['dispatcher'])
+        url = reverse('api-list', args=['cargos'])
+        results = self.client.get(url, {'status': 'n', 'fields': 'id'}).json()['results']
+        self.assertEqual(results, [{'id': self.cargos[0].pk}])
+        self.assertEqual(len(self.client.get(url, {'broker': self.world['broker'].pk}).json()['results']), 5)
+        self.assertEqual(self.client.get(url, {'broker': self.world['dispatcher'].pk}).json()['results'], [])
+        tomorrow = timezone.localdate() + datetime.timedelta(days=1)
+        self.assertEqual(self.client.get(url, {'from': tomorrow.isoformat()}).json()['results'], [])
+        self.assertEqual(self.client.get(url, {'status': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'from': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'broker': 'abc'}).status_code, 400)
+
+        companies = self.client.get(reverse('api-list', args=['companies']), {'type': 'carrier'}).json()['results']
+        self.assertEqual([company['name'] for company in companies], ['Bravo Trucking'])
+
+    def test_cursor_pagination(self):
+        url = reverse('api-list', args=['cargos'])
+        first = self.client.get(url, {'fields': 'id', 'limit': 2}).json()
+        self.assertEqual([row['id'] for row in first['results']], [self.cargos[4].pk, self.cargos[3].pk])
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).json()
+        self.assertEqual([row['id'] for row in second['results']], [self.cargos[2].pk, self.cargos[1].pk])
+        self.assertEqual(self.client.get(second['previous']).json()['results'], first['results'])
+        self.assertEqual(self.client.get(url, {'cursor': 'garbage'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'limit': 10000}).status_code, 400)
+
+    def test_conditional_get(self):
+        url = reverse('api-list', args=['cargos'])
+        response = self.client.get(url, {'fields': 'id,description'})
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+        self.assertIn('Last-Modified', response)
+
+        # An unchanged collection costs the session, the user's permissions and one aggregate query, and no body
+        with self.assertNumQueries(5):
+            response = self.client.get(url, {'fields': 'id,description'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get(url, {'fields': 'id'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        self.cargos[1].description = 'Changed'
+        self.cargos[1].save()
+        self.assertEqual(self.client.get(url, {'fields': 'id,description'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # Deleting a row that was not the newest still changes the ETag
+        etag = self.client.get(url)['ETag']
+        self.cargos[0].delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_detail(self):
+        cargo = self.cargos[0]
+        url = reverse('api-detail', args=['cargos', cargo.pk])
+        response = self.client.get(url, {'fields': 'id,description,posted'})
+        self.assertEqual(response.json(), {'id': cargo.pk, 'description': 'Cargo 0', 'posted': cargo.posted.isoformat()})
+        with self.assertNumQueries(5):  # the session, the user, their permissions and one aggregate query
+            self.assertEqual(self.client.get(url, {'fields': 'id,description,posted'}, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(reverse('api-detail', args=['cargos', 0])).status_code, 404)
+
+        # Renaming a company type changes the companies of that type
+        company = self.world['carrier_co']
+        url = reverse('api-detail', args=['companies', company.pk])
+        etag = self.client.get(url)['ETag']
+        self.world['carrier'].type = 'Trucking'
+        self.world['carrier'].save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['type'], 'Trucking')
+
+
+class LiveUpdateTests(TestCase):
+
+    def setUp(self):
+        self.world = create_world()
+
+    def test_changes_are_published_once_committed(self):
+        cursor = live.broker.cursor()
+        with self.captureOnCommitCallbacks(execute=True):
+            cargo = create_cargo(self.world)
+            self.assertEqual(live.broker.since(cursor), [])
+        events = live.broker.since(cursor)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['type'], 'created')
+        self.assertEqual(events[0]['description'], 'Frozen food')
+        self.assertEqual(events[0]['url'], cargo.get_absolute_url())
+
+        # A bulk transition is one publication, however many cargos it moves
+        others = [create_cargo(self.world) for _ in range(2)]
+        cursor = live.broker.cursor()
+        with mock.patch.object(live.broker, 'publish', wraps=live.broker.publish) as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                Cargo.objects.filter(pk__in=[cargo.pk] + [other.pk for other in others]).transition('n', dispatcher=self.world['dispatcher'])
+        self.assertEqual(publish.call_count, 1)
+        self.assertEqual({(event['cargo'], event['previous'], event['status']) for event in live.broker.since(cursor)},
+                         {(pk, 'p', 'n') for pk in [cargo.pk] + [other.pk for other in others]})
+
+        cursor = live.broker.cursor()
+        with self.captureOnCommitCallbacks(execute=True):
+            cargo.status = 'a'
+            cargo.save()
+            cargo.description = 'Frozen fish'
+            cargo.save()
+        self.assertEqual([(event['type'], event['status']) for event in live.broker.since(cursor)], [('changed', 'a')])
+
+    def test_long_poll(self):
+        url = reverse('cargo-updates')
+        cursor = self.client.get(reverse('cargos-available')).context['live_cursor']
+        timer = threading.Timer(0.2, live.broker.publish, [[{'type': 'changed', 'cargo': 1, 'status': 'n'}]])
+        timer.start()
+        started = time.monotonic()
+        with override_settings(CARGO_LIVE_TIMEOUT=10), self.assertNumQueries(0):
+            data = self.client.get(url, {'after': cursor}).json()
+        timer.join()
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual([event['cargo'] for event in data['events']], [1])
+        self.assertFalse(data['reload'])
+
+        with override_settings(CARGO_LIVE_TIMEOUT=0.05):
+            self.assertEqual(self.client.get(url, {'after': data['cursor']}).json(),
+                             {'cursor': data['cursor'], 'events': [], 'reload': False})
+            # A malformed or missing cursor waits for the next events rather than reloading the page
+            for params in ({'after': 'another-process:3'}, {}):
+                self.assertEqual(self.client.get(url, params).json(), {'cursor': live.broker.cursor(), 'events': [], 'reload': False})
+
+    def test_any_process_continues_a_cursor(self):
+        first, second, late = live.Broker(), live.Broker(), live.Broker()
+        events = live.stamp([{'cargo': pk} for pk in range(3)])
+        first.publish(events[:1])
+        cursor = first.cursor()
+        second.publish(events)
+        first.publish(events[1:])
+        late.publish(events[2:])  # Started listening after the first two
+        self.assertEqual(second.since(cursor), events[1:])
+        self.assertEqual(late.since(cursor), events[2:])
+        # An event that has not reached this process yet: nothing newer so far
+        self.assertEqual(second.since(live.event_id()), [])
+        self.assertEqual(live.Broker().since(cursor), [])
+
+    def test_one_event_wakes_every_waiter(self):
+        broker = live.Broker(size=10)
+        cursor = broker.cursor()
+
+        async def watch():
+            return await asyncio.gather(*[broker.wait(cursor, 10) for _ in range(50)])
+
+        threading.Timer(0.1, broker.publish, [[{'cargo': 7}]]).start()
+        results = asyncio.run(watch())
+        self.assertEqual(len(results), 50)
+        self.assertTrue(all(result == [{'cargo': 7, 'id': broker.cursor()}] for result in results))
+        self.assertEqual(broker.waiters, set())
+
+        # Cursors older than the kept events cannot be continued
+        cursor = broker.cursor()
+        broker.publish([{'cargo': pk} for pk in range(20)])
+        self.assertIsNone(broker.since(cursor))
+
+    def test_notify_payloads_fit(self):
+        events = [{'type': 'created', 'cargo': pk, 'description': 'x' * 150} for pk in range(200)]
+        payloads = list(live._payloads(events))
+        self.assertGreater(len(payloads), 1)
+        self.assertTrue(all(len(payload) <= live.MAX_PAYLOAD for payload in payloads))
+        self.assertEqual([event for payload in payloads for event in json.loads(payload)], events)
+
+
+class OffloadedViewTests(TransactionTestCase):
+
+    def test_views_run_on_the_pool(self):
+        world = create_world()
+        cargo = create_cargo(world)
+        threads = []
+
+        def view(request, pk):
+            threads.append(threading.current_thread().name)
+            return views.CargoDetailView.as_view()(request, pk=pk)
+
+        response = async_to_sync(offloaded(view))(AsyncRequestFactory().get(cargo.get_absolute_url()), pk=cargo.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Frozen food', response.content)  # Rendered in the pool too
+        self.assertTrue(threads[0].startswith('cargo-views'))
+
+        request = AsyncRequestFactory().get('/cargo/api/cargos/')
+        request.user = User.objects.create_user('reader')
+        request.user.user_permissions.add(Permission.objects.get(codename='view_cargo'))
+        response = async_to_sync(offloaded(views.api_list))(request, resource='cargos')
+        self.assertEqual([row['id'] for row in json.loads(response.content)['results']], [cargo.pk])
+
+
+def flaky_job(fail_times, counter):
+    """
+    Job for JobQueueTests: fails the first fail_times attempts counted under the given cache key.
+    """
+    attempts = cache.get_or_set(counter, 0)
+    cache.set(counter, attempts + 1)
+    if attempts < fail_times:
+        raise RuntimeError('Attempt {0} failed'.format(attempts + 1))
+
+
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def make_due(self):
+        Job.objects.update(run_at=timezone.now())
+
+    def test_jobs_commit_with_their_transaction(self):
+        try:
+            with transaction.atomic():
+                jobs.enqueue(flaky_job, fail_times=0, counter='a')
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertFalse(Job.objects.exists())
+        jobs.enqueue(flaky_job, counter='b', fail_times=0)
+        self.assertEqual(jobs.Worker().work_off(), (1, 0))
+        self.assertFalse(Job.objects.exists())
+
+    def test_retries_with_backoff_then_dead_letter(self):
+        jobs.enqueue(flaky_job, max_attempts=3, fail_times=1, counter='retried')
+        jobs.enqueue(flaky_job, max_attempts=2, fail_times=5, counter='dead')
+        worker = jobs.Worker()
+        started = timezone.now()
+        self.assertEqual(worker.work_off(), (0, 2))
+        for job in Job.objects.all():
+            self.assertEqual(job.attempts, 1)
+            self.assertGreaterEqual(job.run_at, started + jobs.BACKOFF)
+            self.assertIn('Attempt 1 failed', job.last_error)
+        self.assertEqual(worker.work_off(), (0, 0))  # Not due yet
+
+        self.make_due()
+        self.assertEqual(worker.work_off(), (1, 1))
+        self.assertFalse(Job.objects.exists())
+        dead = DeadJob.objects.get()
+        self.assertEqual((dead.name, dead.kwargs['counter'], dead.attempts), ('cargo.tests.flaky_job', 'dead', 2))
+        self.assertEqual(jobs.backoff(3), jobs.BACKOFF * 4)
+        self.assertEqual(jobs.backoff(30), jobs.MAX_BACKOFF)
+
+    def test_claimed_jobs_are_leased(self):
+        jobs.enqueue(flaky_job, fail_times=0, counter='leased')
+        first = jobs.Worker(name='first', lease=60)
+        job = first.claim()
+        self.assertEqual((job.locked_by, job.attempts), ('first', 1))
+        self.assertIsNone(jobs.Worker(name='second').claim())
+
+        # The first worker died: once its lease is over the job is taken over
+        self.make_due()
+        second = jobs.Worker(name='second')
+        self.assertEqual(second.work_off(), (1, 0))
+        self.assertEqual(Job.objects.filter(locked_by='first').count(), 0)
+
+    def test_keys_and_queues(self):
+        self.assertIsNotNone(jobs.enqueue(rollups.refresh_all, key='refresh'))
+        self.assertIsNone(jobs.enqueue(rollups.refresh_all, key='refresh'))
+        jobs.enqueue(flaky_job, queue='email', fail_times=0, counter='x')
+        self.assertEqual(jobs.Worker(queues=['email']).work_off(), (1, 0))
+        self.assertEqual(Job.objects.get().name, 'cargo.rollups.refresh_all')
+
+        self.assertEqual(jobs.Worker().work_off(), (1, 0))
+
+        with override_settings(CARGO_PERIODIC_JOBS={'cargo.rollups.refresh_all': 300}):
+            worker, other = jobs.Worker(), jobs.Worker()
+            worker.queue_periodic()
+            other.queue_periodic()  # Already waiting
+            self.assertEqual(Job.objects.get().key, 'periodic:cargo.rollups.refresh_all')
+            self.assertEqual(worker.work_off(), (1, 0))
+            worker.queue_periodic()  # Not due again yet
+            self.assertFalse(Job.objects.exists())
+
+        call_command('run_jobs', once=True, stdout=io.StringIO())
+
+    @override_settings(CARGO_JOBS_EAGER=True)
+    def test_eager_mode(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertIsNone(jobs.enqueue(flaky_job, fail_times=0, counter='eager'))
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(cache.get('eager'), 1)
+
+
+class OnboardingTests(TestCase):
+
+    def setUp(self):
+        self.world = create_world()
+        self.manager = self.world['broker'].user
+        self.manager.user_permissions.add(Permission.objects.get(codename='add_employee'))
+        self.client.force_login(self.manager)
+        self.group = Group.objects.create(name='Dispatchers')
+
+    def test_new_employee_gets_a_link_to_choose_a_password(self):
+        response = self.client.post(reverse('add-employee'), {
+            'username': 'maria', 'first_name': 'Maria', 'last_name': 'Lopez', 'email': 'maria@example.com',
+            'phone': '+13055550123', 'role': [self.group.pk],
+        })
+        self.assertRedirects(response, reverse('employees-by-company'), fetch_redirect_response=False)
+        employee = Employee.objects.select_related('user').get(user__username='maria')
+        self.assertEqual(employee.company, self.world['broker_co'])
+        self.assertFalse(employee.user.has_usable_password())
+        self.assertEqual(len(mail.outbox), 0)  # Not sent during the request
+
+        self.assertEqual(jobs.Worker(queues=['email']).work_off(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['maria@example.com'])
+        link = next(line for line in mail.outbox[0].body.splitlines() if line.startswith('http'))
+        self.assertTrue(link.startswith('http://testserver/accounts/reset/'))
+        self.assertEqual(self.client.get(link, follow=True).status_code, 200)
+
+    def test_only_employees_can_add_employees(self):
+        outsider = User.objects.create_user('outsider')
+        outsider.user_permissions.add(Permission.objects.get(codename='add_employee'))
+        self.client.force_login(outsider)
+        response = self.client.post(reverse('add-employee'), {
+            'username': 'maria', 'first_name': 'Maria', 'last_name': 'Lopez', 'email': 'maria@example.com',
+            'phone': '+13055550123', 'role': [self.group.pk],
+        })
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(User.objects.filter(username='maria').exists())
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        self.world = create_world()
+        self.cargo = create_cargo(self.world, description='Frozen shrimp to Tampa')
+        create_cargo(self.world, description='Dry goods')
+
+    def titles(self, query, **kwargs):
+        return [document.title for document in search.search(query, **kwargs)]
+
+    def test_finds_every_kind(self):
+        self.assertEqual(self.titles('frozen'), ['Frozen shrimp to Tampa'])
+        self.assertEqual(self.titles('galiano'), ['Galiano Corp'])
+        self.assertEqual(self.titles('miami'), ['Storage 23'])
+        self.assertEqual(self.titles('gomez'), ['Pepe Gomez'])
+        self.assertEqual(self.titles('nothing like this'), [])
+        self.assertEqual(self.titles('  '), [])
+
+    def test_usernames_are_not_indexed(self):
+        company = self.world['carrier_co']
+        Employee.objects.create(user=User.objects.create_user('jdoe77', first_name='Jane', last_name='Doe'), company=company)
+        Employee.objects.create(user=User.objects.create_user('ghost42'), company=company)
+        self.assertEqual(self.titles('doe'), ['Jane Doe'])
+        self.assertEqual(self.titles('jdoe77'), [])
+        self.assertEqual(self.titles('ghost42'), [])
+
+    def test_all_words_must_match_and_the_last_is_a_prefix(self):
+        self.assertEqual(self.titles('shrimp tam'), ['Frozen shrimp to Tampa'])
+        self.assertEqual(self.titles('shrimp miami'), [])
+
+    def test_title_matches_rank_first(self):
+        # 'Tampa' is in this cargo's description, and in the address of the destination facility
+        results = search.search('tampa')
+        self.assertEqual([(document.kind, document.title) for document in results], [('cargo', 'Frozen shrimp to Tampa'), ('facility', 'Main office')])
+        self.assertEqual(self.titles('tampa', kinds=['facility']), ['Main office'])
+
+    def test_autocomplete(self):
+        create_cargo(self.world, description='Frozen shrimp to Tampa')
+        self.assertEqual(search.autocomplete('fro'), ['Frozen shrimp to Tampa'])
+        self.assertCountEqual(search.autocomplete('bravo'), ['Bravo Supermarket', 'Bravo Trucking'])
+        self.assertEqual(search.autocomplete('bravo', kinds=['cargo']), [])
+        self.assertEqual(search.autocomplete('mia'), [])  # Addresses are not suggested
+
+    def test_documents_follow_the_objects(self):
+        self.cargo.description = 'Fresh salmon'
+        self.cargo.save()
+        self.assertEqual(self.titles('frozen'), [])
+        self.assertEqual(self.titles('salmon'), ['Fresh salmon'])
+
+        user = self.world['dispatcher'].user
+        user.last_name = 'Garcia'
+        user.save()
+        self.assertEqual(self.titles('garcia'), ['Pepe Garcia'])
+
+        self.cargo.delete()
+        self.assertEqual(self.titles('salmon'), [])
+
+    def test_unchanged_text_is_not_reindexed(self):
+        self.cargo.status = 'a'
+        with CaptureQueriesContext(connection) as queries:
+            self.cargo.save()
+        self.assertFalse([query for query in queries if 'searchdocument' in query['sql']])
+        with CaptureQueriesContext(connection) as queries:
+            self.world['driver'].user.save(update_fields=['last_login'])
+        self.assertFalse([query for query in queries if 'searchdocument' in query['sql']])
+
+    def test_rebuild(self):
+        SearchDocument.objects.all().delete()
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(self.titles('frozen'), ['Frozen shrimp to Tampa'])
+        self.assertEqual(SearchDocument.objects.count(), 2 + 3 + 2 + 3)
+
+    def test_imported_cargos_are_found(self):
+        line = json.dumps({'description': 'Imported bananas', 'price': '900', 'broker': 'lolo'})
+        CargoImporter().run(read_rows(io.StringIO(line), 'jsonl'))
+        self.assertEqual(self.titles('bananas'), ['Imported bananas'])
+
+    def test_views(self):
+        response = self.client.get(reverse('search'), {'q': 'frozen'})
+        self.assertContains(response, 'Frozen shrimp to Tampa')
+        self.assertContains(response, self.cargo.get_absolute_url())
+        response = self.client.get(reverse('search-autocomplete'), {'q': 'fro'})
+        self.assertEqual(response.json(), {'suggestions': ['Frozen shrimp to Tampa']})
+        self.assertEqual(self.client.get(reverse('search'), {'q': 'frozen', 'kind': 'truck'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('search-autocomplete'), {'q': 'fro', 'limit': 'x'}).status_code, 400)
+
+
+class GeoTests(TestCase):
+
+    def setUp(self):
+        self.world = create_world()
+        jobs.Worker(queues=['geocoding']).work_off()
+        self.world['origin'].refresh_from_db()
+        self.world['destination'].refresh_from_db()
+        self.cargo = create_cargo(self.world)
+        create_pickup(self.world, self.cargo)
+
+    def test_geohash(self):
+        self.assertEqual(geo.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertTrue(geo.encode(25.762, -80.192).startswith(geo.encode(25.762, -80.192, 4)))
+        self.assertAlmostEqual(geo.distance(25.762, -80.192, 27.951, -82.457), 204, delta=3)
+
+    def test_facilities_are_geocoded_once_per_address(self):
+        origin = self.world['origin']
+        self.assertAlmostEqual(origin.latitude, 25.762, delta=0.05)
+        self.assertAlmostEqual(origin.longitude, -80.192, delta=0.05)
+        self.assertEqual(origin.geohash, geo.encode(origin.latitude, origin.longitude))
+
+        with mock.patch.object(geo.StubGeocoder, 'geocode', wraps=geo.geocoder().geocode) as geocode:
+            Facility.objects.create(name='Dock 2', company=self.world['shipper_co'], address=' 23 MAIN ST,  Miami, FL')
+            origin.save()  # Unchanged address: nothing queued
+            self.assertEqual(jobs.Worker(queues=['geocoding']).work_off(), (1, 0))
+            self.assertFalse(geocode.called)
+        self.assertEqual(Facility.objects.get(name='Dock 2').geohash, origin.geohash)
+
+        origin.address = 'Nowhere in particular'
+        origin.save()
+        jobs.Worker(queues=['geocoding']).work_off()
+        origin.refresh_from_db()
+        self.assertEqual((origin.latitude, origin.longitude, origin.geohash), (None, None, ''))
+        self.assertEqual(GeocodeResult.objects.count(), 3)
+
+    def test_google_geocoder(self):
+        def answer(data):
+            return mock.patch('urllib.request.urlopen', return_value=io.BytesIO(json.dumps(data).encode()))
+        geocoder = geo.GoogleGeocoder(api_key='key')
+        with answer({'status': 'OK', 'results': [{'geometry': {'location': {'lat': 25.7, 'lng': -80.1}}}]}) as urlopen:
+            self.assertEqual(geocoder.geocode('23 Main St, Miami'), (25.7, -80.1))
+        self.assertIn('address=23+Main+St%2C+Miami', urlopen.call_args[0][0])
+        with answer({'status': 'ZERO_RESULTS', 'results': []}):
+            self.assertIsNone(geocoder.geocode('Nowhere'))
+        with answer({'status': 'OVER_QUERY_LIMIT', 'results': []}), self.assertRaises(geo.GeocodingError):
+            geocoder.geocode('23 Main St, Miami')
+
+    def test_within_matches_a_full_scan(self):
+        rnd = random.Random(7)
+        for number in range(300):
+            latitude, longitude = rnd.uniform(24, 49), rnd.uniform(-125, -67)
+            Facility.objects.filter(pk=Facility.objects.create(name=str(number), address='-', company=self.world['shipper_co']).pk).update(
+                latitude=latitude, longitude=longitude, geohash=geo.encode(latitude, longitude))
+        located = list(Facility.objects.filter(latitude__isnull=False))
+        for _ in range(20):
+            latitude, longitude, radius = rnd.uniform(24, 49), rnd.uniform(-125, -67), rnd.choice([10, 100, 400])
+            expected = sorted(f.pk for f in located if geo.distance(latitude, longitude, f.latitude, f.longitude) <= radius)
+            self.assertEqual(sorted(f.pk for f in geo.within(latitude, longitude, radius)), expected)
+
+    def test_nearest(self):
+        orlando = (28.538, -81.379)
+        self.assertEqual([f.name for f in geo.nearest(*orlando, limit=1)], ['Main office'])  # Tampa
+        self.assertEqual([f.name for f in geo.nearest(*orlando, limit=5)], ['Main office', 'Storage 23'])
+        self.assertEqual(geo.nearest(*orlando, limit=5, max_radius=50), [])
+
+    def test_open_cargos_near_a_point_and_along_a_lane(self):
+        miami, tampa, orlando = (25.762, -80.192), (27.951, -82.457), (28.538, -81.379)
+        self.assertEqual([c.pk for c in geo.cargos_near(*miami, 50)], [self.cargo.pk])
+        self.assertEqual(geo.cargos_near(*orlando, 50), [])
+        self.assertEqual([c.pk for c in geo.cargos_along(miami, orlando, 100)], [self.cargo.pk])
+        self.assertEqual(geo.cargos_along(orlando, miami, 100), [])  # The other way
+        self.assertEqual(geo.cargos_along(miami, (25.5, -80.4), 100), [])  # Tampa is off that lane
+        self.assertLess(geo.lane_offset(tampa, miami, orlando)[0], 100)
+
+        Cargo.objects.filter(pk=self.cargo.pk).transition('n')
+        self.assertEqual(geo.cargos_near(*miami, 50), [])
+
+    def test_views(self):
+        response = self.client.get(reverse('nearby-cargos'), {'near': '25.76,-80.19', 'radius': '50'})
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.cargo.pk])
+        response = self.client.get(reverse('nearby-cargos'), {'near': '25.76,-80.19', 'to': '28.54,-81.38'})
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.cargo.pk])
+        response = self.client.get(reverse('nearby-facilities'), {'near': '27.95,-82.45', 'limit': '1'})
+        self.assertEqual([row['name'] for row in response.json()['results']], ['Main office'])
+        for params in ({}, {'near': 'x'}, {'near': '95,0'}, {'near': '25,-80', 'radius': '-1'}):
+            self.assertEqual(self.client.get(reverse('nearby-cargos'), params).status_code, 400)
+
+
+class MatchingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.world = create_world()
+        self.orlando = Facility.objects.create(name='Orlando DC', company=self.world['shipper_co'], address='Orlando, FL')
+        self.seattle = Facility.objects.create(name='Seattle DC', company=self.world['shipper_co'], address='Seattle, WA')
+        jobs.Worker(queues=['geocoding']).work_off()
+        self.driver = self.world['driver']
+        matching.report_location(self.driver, 25.77, -80.2)  # Miami
+        self.in_six_hours = timezone.now() + datetime.timedelta(hours=6)
+
+    def load(self, description, price, pickup_from, deliver_to, loaded=None, **kwargs):
+        cargo = create_cargo(self.world, description=description, price=price, **kwargs)
+        create_pickup(self.world, cargo, pickup_from=pickup_from, deliver_to=deliver_to, loaded=loaded or self.in_six_hours)
+        return cargo
+
+    def test_best_paying_reachable_loads_first(self):
+        origin, destination = self.world['origin'], self.world['destination']
+        short = self.load('Miami to Tampa', 1000, origin, destination)
+        from_orlando = self.load('Orlando to Tampa', 1500, self.orlando, destination)
+        self.load('Already loaded', 5000, origin, destination, loaded=timezone.now() - datetime.timedelta(hours=5))
+        self.load('Too far', 9000, self.seattle, destination, loaded=timezone.now() + datetime.timedelta(days=9))
+        self.load('In euros', Money(9000, 'EUR'), origin, destination)
+        self.load('No pickup location', 9000, Facility.objects.create(name='Nowhere', address='?'), destination)
+
+        best = matching.matches([self.driver])[self.driver.pk]
+        # 1500 over ~205 miles of deadhead and ~80 loaded pays more per mile than 1000 over ~204 loaded
+        self.assertEqual([match['cargo'] for match in best], [from_orlando.pk, short.pk])
+        self.assertLess(best[1]['deadhead'], 5)
+        self.assertAlmostEqual(best[1]['loaded_miles'], 204, delta=5)
+        self.assertAlmostEqual(best[1]['rate_per_mile'], 1000 / (best[1]['deadhead'] + best[1]['loaded_miles']), places=2)
+        self.assertEqual(matching.matches([self.world['dispatcher']]), {self.world['dispatcher'].pk: []})  # Not located
+
+    def test_vectorized_scores_match_a_plain_computation(self):
+        rnd = random.Random(3)
+        count = 300
+        loads = {
+            'cargo': np.arange(count),
+            'price': np.array([rnd.uniform(200, 5000) for _ in range(count)]),
+            'loaded': np.array([timezone.now().timestamp() + rnd.uniform(-3, 48) * 3600 for _ in range(count)]),
+        }
+        pickups = [(rnd.uniform(25, 48), rnd.uniform(-120, -70)) for _ in range(count)]
+        deliveries = [(rnd.uniform(25, 48), rnd.uniform(-120, -70)) for _ in range(count)]
+        loads['latitude'], loads['longitude'] = np.radians(np.array(pickups).T)
+        loads['cos_latitude'] = np.cos(loads['latitude'])
+        loads['loaded_miles'] = np.array([geo.distance(*p, *d) for p, d in zip(pickups, deliveries)])
+        trucks = [(rnd.uniform(25, 48), rnd.uniform(-120, -70)) for _ in range(matching.TRUCK_BATCH + 5)]
+        now = timezone.now()
+
+        for truck, best in zip(trucks, matching.score(loads, trucks, limit=5, now=now)):
+            expected = []
+            for index, pickup in enumerate(pickups):
+                deadhead = geo.distance(*truck, *pickup)
+                hours = (loads['loaded'][index] - now.timestamp()) / 3600 - deadhead / matching.AVERAGE_SPEED
+                if deadhead <= matching.MAX_DEADHEAD and hours >= -matching.LATE_TOLERANCE:
+                    expected.append(((loads['price'][index] - matching.WAIT_COST * max(hours, 0)) / (deadhead + loads['loaded_miles'][index]), index))
+            expected = [index for _, index in sorted(expected, reverse=True)[:5]]
+            self.assertEqual([match['cargo'] for match in best], expected)
+
+    def test_matches_are_cached_until_a_status_or_location_changes(self):
+        cargo = self.load('Miami to Tampa', 1000, self.world['origin'], self.world['destination'])
+        self.assertEqual(len(matching.matches([self.driver])[self.driver.pk]), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(matching.matches([self.driver])[self.driver.pk]), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Cargo.objects.filter(pk=cargo.pk).transition('n')
+        self.assertEqual(matching.matches([self.driver])[self.driver.pk], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other = self.load('Orlando to Tampa', 1500, self.orlando, self.world['destination'])
+        self.assertEqual([match['cargo'] for match in matching.matches([self.driver])[self.driver.pk]], [other.pk])
+
+        self.client.force_login(self.driver.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('report-location'), {'location': '47.6,-122.3'})  # Seattle
+        self.assertEqual(response.status_code, 200)
+        self.driver.refresh_from_db()
+        self.assertEqual(matching.matches([self.driver])[self.driver.pk], [])
+        self.assertEqual(self.client.post(reverse('report-location'), {'location': 'here'}).status_code, 400)
+
+    def test_view(self):
+        cargo = self.load('Miami to Tampa', 1000, self.world['origin'], self.world['destination'])
+        self.client.force_login(self.world['dispatcher'].user)
+        response = self.client.get(reverse('load-matches'))
+        self.assertContains(response, cargo.get_absolute_url())
+        self.assertContains(response, 'Juan Diaz')
+        self.assertNotContains(response, 'Pepe Gomez')  # No location
+        self.client.force_login(User.objects.create_user('outsider'))
+        self.assertEqual(self.client.get(reverse('load-matches')).status_code, 403)
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        self.world = create_world()
+        self.staff = User.objects.create_user('ops', password='w12sdQd!', is_staff=True)
+
+    def value(self, name, **labels):
+        values, _ = metrics.collect()
+        return values.get((name, tuple(sorted(labels.items()))), 0)
+
+    def test_requests_and_queries_are_recorded(self):
+        key = ('cargo_http_request_queries', (('view', 'cargos'),))
+        before = self.value('cargo_http_requests_total', view='cargos', method='GET', status='200')
+        counts_before, total_before = metrics.collect()[1].get(key, [[0], 0])
+        self.client.get(reverse('cargos'))
+        self.assertEqual(self.value('cargo_http_requests_total', view='cargos', method='GET', status='200'), before + 1)
+        counts, total = metrics.collect()[1][key]
+        self.assertEqual(sum(counts), sum(counts_before) + 1)
+        self.assertGreater(total, total_before)
+
+    @override_settings(CARGO_DUPLICATE_QUERY_THRESHOLD=3)
+    def test_repeated_queries_are_reported(self):
+        def n_plus_one(request):
+            for employee in Employee.objects.all():
+                employee.user.username  # One query per employee
+            return HttpResponse()
+
+        middleware = metrics.MetricsMiddleware(n_plus_one)
+        before = self.value('cargo_http_duplicate_queries_total', view='unresolved')
+        with self.assertLogs('cargo.metrics', 'WARNING') as logs:
+            middleware(RequestFactory().get('/'))
+        self.assertEqual(self.value('cargo_http_duplicate_queries_total', view='unresolved'), before + 1)
+        self.assertIn('ran the same query 3 times', logs.output[0])
+
+        def joined(request):
+            for employee in Employee.objects.select_related('user'):
+                employee.user.username
+            return HttpResponse()
+
+        metrics.MetricsMiddleware(joined)(RequestFactory().get('/'))
+        self.assertEqual(self.value('cargo_http_duplicate_queries_total', view='unresolved'), before + 1)
+
+    def test_async_requests_are_recorded(self):
+        async def view(request):
+            return HttpResponse(status=204)
+
+        before = self.value('cargo_http_requests_total', view='unresolved', method='GET', status='204')
+        middleware = metrics.MetricsMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        async_to_sync(middleware)(AsyncRequestFactory().get('/'))
+        self.assertEqual(self.value('cargo_http_requests_total', view='unresolved', method='GET', status='204'), before + 1)
+
+    @override_settings(CARGO_METRICS_TOKEN='s3cret')
+    def test_page(self):
+        jobs.enqueue(rollups.refresh_all, queue='metrics-test')
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('# TYPE cargo_http_request_duration_seconds histogram', text)
+        self.assertIn('cargo_jobs_waiting{queue="metrics-test"} 1', text)
+        self.assertIn('cargo_cache_hits_total ', text)
+        self.assertIn('cargo_http_request_duration_seconds_bucket{le="+Inf",view="metrics"}', text)
+
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+    def test_processes_are_added_up(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        other = {
+            'values': [['cargo_http_requests_total', [['method', 'GET'], ['status', '200'], ['view', 'cargos']], 1000],
+                       ['cargo_db_pool_connections', [['database', 'default'], ['state', 'idle']], 7]],
+            'histograms': [],
+        }
+        with open(directory + '/metrics-1.json', 'w') as f:
+            json.dump(other, f)
+        with override_settings(CARGO_METRICS_DIR=directory):
+            before = self.value('cargo_http_requests_total', view='cargos', method='GET', status='200')
+            self.assertGreaterEqual(before, 1000)
+            self.assertEqual(self.value('cargo_db_pool_connections', database='default', state='idle'), 7)
+            self.client.get(reverse('cargos'))
+            self.assertEqual(self.value('cargo_http_requests_total', view='cargos', method='GET', status='200'), before + 1)
+
+            # An exited process' counters still count, its gauges no longer do
+            stale = time.time() - metrics.STALE_GAUGES - 1
+            os.utime(directory + '/metrics-1.json', (stale, stale))
+            self.assertEqual(self.value('cargo_http_requests_total', view='cargos', method='GET', status='200'), before + 1)
+            self.assertEqual(self.value('cargo_db_pool_connections', database='default', state='idle'), 0)
+
+
+class ProfilingTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_slow_requests_are_saved(self):
+        create_world()
+        with override_settings(CARGO_PROFILE_SAMPLE_RATE=1, CARGO_PROFILE_SLOW=0, CARGO_PROFILE_DIR=self.directory):
+            self.client.get(reverse('cargos'))
+        names = sorted(os.listdir(self.directory))
+        self.assertEqual(len(names), 2)
+        self.assertTrue(names[0].endswith('-cargos-' + names[0].rsplit('-', 1)[1]))
+        self.assertEqual([name.rsplit('.', 1)[1] for name in names], ['folded', 'prof'])
+
+        with override_settings(CARGO_PROFILE_SAMPLE_RATE=1, CARGO_PROFILE_SLOW=60, CARGO_PROFILE_DIR=self.directory):
+            self.client.get(reverse('cargos'))
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+    def test_only_the_newest_are_kept(self):
+        for day in range(1, 6):
+            for extension in ('.prof', '.folded'):
+                open(os.path.join(self.directory, '2026010{0}-000000-cargos-5ms{1}'.format(day, extension)), 'w').close()
+        profiling.prune(self.directory, 2)
+        self.assertEqual(sorted(os.listdir(self.directory)), [
+            '20260104-000000-cargos-5ms.folded', '20260104-000000-cargos-5ms.prof',
+            '20260105-000000-cargos-5ms.folded', '20260105-000000-cargos-5ms.prof',
+        ])
+
+    def test_stacks_are_sampled(self):
+        sampler = profiling.StackSampler(threading.get_ident(), interval=0.001)
+        sampler.start()
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            pass
+        sampler.stop()
+        self.assertTrue(sampler.stacks)
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in sampler.folded().splitlines()))
+        self.assertIn('cargo.tests:test_stacks_are_sampled', sampler.folded())
+
+
+class SeedingTests(TestCase):
+
+    def seed(self, cargos=60):
+        return seeding.seed(cargos, seed=7, end=datetime.date(2026, 3, 1), days=30, batch_size=25)
+
+    def test_rows_are_consistent(self):
+        counts = self.seed()
+        self.assertEqual(counts['Cargo'], 60)
+        self.assertEqual(Cargo.objects.count(), 60)
+        self.assertEqual(PickupOrder.objects.count(), counts['PickupOrder'])
+        self.assertEqual(Lumper.objects.count(), counts['Lumper'])
+        counter = counters.current()
+        self.assertEqual({name: getattr(counter, name) for name in counters.compute()}, counters.compute())
+        for cargo in Cargo.objects.select_related('broker__company__type', 'dispatcher', 'driver'):
+            self.assertEqual(cargo.broker.company.type.type, 'Brokerage')
+            steps = list(cargo.events.values_list('to_status', flat=True))
+            self.assertEqual(steps, ['n', 'a', 'o', 'd'][:'pnaod'.index(cargo.status)])
+            if cargo.status != 'p':
+                self.assertEqual(cargo.dispatcher.company_id, getattr(cargo.driver, 'company_id', cargo.dispatcher.company_id))
+            self.assertTrue(cargo.pickuporder_set.exists())
+            self.assertLessEqual(cargo.updated, timezone.make_aware(datetime.datetime(2026, 3, 1)))
+        self.assertFalse(Facility.objects.filter(geohash='').exists())
+        self.assertEqual(SearchDocument.objects.filter(kind='cargo').count(), 60)
+        self.assertTrue(self.client.login(username=Employee.objects.first().user.username, password=seeding.PASSWORD))
+
+        # New ids continue after the seeded ones
+        last = Company.objects.order_by('-pk')[0].pk
+        self.assertGreater(Company.objects.create(name='Late Corp', type=CompanyType.objects.first()).pk, last)
+
+    def test_same_seed_same_data(self):
+        def rows():
+            return list(Cargo.objects.order_by('pk').values_list('description', 'price', 'price_currency', 'status', 'posted', 'delivered'))
+
+        self.seed()
+        first = rows()
+        Lumper.objects.all().delete()
+        PickupOrder.objects.all().delete()
+        CargoEvent.objects.all().delete()
+        Cargo.objects.all().delete()
+        self.seed()
+        self.assertEqual(rows(), first)
+
+
+class BenchmarkTests(TestCase):
+
+    def setUp(self):
+        seeding.seed(30, seed=1, end=datetime.date(2026, 3, 1), days=30)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_run(self):
+        results = benchmarks.run(['index', 'cargo-detail', 'admin-cargos'], workers=1, requests=5, warmup=1)
+        self.assertEqual(set(results), {'index', 'cargo-detail', 'admin-cargos'})
+        for result in results.values():
+            self.assertEqual(result['errors'], 0)
+            self.assertGreater(result['throughput'], 0)
+            self.assertLessEqual(result['p50'], result['p99'])
+        self.assertGreater(results['admin-cargos']['queries'], 0)
+
+    def test_compare(self):
+        baseline = {'cargo-list': {'throughput': 100.0, 'p50': 10.0, 'p99': 20.0, 'queries': 2.0, 'errors': 0}}
+        same = {'cargo-list': {'throughput': 90.0, 'p50': 11.0, 'p99': 24.0, 'queries': 2.4, 'errors': 0}}
+        self.assertEqual(benchmarks.compare(same, baseline), [])
+        worse = {'cargo-list': {'throughput': 70.0, 'p50': 13.0, 'p99': 30.0, 'queries': 3.0, 'errors': 1}}
+        self.assertEqual(len(benchmarks.compare(worse, baseline)), 5)
+
+    def test_command(self):
+        path = os.path.join(self.directory, 'baseline.json')
+        options = {'scenarios': 'cargo-detail,brokers', 'workers': 1, 'requests': 4, 'warmup': 1, 'host': 'testserver', 'baseline': path}
+        call_command('benchmark', save=True, stdout=io.StringIO(), **options)
+        saved = benchmarks.load_baseline(path)
+        self.assertEqual(saved['conditions']['cargos'], 30)
+        self.assertEqual(set(saved['scenarios']), {'cargo-detail', 'brokers'})
+
+        # A page that ran fewer queries before
+        saved['scenarios']['cargo-detail']['queries'] = 0
+        for result in saved['scenarios'].values():
+            result['p50'] = result['p99'] = 1000.0
+            result['throughput'] = 0.1
+        with open(path, 'w') as f:
+            json.dump(saved, f)
+        with self.assertRaisesMessage(CommandError, 'cargo-detail: '):
+            call_command('benchmark', stdout=io.StringIO(), **options)
+        saved['scenarios']['cargo-detail']['queries'] = 100
+        with open(path, 'w') as f:
+            json.dump(saved, f)
+        out = io.StringIO()
+        call_command('benchmark', stdout=out, **options)
+        self.assertIn('No regressions', out.getvalue())
+
+
+class SnapshotTests(TestCase):
+
+    def setUp(self):
+        seeding.seed(40, seed=3, end=datetime.date(2026, 3, 1), days=30)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'cargo.snapshot.gz')
+
+    def rows(self):
+        return {
+            'cargos': list(Cargo.objects.order_by('pk').values_list('pk', 'description', 'price', 'price_currency', 'status', 'posted', 'delivered', 'broker_id', 'driver_id')),
+            'pickups': list(PickupOrder.objects.order_by('pk').values_list('pk', 'cargo_id', 'pickup_from_id', 'loaded', 'updated')),
+            'lumpers': list(Lumper.objects.order_by('pk').values_list('pk', 'price', 'requested', 'paid')),
+            'facilities': list(Facility.objects.order_by('pk').values_list('pk', 'name', 'latitude', 'geohash')),
+            'users': list(User.objects.order_by('pk').values_list('pk', 'username', 'password', 'is_staff', 'date_joined')),
+            'events': CargoEvent.objects.count(),
+            'revenue': list(CompanyRevenueDaily.objects.order_by('pk').values_list('company_id', 'day', 'role', 'total', 'currency')),
+        }
+
+    def test_round_trip(self):
+        before = self.rows()
+        User.objects.create_superuser('root', 'root@example.com', 'w12sdQd!')  # Not an employee: stays out
+        counts = snapshots.dump(self.path)
+        self.assertEqual(counts['cargo.cargo'], 40)
+        self.assertEqual(counts['auth.user'], Employee.objects.count())
+        self.assertEqual(list(counts)[:4], ['auth.user', 'cargo.companytype', 'cargo.company', 'cargo.facility'])
+
+        Cargo.objects.filter(pk=before['cargos'][0][0]).update(description='Changed since the snapshot')
+        cache.set('stale', 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(snapshots.restore(self.path, replace=True, batch_size=7), counts)
+        self.assertEqual(self.rows(), before)
+        self.assertIsNone(cache.get('stale'))
+
+        # The search index and the sequences follow the restored rows
+        description = before['cargos'][0][1]
+        self.assertIn(before['cargos'][0][0], [document.object_id for document in search.search(description, kinds=['cargo'], limit=100)])
+        last = Company.objects.order_by('-pk')[0].pk
+        self.assertGreater(Company.objects.create(name='Late Corp', type=CompanyType.objects.first()).pk, last)
+
+    def test_restore_needs_empty_tables(self):
+        snapshots.dump(self.path)
+        with self.assertRaisesMessage(snapshots.SnapshotError, 'not empty'):
+            snapshots.restore(self.path)
+        self.assertEqual(Cargo.objects.count(), 40)
+
+    def test_dependency_order(self):
+        order = snapshots.snapshot_models()
+        self.assertNotIn(Job, order)
+        for before, after in [(User, Employee), (CompanyType, Company), (Company, Facility), (Company, Employee),
+                              (Employee, Cargo), (Cargo, PickupOrder), (Facility, PickupOrder), (PickupOrder, Lumper)]:
+            self.assertLess(order.index(before), order.index(after))
+
+    def test_commands(self):
+        call_command('dump_snapshot', self.path, stdout=io.StringIO())
+        out = io.StringIO()
+        call_command('restore_snapshot', self.path, replace=True, stdout=out)
+        self.assertIn('Restored', out.getvalue())
+        with open(self.path, 'wb') as f:
+            f.write(b'not a snapshot')
+        with self.assertRaises(CommandError):
+            call_command('restore_snapshot', self.path, replace=True, stdout=io.StringIO())
+
+    def test_copy_format(self):
+        stream = snapshots._CopyStream(iter([[1, None, True, 'tab\there', 'new\nline \\ back'], [2, '', False, '2026-03-01 10:00:00', b'\x01']]))
+        self.assertEqual(stream.read(10) + stream.read(), '1\t\\N\tt\ttab\\there\tnew\\nline \\\\ back\n2\t\tf\t2026-03-01 10:00:00\t\\\\x01\n')
+        self.assertEqual(stream.count, 2)
+
+
+class ArchiveTests(TestCase):
+
+    def setUp(self):
+        self.world = create_world()
+        long_ago = timezone.now() - datetime.timedelta(days=400)
+        self.old = create_cargo(self.world, 'Old load', dispatcher=self.world['dispatcher'], status='d', delivered=long_ago)
+        CargoEvent.objects.create(cargo=self.old, from_status='o', to_status='d', occurred=long_ago, employee=self.world['driver'])
+        self.pickup = create_pickup(self.world, self.old, loaded=long_ago, delivered=long_ago)
+        self.lumper = Lumper.objects.create(pickup_order=self.pickup, price=Money(75, 'USD'), paid=long_ago)
+        self.recent = create_cargo(self.world, 'Recent load', status='d', delivered=timezone.now() - datetime.timedelta(days=10))
+        self.open = create_cargo(self.world, 'Open load')
+        create_pickup(self.world, self.open)
+        call_command('refresh_rollups', lag=0, stdout=io.StringIO())
+
+    def test_moves_old_delivered_cargos(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(archive.archive(365, batch_size=1), 1)
+        self.assertEqual(list(Cargo.objects.order_by('pk').values_list('pk', flat=True)), [self.recent.pk, self.open.pk])
+        self.assertFalse(PickupOrder.objects.filter(pk=self.pickup.pk).exists())
+        self.assertFalse(Lumper.objects.exists())
+        self.assertFalse(CargoEvent.objects.filter(cargo_id=self.old.pk).exists())
+
+        archived = ArchivedCargo.objects.get(pk=self.old.pk)
+        self.assertEqual((archived.description, archived.price, archived.dispatcher, archived.delivered), ('Old load', self.old.price, self.world['dispatcher'], self.old.delivered))
+        self.assertIsNotNone(archived.archived)
+        self.assertEqual(list(archived.events.values_list('to_status', 'employee')), [('d', self.world['driver'].pk)])
+        self.assertEqual(list(archived.pickuporder_set.values_list('pk', flat=True)), [self.pickup.pk])
+        self.assertEqual(ArchivedLumper.objects.get().pickup_order_id, self.pickup.pk)
+        self.assertEqual(archive.lookup(self.old.pk), archived)
+        self.assertEqual(archive.lookup(self.open.pk), self.open)
+        self.assertNotIn(self.old.pk, [document.object_id for document in search.search('Old load', kinds=['cargo'])])
+
+        # Nothing left to archive
+        self.assertEqual(archive.archive(365), 0)
+
+    def test_counters_and_rollups_keep_archived_rows(self):
+        counts = counters.compute()
+        revenue = sorted(CompanyRevenueDaily.objects.values_list('company_id', 'role', 'currency', 'total', 'cargos'))
+        lumper_costs = list(FacilityLumperCostDaily.objects.values_list('facility_id', 'total', 'lumpers'))
+        archive.archive(365)
+
+        self.assertEqual(counters.compute(), counts)
+        for name in rollups.ROLLUPS:
+            rollups.ROLLUPS[name].rebuild(lag=datetime.timedelta(0))
+        self.assertEqual(sorted(CompanyRevenueDaily.objects.values_list('company_id', 'role', 'currency', 'total', 'cargos')), revenue)
+        self.assertEqual(list(FacilityLumperCostDaily.objects.values_list('facility_id', 'total', 'lumpers')), lumper_costs)
+
+    def test_detail_page_shows_archived_cargo(self):
+        url = reverse('cargo-detail', args=[self.old.pk])
+        self.assertContains(self.client.get(url), 'Storage 23')
+        with self.captureOnCommitCallbacks(execute=True):
+            archive.archive(365)
+        response = self.client.get(url)
+        self.assertContains(response, 'Old load')
+        self.assertContains(response, '75.00')
+        self.assertEqual(self.client.get(reverse('cargo-detail', args=[self.old.pk + 100])).status_code, 404)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('archive_cargos', dry_run=True, stdout=out)
+        self.assertIn('1 cargos would be archived', out.getvalue())
+        call_command('archive_cargos', days=5, stdout=out)
+        self.assertIn('Archived 2 cargos', out.getvalue())
+        self.assertEqual(ArchivedCargo.objects.count(), 2)
@@ -1,12 +1,33 @@
+from django.conf import settings
 from django.urls import path
 from cargo import views
+from cargo.offload import offloaded
+
+# The read-heavy views, as async views under ASGI (see cargo.offload)
+read_view = offloaded if settings.CARGO_ASYNC_VIEWS else (lambda view: view)
 
 
 urlpatterns = [
-    path('', views.index, name='index'),
-    path('cargos/', views.CargoListView.as_view(), name='cargos'),
-    path('cargo/<int:pk>', views.CargoDetailView.as_view(), name='cargo-detail'),
-    path('cargos-available/', views.CargoAvailableListView.as_view(), name='cargos-available'),
+    path('', read_view(views.index), name='index'),
+    path('cargos/', read_view(views.CargoListView.as_view()), name='cargos'),
+    path('cargo/<int:pk>', read_view(views.CargoDetailView.as_view()), name='cargo-detail'),
+    path('cargos/import/', views.import_cargos, name='cargo-import'),
+    path('exports/<slug:kind>.<slug:format>', views.export, name='export'),
+    path('reports/revenue/', views.revenue_report, name='revenue-report'),
+    path('reports/lumper-costs/', views.lumper_cost_report, name='lumper-cost-report'),
+    path('api/<slug:resource>/', read_view(views.api_list), name='api-list'),
+    path('api/<slug:resource>/<int:pk>', read_view(views.api_detail), name='api-detail'),
+    path('search/', read_view(views.search), name='search'),
+    path('search/autocomplete/', read_view(views.search_autocomplete), name='search-autocomplete'),
+    path('facilities/nearby/', read_view(views.nearby_facilities), name='nearby-facilities'),
+    path('cargos-available/nearby/', read_view(views.nearby_cargos), name='nearby-cargos'),
+    path('matches/', views.load_matches, name='load-matches'),
+    path('location/', views.report_location, name='report-location'),
+    path('metrics/', views.metrics_page, name='metrics'),
+    path('cache-stats/', views.cache_stats, name='cache-stats'),
+    path('pool-stats/', views.pool_stats, name='pool-stats'),
+    path('cargos-available/', read_view(views.CargoAvailableListView.as_view()), name='cargos-available'),
+    path('cargos-available/updates/', views.cargo_updates, name='cargo-updates'),
     path('brokers/', views.BrokerListView.as_view(), name='brokers'),
     path('carriers/', views.CarrierListView.as_view(), name='carriers'),
     path('company/<int:pk>', views.CompanyDetailView.as_view(), name='company-detail'),
@@ -1,11 +1,39 @@
+import codecs
+import os
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
 from django.shortcuts import render, get_object_or_404
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.core.exceptions import PermissionDenied
 from django.views import generic
+from django.views.decorators.http import require_POST
+from django.contrib.auth.decorators import login_required, permission_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.contrib import messages
 from django.urls import reverse_lazy
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare
 
-from cargo.models import Cargo, PickupOrder, Company, Employee
+from cargo.models import Cargo, PickupOrder, Company, Employee, CompanyRevenueDaily, SearchDocument, ArchivedCargo, ArchivedPickupOrder
 from cargo.forms import CreateEmployeeForm
+from cargo import counters
+from cargo.pagination import CursorPaginationMixin, InvalidCursor
+from cargo.importers import CargoImporter, FORMATS, read_rows
+from cargo import exports
+from cargo import rollups
+from cargo import caching
+from cargo import visits
+from cargo import api
+from cargo import live
+from cargo import onboarding
+from cargo import geo
+from cargo import matching
+from cargo import metrics
+from cargo import search as searching
+from cargomonitoring.pooled_postgresql import pool
 
 # Create your views here.
 
@@ -13,41 +41,353 @@ from cargo.forms import CreateEmployeeForm
 def index(request):
     """View function for home page of site."""
 
-    # Generate counts of some of the main objects
-    num_cargos = Cargo.objects.all().count()
-    num_pickuporders = PickupOrder.objects.all().count()
-    
-    # Available books (status = 'a')
-    num_cargos_available = Cargo.objects.filter(status__exact='p').count()
-    
-    # Amount of Brokerage companies (type = 'brokerage')
-    # The 'all()' is implied by default.    
-    num_brokerages = Company.objects.filter(type__type__iexact='brokerage').count()
-    
-    # Amount of Carriers companies (type = 'carrier')
-    num_carriers = Company.objects.filter(type__type__iexact='carrier').count()
+    # Counts of some of the main objects, precomputed in a single row (see cargo.counters)
+    counter = counters.current()
 
-    # Number of visits to this view, as counted in the session variable.
-    num_visits = request.session.get('num_visits', 0)
-    request.session['num_visits'] = num_visits + 1
-
-    
     context = {
-        'num_cargos': num_cargos,
-        'num_pickuporders': num_pickuporders,
-        'num_cargos_available': num_cargos_available,
-        'num_brokerages': num_brokerages,
-        'num_carriers': num_carriers,
-        'num_visits': num_visits,
+        'num_cargos': counter.num_cargos,
+        'num_pickuporders': counter.num_pickuporders,
+        'num_cargos_available': counter.num_cargos_available,
+        'num_brokerages': counter.num_brokerages,
+        'num_carriers': counter.num_carriers,
     }
 
+    # Number of visits to this view, counted in a signed cookie and in memory (see cargo.visits),
+    # so viewing the page does not write to the session or the database.
+    num_visits = visits.visitor_count(request)
+    context['num_visits'] = num_visits
+    visits.counter.record('index')
+
     # Render the HTML template index.html with the data in the context variable
-    return render(request, 'index.html', context=context)
+    response = render(request, 'index.html', context=context)
+    visits.set_visitor_count(response, num_visits + 1)
+    return response
+
+
+@require_POST
+@permission_required('cargo.add_cargo', raise_exception=True)
+def import_cargos(request):
+    """
+    View function for the bulk load-board import. Expects a CSV or JSONL upload in 'file'
+    (see cargo.importers for the columns) and answers with the import counts and rejected rows.
+    """
+    upload = request.FILES.get('file')
+    if upload is None:
+        return JsonResponse({'error': "Upload the load-board file in the 'file' field."}, status=400)
+    format = request.POST.get('format') or os.path.splitext(upload.name)[1].lstrip('.').lower()
+    if format not in FORMATS:
+        return JsonResponse({'error': 'Unknown format {0!r}, expected one of {1}.'.format(format, ', '.join(FORMATS))}, status=400)
+
+    try:
+        result = CargoImporter().run(read_rows(codecs.iterdecode(upload, 'utf-8'), format))
+    except UnicodeDecodeError:
+        return JsonResponse({'error': 'The file is not UTF-8 encoded.'}, status=400)
+    return JsonResponse(result.as_dict(), status=400 if result.errors and not result.cargos else 201)
+
+
+def export(request, kind, format):
+    """
+    View function streaming an accounting export (cargos, pickups or lumpers) as CSV or NDJSON,
+    filtered with the 'from'/'to' dates and the cargo 'status' query parameters.
+    """
+    if kind not in exports.EXPORTS or format not in exports.FORMATS:
+        raise Http404('Unknown export.')
+    the_export = exports.EXPORTS[kind]
+    if not request.user.has_perm('cargo.view_{0}'.format(the_export.model._meta.model_name)):
+        raise PermissionDenied
+    try:
+        filters = exports.parse_filters(request.GET)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    response = StreamingHttpResponse(exports.stream(the_export, format, **filters), content_type=exports.FORMATS[format])
+    response['Content-Disposition'] = 'attachment; filename="{0}.{1}"'.format(kind, format)
+    return response
+
+
+@permission_required('cargo.view_companyrevenuedaily', raise_exception=True)
+def revenue_report(request):
+    """
+    View function for the revenue per company and currency between the 'from' and 'to' dates,
+    optionally only as brokerage ('role=b') or carrier ('role=c'). Reads the daily rollups
+    (see cargo.rollups), so it is as fresh as their last refresh.
+    """
+    try:
+        filters = exports.parse_filters({key: request.GET.get(key) for key in ('from', 'to')})
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    role = request.GET.get('role')
+    if role and role not in dict(CompanyRevenueDaily.ROLES):
+        return HttpResponseBadRequest('Invalid role {0!r}'.format(role))
+    return JsonResponse({'revenue': list(rollups.revenue(role=role, **filters))})
+
+
+@permission_required('cargo.view_facilitylumpercostdaily', raise_exception=True)
+def lumper_cost_report(request):
+    """
+    View function for the lumper cost per pickup facility and currency between the 'from' and
+    'to' dates. Reads the daily rollups (see cargo.rollups).
+    """
+    try:
+        filters = exports.parse_filters({key: request.GET.get(key) for key in ('from', 'to')})
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    return JsonResponse({'lumper_costs': list(rollups.lumper_costs(**filters))})
+
+
+@staff_member_required
+def cache_stats(request):
+    """
+    View function with the cache hit and miss counts of the process that answers it.
+    """
+    return JsonResponse(caching.stats())
+
+
+@staff_member_required
+def pool_stats(request):
+    """
+    View function with the database connection pool metrics of the process that answers it
+    (empty unless the pooled backend is enabled).
+    """
+    return JsonResponse(pool.stats())
+
+
+def metrics_page(request):
+    """
+    View function for the request, cache, pool and job metrics in the Prometheus text format
+    (see cargo.metrics), for staff users or clients with the CARGO_METRICS_TOKEN bearer token.
+    """
+    token = settings.CARGO_METRICS_TOKEN
+    authorized = token and constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer ' + token)
+    if not (authorized or (request.user.is_active and request.user.is_staff)):
+        raise PermissionDenied
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def api_list(request, resource):
+    """
+    View function for a page of an API resource (see cargo.api), as JSON. Answers 304 Not
+    Modified, after a single aggregate query, when the client's ETag is still current.
+    """
+    resource = _api_resource(request, resource)
+    try:
+        names = resource.projection(request.GET.get('fields'))
+        limit = api.limit(request.GET)
+        queryset = resource.queryset(request.GET)
+        updated, count = resource.version(queryset)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    tag = api.etag(request, updated, count)
+    response = get_conditional_response(request, etag=tag, last_modified=api.last_modified(updated))
+    if response is not None:
+        return api.set_validators(response, tag, updated)
+
+    try:
+        page = resource.paginator(queryset, names, limit).page(request.GET.get('cursor'))
+    except InvalidCursor:
+        return HttpResponseBadRequest('Invalid page cursor.')
+    params = request.GET.copy()
+    links = {}
+    for name, cursor in (('next', page.next_cursor), ('previous', page.previous_cursor)):
+        if cursor:
+            params['cursor'] = cursor
+            links[name] = request.build_absolute_uri('?' + params.urlencode())
+        else:
+            links[name] = None
+    data = dict(links, results=[resource.serialize(row, names) for row in page.object_list])
+    return api.set_validators(JsonResponse(data), tag, updated)
 
 
-class CargoListView(generic.ListView):
+def api_detail(request, resource, pk):
+    """
+    View function for one object of an API resource (see cargo.api), as JSON, with the same
+    conditional GET handling as api_list.
+    """
+    resource = _api_resource(request, resource)
+    try:
+        names = resource.projection(request.GET.get('fields'))
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    queryset = resource.model.objects.filter(pk=pk)
+    updated, count = resource.version(queryset)
+    if not count:
+        raise Http404('No {0} with id {1}.'.format(resource.model._meta.verbose_name, pk))
+    tag = api.etag(request, updated, count)
+    response = get_conditional_response(request, etag=tag, last_modified=api.last_modified(updated))
+    if response is not None:
+        return api.set_validators(response, tag, updated)
+    row = resource.rows(queryset, names).get()
+    return api.set_validators(JsonResponse(resource.serialize(row, names)), tag, updated)
+
+
+def search(request):
+    """
+    View function for the search page: the best matches for 'q' (see cargo.search), optionally
+    only of some kinds ('kind' may be repeated).
+    """
+    try:
+        kinds, limit = _search_params(request, 20)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    query = request.GET.get('q', '').strip()
+    context = {
+        'query': query,
+        'kinds': kinds,
+        'kind_choices': SearchDocument.KINDS,
+        'results': searching.search(query, kinds, limit) if query else [],
+    }
+    return render(request, 'cargo/search.html', context=context)
+
+
+def search_autocomplete(request):
+    """
+    View function for as-you-type suggestions: the titles matching the prefix 'q', as JSON.
+    """
+    try:
+        kinds, limit = _search_params(request, 10)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    return JsonResponse({'suggestions': searching.autocomplete(request.GET.get('q', ''), kinds, limit)})
+
+
+def nearby_facilities(request):
+    """
+    View function for the facilities nearest to the point 'near' (latitude,longitude), at most
+    'radius' miles away, as JSON.
+    """
+    try:
+        point = geo.parse_point(request.GET.get('near'))
+        radius = _miles(request.GET.get('radius'), geo.MAX_RADIUS)
+        limit = api.limit(request.GET)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    facilities = geo.nearest(*point, limit=limit, max_radius=radius)
+    return JsonResponse({'results': [
+        {'id': facility.pk, 'name': facility.name, 'company': facility.company_id, 'address': facility.address,
+         'latitude': facility.latitude, 'longitude': facility.longitude, 'distance': round(facility.distance, 1)}
+        for facility in facilities
+    ]})
+
+
+def nearby_cargos(request):
+    """
+    View function for the open cargos picked up within 'radius' miles (default 100) of the point
+    'near' or, with a 'to' point too, picked up and delivered along the lane from 'near' to 'to'.
+    As JSON, nearest first.
+    """
+    try:
+        point = geo.parse_point(request.GET.get('near'))
+        destination = geo.parse_point(request.GET['to']) if request.GET.get('to') else None
+        radius = _miles(request.GET.get('radius'), 100)
+        limit = api.limit(request.GET)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    queryset = Cargo.objects.only('id', 'description', 'price', 'price_currency', 'status')
+    if destination:
+        cargos = geo.cargos_along(point, destination, radius, queryset)
+    else:
+        cargos = geo.cargos_near(*point, radius, queryset=queryset)
+    return JsonResponse({'results': [
+        {'id': cargo.pk, 'description': cargo.description, 'price': str(cargo.price.amount),
+         'price_currency': str(cargo.price.currency), 'url': cargo.get_absolute_url(), 'distance': round(cargo.distance, 1)}
+        for cargo in cargos[:limit]
+    ]})
+
+
+@login_required
+def load_matches(request):
+    """
+    View function for the best open loads for each located truck of the current user's
+    company (optionally only the 'driver' given), scored by cargo.matching.
+    """
+    company_id = Employee.objects.filter(user=request.user).values_list('company_id', flat=True).first()
+    if company_id is None:
+        raise PermissionDenied
+    drivers = Employee.objects.with_names().filter(company=company_id, latitude__isnull=False)
+    try:
+        limit = int(request.GET.get('limit', 5))
+        if request.GET.get('driver'):
+            drivers = drivers.filter(pk=int(request.GET['driver']))
+    except ValueError:
+        return HttpResponseBadRequest('Invalid limit or driver')
+    drivers = list(drivers)
+    best = matching.matches(drivers, min(max(limit, 1), 50))
+    cargos = Cargo.objects.in_bulk({match['cargo'] for found in best.values() for match in found})
+    trucks = [
+        (driver, [dict(match, cargo=cargos[match['cargo']]) for match in best[driver.pk] if match['cargo'] in cargos])
+        for driver in drivers
+    ]
+    return render(request, 'cargo/load_matches.html', context={'trucks': trucks})
+
+
+@require_POST
+@login_required
+def report_location(request):
+    """
+    View function for a driver's app reporting where the truck is, as 'location'=latitude,longitude.
+    """
+    employee = Employee.objects.filter(user=request.user).first()
+    if employee is None:
+        raise PermissionDenied
+    try:
+        latitude, longitude = geo.parse_point(request.POST.get('location'))
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    matching.report_location(employee, latitude, longitude)
+    return JsonResponse({'latitude': latitude, 'longitude': longitude})
+
+
+async def cargo_updates(request):
+    """
+    View function for the load board's long poll (see cargo.live). Answers with the cargo events
+    after the 'after' cursor as soon as there are any, or with none after CARGO_LIVE_TIMEOUT
+    seconds; 'reload' tells the client it missed events and must reload the page.
+    """
+    events, cursor = await live.wait(request.GET.get('after'))
+    return JsonResponse({'cursor': cursor, 'events': events or [], 'reload': events is None})
+
+
+def _search_params(request, default_limit):
+    kinds = request.GET.getlist('kind')
+    unknown = set(kinds) - set(dict(SearchDocument.KINDS))
+    if unknown:
+        raise ValueError('Invalid kind {0!r}'.format(sorted(unknown)[0]))
+    try:
+        limit = int(request.GET.get('limit', default_limit))
+    except ValueError:
+        raise ValueError('Invalid limit')
+    return kinds, min(max(limit, 1), 100)
+
+
+def _miles(value, default):
+    if not value:
+        return default
+    try:
+        miles = float(value)
+    except ValueError:
+        raise ValueError('Invalid radius {0!r}'.format(value))
+    if not 0 < miles <= geo.MAX_RADIUS:
+        raise ValueError('The radius must be between 0 and {0} miles'.format(geo.MAX_RADIUS))
+    return miles
+
+
+def _api_resource(request, name):
+    """
+    The API resource with the given name, which the user needs the view permission of its model to read.
+    """
+    try:
+        resource = api.RESOURCES[name]
+    except KeyError:
+        raise Http404('Unknown API resource {0!r}.'.format(name))
+    if not request.user.has_perm('cargo.view_{0}'.format(resource.model._meta.model_name)):
+        raise PermissionDenied
+    return resource
+
+
+class CargoListView(CursorPaginationMixin, generic.ListView):
     model = Cargo
     paginate_by = 5
+    cursor_ordering = ('-posted', '-id')  # Keyset pagination, backed by the cargo_posted_id_idx index
 
     def get_context_data(self, **kwargs):
         # Call the base implementation first to get the context
@@ -58,38 +398,67 @@ class CargoListView(generic.ListView):
 
 
 class CargoAvailableListView(CargoListView):
-    queryset = Cargo.objects.filter(status__exact='p')[:15] # Get 15 available cargos 
+    queryset = Cargo.objects.filter(status__exact='p') # Available cargos, paged through with the cursor
     #template_name = 'cargo/cargo_available_list.html'  # Specify your own template name/location
     
     def get_context_data(self, **kwargs):
+        # Taken before the cargos are read, so no change made in between is missed
+        live_cursor = live.broker.cursor()
         # Call the base implementation first to get the context
         context = super(CargoAvailableListView, self).get_context_data(**kwargs)
+        context['live_cursor'] = live_cursor
         # Create any data and add it to the context
         context['page_title'] = 'Available Cargo List'
         return context
 
 
-class CompanyListlView(generic.ListView):
+class CompanyListlView(CursorPaginationMixin, generic.ListView):
     model = Company
     paginate_by = 5
+    cursor_ordering = ('name',)  # Company names are unique, so the name alone is a valid keyset
 
-class BrokerListView(CompanyListlView):
+class BrokerListView(caching.CachedPageMixin, CompanyListlView):
+    cache_kind = 'companies'
     context_object_name = 'broker_list'   # your own name for the list as a template variable
-    queryset = Company.objects.filter(type__type__iexact='brokerage')[:15] # Get 15 brokers 
+    queryset = Company.objects.filter(type__type__iexact='brokerage') # Brokers, paged through with the cursor
     template_name = 'cargo/broker_list.html'  # Specify your own template name/location
 
 
-class CarrierListView(CompanyListlView):
+class CarrierListView(caching.CachedPageMixin, CompanyListlView):
+    cache_kind = 'companies'
     context_object_name = 'carrier_list'   # your own name for the list as a template variable
-    queryset = Company.objects.filter(type__type__iexact='carrier')[:15] # Get 15 carriers
+    queryset = Company.objects.filter(type__type__iexact='carrier') # Carriers, paged through with the cursor
     template_name = 'cargo/carrier_list.html'  # Specify your own template name/location
 
 
-class CargoDetailView(generic.DetailView):
+class CargoDetailView(caching.CachedObjectMixin, generic.DetailView):
     model = Cargo
+    cache_kind = 'cargo'
+    template_name = 'cargo/cargo_detail.html'
+    context_object_name = 'cargo'
+    # The template renders the broker and its company, and the pickup orders with their lumpers
+    queryset = Cargo.objects.with_parties().prefetch_related(
+        Prefetch('pickuporder_set', queryset=PickupOrder.objects.with_facilities()),
+        'pickuporder_set__lumper_set',
+    )
+    archive_queryset = ArchivedCargo.objects.with_parties().prefetch_related(
+        Prefetch('pickuporder_set', queryset=ArchivedPickupOrder.objects.with_facilities()),
+        'pickuporder_set__lumper_set',
+    )
+
+    def get_object(self, queryset=None):
+        try:
+            return super(CargoDetailView, self).get_object(queryset)
+        except Http404:
+            if queryset is not None:
+                raise
+            # Delivered cargos are moved to the archive after a while (see cargo.archive) and keep their page
+            return super(CargoDetailView, self).get_object(self.archive_queryset)
 
-class CompanyDetailView(generic.DetailView):
+class CompanyDetailView(caching.CachedObjectMixin, generic.DetailView):
     model = Company
+    cache_kind = 'company'
+    queryset = Company.objects.select_related('type')
 
 
 # class CargosPostedByBrokerageListView(LoginRequiredMixin,generic.ListView):
@@ -102,17 +471,17 @@ class CompanyDetailView(generic.DetailView):
 #         return Cargo.objects.filter(broker=self.request.user).filter(status__exact='p').order_by('-posted')
 
 
-class EmployeesByCompanyListView(PermissionRequiredMixin, generic.ListView):
+class EmployeesByCompanyListView(PermissionRequiredMixin, CursorPaginationMixin, generic.ListView):
     """Generic class-based view listing books on loan to current user."""
     model = Employee
     template_name ='cargo/employee_list_by_company.html'
     paginate_by = 10
+    cursor_ordering = ('id',)
     permission_required = ('cargo.view_employee')
     
     def get_queryset(self):
-        the_employee = Employee.objects.get(user=self.request.user)
-        the_company  = Company.objects.get(pk=the_employee.company.id)
-        return Employee.objects.filter(company=the_company)
+        # Employees of the current user's company, with the user and company each one renders
+        return Employee.objects.with_names().filter(company__employee__user=self.request.user)
 
 
 class CreateEmployeeView(PermissionRequiredMixin, generic.CreateView):
@@ -121,7 +490,7 @@ class CreateEmployeeView(PermissionRequiredMixin, generic.CreateView):
     template_name       = 'cargo/employee_create.html'
     permission_required = ('cargo.add_employee')
     success_url         = reverse_lazy('employees-by-company')
-    success_message     = 'New employee has been created. The password has been emailed to the employee email address.'
+    success_message     = 'New employee has been created. An email with a link to choose a password has been sent to the employee email address.'
     
     def get_form_kwargs(self):
         kwargs = super(CreateEmployeeView, self).get_form_kwargs()
@@ -129,21 +498,20 @@ class CreateEmployeeView(PermissionRequiredMixin, generic.CreateView):
         return kwargs
 
     def form_valid(self, form):
-        cxt   = {'form': form, }
-        user  = form.save(commit=False)
         # Cleaned(normalized) data
         phone = form.cleaned_data['phone']
-        # password = form.cleaned_data['password']
-        # repeat_password = form.cleaned_data['repeat_password']
-        # if password != repeat_password:
-        #     messages.error(self.request, "Passwords do not Match", extra_tags='alert alert-danger')
-        #     return render(self.request, self.template_name, cxt)
-        user.set_password('w12sdQd!')
-        user.save()
- 
-        # Create Employee model
-        manager  = Employee.objects.get(user=self.request.user)
-        the_company  = Company.objects.get(pk=manager.company.id)
-        Employee.objects.create(user=user, phone=phone, company=the_company)
- 
-        return super(CreateEmployeeView, self).form_valid(form)
\ No newline at end of file
+        # The new employee works in the company of the one adding them
+        company_id = Employee.objects.filter(user=self.request.user).values_list('company_id', flat=True).first()
+        if company_id is None:
+            raise PermissionDenied('Only employees of a company can add employees to it.')
+
+        with transaction.atomic():
+            user = form.save(commit=False)
+            # No password until the employee chooses one through the emailed link
+            user.set_unusable_password()
+            user.save()
+            Employee.objects.create(user=user, phone=phone, company_id=company_id)
+            onboarding.welcome(user, self.request.get_host(), self.request.is_secure())
+        self.object = user
+        # Not super().form_valid(), which would save the user a second time
+        return HttpResponseRedirect(self.get_success_url())
\ No newline at end of file
@@ -0,0 +1,118 @@
+"""
+Visit counting without a database write per page view.
+
+Each visitor's own count travels in a signed cookie (see visitor_count), so it
+needs neither the session nor the database. The site-wide counts per page and
+day are added up in memory, per process, and a background thread adds them to
+VisitCount every settings.VISIT_FLUSH_INTERVAL seconds with one UPDATE (or
+INSERT) per page and day. Counts are also flushed when the process exits; a
+crash loses at most one interval's worth. An interval of 0 writes each visit
+synchronously (useful for tests).
+"""
+import atexit
+import collections
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from cargo.models import VisitCount
+
+logger = logging.getLogger(__name__)
+
+COOKIE_NAME = 'num_visits'
+COOKIE_SALT = 'cargo.visits'
+COOKIE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def visitor_count(request):
+    """
+    Returns the number of earlier visits of the visitor, from the signed cookie.
+    """
+    try:
+        return int(request.get_signed_cookie(COOKIE_NAME, default=0, salt=COOKIE_SALT))
+    except (signing.BadSignature, ValueError):
+        return 0
+
+
+def set_visitor_count(response, visits):
+    """
+    Stores the visitor's number of visits in the signed cookie.
+    """
+    response.set_signed_cookie(COOKIE_NAME, visits, salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE, httponly=True, samesite='Lax')
+
+
+class VisitCounter(object):
+    """
+    In-memory visit counts per (page, day), flushed to VisitCount in batches.
+    """
+
+    def __init__(self):
+        self.pending = collections.Counter()
+        self.lock    = threading.Lock()
+        self.thread  = None
+
+    def record(self, page):
+        with self.lock:
+            self.pending[page, timezone.localdate()] += 1
+            if settings.VISIT_FLUSH_INTERVAL and self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='cargo-visits', daemon=True)
+                self.thread.start()
+                atexit.register(self._flush_at_exit)
+        if not settings.VISIT_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """
+        Adds the pending counts to the database. Returns the number of visits written.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, collections.Counter()
+        if not pending:
+            return 0
+        try:
+            with transaction.atomic():
+                for (page, day), count in sorted(pending.items()):
+                    _add(page, day, count)
+        except Exception:
+            # Put them back for the next flush
+            with self.lock:
+                self.pending.update(pending)
+            raise
+        return sum(pending.values())
+
+    def _run(self):
+        while True:
+            time.sleep(settings.VISIT_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing the visit counts failed')
+            finally:
+                # The thread opens its own connection; do not keep it open between flushes
+                connection.close()
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Flushing the visit counts at exit failed')
+
+
+def _add(page, day, count):
+    if VisitCount.objects.filter(page=page, day=day).update(count=F('count') + count):
+        return
+    try:
+        with transaction.atomic():
+            VisitCount.objects.create(page=page, day=day, count=count)
+    except IntegrityError:
+        # Another process created the row in the meantime
+        VisitCount.objects.filter(page=page, day=day).update(count=F('count') + count)
+
+
+counter = VisitCounter()
@@ -0,0 +1,20 @@
+"""
+ASGI config for cargomonitoring project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Served this way, the read-heavy views run on their own thread pool (see
+cargo.offload) and the load board's long poll waits without holding a thread.
+See gunicorn.conf.py for how to run it.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cargomonitoring.settings')
+os.environ.setdefault('CARGO_ASYNC_VIEWS', '1')
+
+application = get_asgi_application()
@@ -0,0 +1,8 @@
+"""
+PostgreSQL database backend whose connections come from a per-process pool.
+
+Enabled from the environment (see DB_POOL_MAX_SIZE in settings). Each process
+keeps at most MAX_SIZE connections per database however many threads it runs,
+checks idle connections before handing them out, and records how long requests
+wait for a connection and how full the pool is (see pool.stats()).
+"""
@@ -0,0 +1,85 @@
+"""
+The pooled PostgreSQL DatabaseWrapper.
+
+Pool settings go in DATABASES[alias]['POOL']: MIN_SIZE, MAX_SIZE, TIMEOUT
+(seconds to wait for a connection) and CHECK_INTERVAL (connections idle for
+longer are checked with a SELECT 1 before they are handed out). Use it with
+CONN_MAX_AGE = 0: closing the connection at the end of each request is what
+returns it to the pool.
+"""
+from functools import partial
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+from django.db.backends.postgresql import base
+
+from cargomonitoring.pooled_postgresql.pool import ConnectionPool, POOLS, POOLS_LOCK
+
+
+def check(connection):
+    """
+    Tells whether an idle connection still works.
+    """
+    if connection.closed:
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+    if connection.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        connection.rollback()
+    return True
+
+
+def reset(connection):
+    """
+    Gets a returned connection ready for its next user; tells whether it can be reused.
+    """
+    if connection.closed:
+        return False
+    status = connection.info.transaction_status
+    if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        connection.rollback()
+    return True
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_pool(self, conn_params):
+        with POOLS_LOCK:
+            pool = POOLS.get(self.alias)
+            if pool is None:
+                options = self.settings_dict.get('POOL', {})
+                pool = POOLS[self.alias] = ConnectionPool(
+                    partial(base.Database.connect, **conn_params),
+                    min_size=options.get('MIN_SIZE', 1),
+                    max_size=options.get('MAX_SIZE', 10),
+                    timeout=options.get('TIMEOUT', 5.0),
+                    check_interval=options.get('CHECK_INTERVAL', 10.0),
+                    check=check,
+                    reset=reset,
+                )
+        return pool
+
+    def get_new_connection(self, conn_params):
+        pool = self.get_pool(conn_params)
+        pool.fill()
+        connection = pool.getconn()
+        # Same per-connection setup as the stock backend, for new and reused connections alike
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                # Back to the pool instead of closing; a broken connection is dropped
+                POOLS[self.alias].putconn(self.connection, discard=self.errors_occurred and not self.is_usable())
@@ -0,0 +1,217 @@
+"""
+A thread-safe pool of DB-API connections with a checkout timeout, health
+checks on checkout and wait/saturation metrics.
+
+It does not depend on the database driver: the pool is given a function that
+opens a connection, one that tells whether an idle connection is still usable,
+and one that tells whether a returned connection can be reused.
+"""
+import threading
+import time
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no connection could be checked out within the pool's timeout.
+    """
+    pass
+
+
+class ConnectionPool(object):
+    """
+    Keeps between min_size and max_size connections open. getconn() hands out an
+    idle connection (checking its health first if it has been idle for more than
+    check_interval seconds), opens a new one if the pool is not full, or waits up
+    to timeout seconds for one to be returned.
+    """
+
+    def __init__(self, connect, min_size=1, max_size=10, timeout=5.0, check_interval=10.0, check=None, reset=None):
+        if not 0 <= min_size <= max_size or max_size < 1:
+            raise ValueError('Invalid pool size: min {0}, max {1}'.format(min_size, max_size))
+        self.connect        = connect
+        self.min_size       = min_size
+        self.max_size       = max_size
+        self.timeout        = timeout
+        self.check_interval = check_interval
+        self.check          = check or (lambda conn: True)
+        self.reset          = reset or (lambda conn: True)
+        self.idle    = []  # (connection, returned at) pairs, most recently returned last
+        self.in_use  = 0
+        self.opening = 0
+        self.lock = threading.Condition()
+        self.metrics = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'max_wait_time': 0.0,
+            'timeouts': 0,
+            'opened': 0,
+            'closed': 0,
+            'failed_checks': 0,
+        }
+
+    @property
+    def size(self):
+        return len(self.idle) + self.in_use + self.opening
+
+    def fill(self):
+        """
+        Opens connections until the pool holds min_size of them.
+        """
+        while True:
+            with self.lock:
+                if self.size >= self.min_size:
+                    return
+                self.opening += 1
+            try:
+                conn = self._open()
+            finally:
+                with self.lock:
+                    self.opening -= 1
+            self._put_idle(conn)
+
+    def getconn(self):
+        """
+        Checks out a connection, raising PoolTimeout if none is available in time.
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        while True:
+            with self.lock:
+                while not self.idle and self.size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.metrics['timeouts'] += 1
+                        raise PoolTimeout('No database connection available after {0} seconds ({1} in use)'.format(self.timeout, self.in_use))
+                    waited = True
+                    self.lock.wait(remaining)
+                if self.idle:
+                    conn, returned = self.idle.pop()
+                else:
+                    conn, returned = None, None
+                    self.opening += 1
+
+            if conn is None:
+                try:
+                    conn = self._open()
+                except Exception:
+                    with self.lock:
+                        self.opening -= 1
+                        self.lock.notify()
+                    raise
+                with self.lock:
+                    self.opening -= 1
+                    self.in_use += 1
+                    self._record_checkout(started, waited)
+                return conn
+            with self.lock:
+                self.in_use += 1
+            if time.monotonic() - returned <= self.check_interval or self._healthy(conn):
+                with self.lock:
+                    self._record_checkout(started, waited)
+                return conn
+            # Dead connection: drop it and try again
+            self._discard(conn, in_use=True)
+
+    def putconn(self, conn, discard=False):
+        """
+        Returns a checked out connection. It is closed instead if discard is True
+        or if it cannot be reset for the next user.
+        """
+        reusable = not discard and self._reusable(conn)
+        with self.lock:
+            self.in_use -= 1
+            keep = reusable and self.size < self.max_size
+            if keep:
+                self.idle.append((conn, time.monotonic()))
+            self.lock.notify()
+        if not keep:
+            self._close(conn)
+
+    def closeall(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn, _ in idle:
+            self._close(conn)
+
+    def stats(self):
+        """
+        Returns the pool's size, usage and wait metrics.
+        """
+        with self.lock:
+            stats = dict(self.metrics)
+            stats.update({
+                'size': self.size,
+                'idle': len(self.idle),
+                'in_use': self.in_use,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'saturation': self.in_use / self.max_size,
+                'average_wait_time': stats['wait_time'] / stats['checkouts'] if stats['checkouts'] else 0.0,
+            })
+        return stats
+
+    def _record_checkout(self, started, waited):
+        wait = time.monotonic() - started
+        self.metrics['checkouts'] += 1
+        self.metrics['wait_time'] += wait
+        self.metrics['max_wait_time'] = max(self.metrics['max_wait_time'], wait)
+        if waited:
+            self.metrics['waits'] += 1
+
+    def _open(self):
+        conn = self.connect()
+        with self.lock:
+            self.metrics['opened'] += 1
+        return conn
+
+    def _put_idle(self, conn):
+        with self.lock:
+            self.idle.append((conn, time.monotonic()))
+            self.lock.notify()
+
+    def _healthy(self, conn):
+        try:
+            healthy = self.check(conn)
+        except Exception:
+            healthy = False
+        if not healthy:
+            with self.lock:
+                self.metrics['failed_checks'] += 1
+        return healthy
+
+    def _reusable(self, conn):
+        try:
+            return self.reset(conn)
+        except Exception:
+            return False
+
+    def _discard(self, conn, in_use=False):
+        with self.lock:
+            if in_use:
+                self.in_use -= 1
+            self.lock.notify()
+        self._close(conn)
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self.lock:
+            self.metrics['closed'] += 1
+
+
+# The pools of this process, by database alias (filled by the pooled backend)
+POOLS = {}
+POOLS_LOCK = threading.Lock()
+
+
+def stats():
+    """
+    Returns the metrics of each pool of this process, by database alias.
+    """
+    with POOLS_LOCK:
+        pools = dict(POOLS)
+    return {alias: pool.stats() for alias, pool in pools.items()}
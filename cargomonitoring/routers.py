@@ -0,0 +1,131 @@
+"""
+Primary/replica database routing.
+
+Writes go to the 'default' (primary) database. Reads go round-robin to the
+replicas listed in settings.DATABASE_REPLICAS (see DATABASE_REPLICA_URLS in
+settings), except when they might not see a recent write:
+
+- inside a transaction on the primary, which must see its own writes;
+- for the rest of a request, once it has written to the primary;
+- for settings.DATABASE_REPLICA_LAG seconds after a client's last write, so
+  that the page it is redirected to shows what it just saved. The
+  PrimaryStickinessMiddleware remembers this in a cookie.
+
+Without replicas everything goes to the primary.
+"""
+import asyncio
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.local import Local
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+STICKY_COOKIE = 'use_primary'
+
+_state = Local()  # Per request (thread or async task): 'pinned' and 'wrote' flags
+_counter = itertools.count()
+_counter_lock = threading.Lock()
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def pinned():
+    """
+    Returns True if the reads of the current request must go to the primary.
+    """
+    return getattr(_state, 'pinned', False) or getattr(_state, 'wrote', False)
+
+
+@contextmanager
+def use_primary():
+    """
+    Sends the reads made inside the block to the primary.
+    """
+    previous = getattr(_state, 'pinned', False)
+    _state.pinned = True
+    try:
+        yield
+    finally:
+        _state.pinned = previous
+
+
+class PrimaryReplicaRouter(object):
+    """
+    Sends writes to the primary and reads round-robin to the replicas.
+    """
+
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if not aliases or pinned() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        with _counter_lock:
+            index = next(_counter)
+        return aliases[index % len(aliases)]
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        databases = {DEFAULT_DB_ALIAS} | set(replicas())
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema through replication
+        return db == DEFAULT_DB_ALIAS
+
+
+class PrimaryStickinessMiddleware(object):
+    """
+    Keeps a client's reads on the primary for DATABASE_REPLICA_LAG seconds after it wrote,
+    through a short-lived cookie, and resets the routing state between requests.
+    Works in both sync and async (ASGI) middleware chains.
+    """
+    sync_capable  = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Marks the instance as a coroutine function, as Django's MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        _state.pinned = _sticky(request)
+        _state.wrote = False
+        try:
+            return _remember_write(self.get_response(request))
+        finally:
+            _state.pinned = _state.wrote = False
+
+    async def __acall__(self, request):
+        _state.pinned = _sticky(request)
+        _state.wrote = False
+        try:
+            return _remember_write(await self.get_response(request))
+        finally:
+            _state.pinned = _state.wrote = False
+
+
+def _remember_write(response):
+    if _state.wrote and replicas():
+        lag = settings.DATABASE_REPLICA_LAG
+        response.set_cookie(STICKY_COOKIE, str(time.time() + lag), max_age=max(1, int(lag + 0.999)), httponly=True, samesite='Lax')
+    return response
+
+
+def _sticky(request):
+    try:
+        return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
@@ -0,0 +1,50 @@
+"""
+Gunicorn configuration, read from the working directory (or with -c gunicorn.conf.py).
+
+WSGI, with threaded sync workers:
+
+    gunicorn cargomonitoring.wsgi
+
+ASGI, with uvicorn workers (pip install uvicorn[standard]); the read-heavy
+views then run on a thread pool per worker (CARGO_ASYNC_VIEW_THREADS, see
+cargo.offload) and the load board's long polls wait without holding threads:
+
+    GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn cargomonitoring.asgi
+
+or uvicorn alone, e.g. in development (which does not read this file, so set
+the live backend yourself when running several workers):
+
+    CARGO_LIVE_BACKEND=postgresql uvicorn cargomonitoring.asgi:application --workers 4
+
+With more than one worker process, the load board updates must reach every
+process: CARGO_LIVE_BACKEND defaults to postgresql then, and starting with
+CARGO_LIVE_BACKEND=local is refused. So must the cache invalidations (see
+cargo.caching): starting with the local memory cache is refused too, so set
+CACHE_BACKEND/CACHE_LOCATION to a shared cache, and run the job workers
+('manage.py run_jobs') with the same ones, as the jobs invalidate pages too. Size DB_POOL_MAX_SIZE for the threads of
+one worker (each process has its own pool).
+
+To compare both, start each in turn and run the same load against it:
+
+    python manage.py loadtest --url http://127.0.0.1:8000 --path /cargo/cargos/ --workers 1,16,64 --requests 2000
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:8000')
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+# Read by the settings of the workers, which inherit the environment (see cargo.live)
+if workers > 1:
+    if os.environ.setdefault('CARGO_LIVE_BACKEND', 'postgresql') == 'local':
+        raise RuntimeError('CARGO_LIVE_BACKEND=local only reaches the process an update is made in; '
+                           'use postgresql with {0} workers, or GUNICORN_WORKERS=1'.format(workers))
+    if os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache').endswith('.LocMemCache'):
+        raise RuntimeError('The local memory cache is not shared by the worker processes, which would keep serving '
+                           'invalidated pages; set CACHE_BACKEND/CACHE_LOCATION to a shared cache with {0} workers, '
+                           'or GUNICORN_WORKERS=1'.format(workers))
+# Threads per worker for gthread, each also held by a waiting load board long poll (ignored by uvicorn workers)
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-')